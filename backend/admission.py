@@ -0,0 +1,238 @@
+"""Admission control: per-caller rate limits and a cap on expensive requests.
+
+A burst from one user, or a client stuck in a retry loop, shouldn't take
+every request thread and pooler connection from everyone else.
+
+Rate limits. Each caller has a token bucket per endpoint class:
+
+    read    GET and HEAD
+    write   every other method
+    login   views marked @rate_class("login")
+
+Callers are keyed by their JWT ``sub``. Requests without a valid token
+are keyed by client address, since some read endpoints (the catalog
+summary among them) don't require one. Login is keyed by address and the
+email posted, so one client can't lock someone else out by failing their
+login. The client address is the one PROXY_HOPS proxies in front of the
+app saw (X-Forwarded-For, counted from the right). Entries further left
+are whatever the client sent, and can be forged.
+
+RATE_LIMITS ("read=10/40,write=5/20,login=0.2/5") gives each class's
+refill rate in tokens per second and its bucket size, i.e. the burst a
+caller may send at once. A class left out is not limited. A request that
+finds its bucket empty gets 429 with Retry-After set to when the next token
+is due.
+
+Concurrency caps. Expensive views name a slot pool:
+
+    @concurrency_limited("export")
+
+and at most CONCURRENCY_LIMITS ("resumen=2,export=1,import=1") of a pool's
+requests run at once. Each kind of work gets its own pool, so a few
+minute-long exports can't hold the slots the catalog summary needs, and
+the expensive queries never pile up on the database. A streamed response
+keeps its slot until the body is fully sent. A request that finds its
+pool full waits in line for up to ADMISSION_QUEUE_TIMEOUT_MS, then gets
+503 with Retry-After. At most ADMISSION_QUEUE_MAX requests wait at a time,
+across pools, and any beyond that are turned away at once. Otherwise a
+burst would park every request thread in the queue and starve the cheap
+calls. The wait is part of the request deadline (timeouts.py). Time spent
+waiting is recorded in admission_wait_seconds, and current use per pool in
+admission_slots.
+
+Buckets and slots are per worker, like usercache.py. With W gunicorn
+workers, a caller whose requests are spread across all of them can go up
+to W times the configured rate.
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+
+import jwt
+from flask import current_app, g, jsonify, request
+
+import metrics
+
+RATE_LIMITED = metrics.counter(
+    "rate_limited_total", "Requests refused by the per-caller rate limit.", ("endpoint", "class"))
+ADMISSION_WAIT = metrics.histogram(
+    "admission_wait_seconds", "Time @concurrency_limited requests waited for a slot.",
+    ("endpoint",), metrics.LATENCY_BUCKETS)
+ADMISSION_REJECTED = metrics.counter(
+    "admission_rejected_total", "Requests turned away without a slot, and why.", ("endpoint", "reason"))
+SLOTS = metrics.gauge(
+    "admission_slots", "@concurrency_limited requests running and waiting, by pool.", ("pool", "state"))
+
+_buckets = OrderedDict()  # (class, key) -> [tokens, updated_at]
+_lock = threading.Lock()
+_pools = {}               # name -> _Pool, from CONCURRENCY_LIMITS
+_waiting = 0              # across pools
+
+
+class _Pool:
+    def __init__(self, size):
+        self.slots = threading.BoundedSemaphore(size)
+        self.running = 0
+        self.waiting = 0
+
+
+def rate_class(name):
+    """Put a view in rate-limit class ``name`` instead of read/write."""
+    def decorate(fn):
+        fn.rate_class = name
+        return fn
+    return decorate
+
+
+def concurrency_limited(pool):
+    """Run the view only in one of ``pool``'s slots (CONCURRENCY_LIMITS)."""
+    def decorate(fn):
+        fn.concurrency_pool = pool
+        return fn
+    return decorate
+
+
+# ---- Rate limits ------------------------------------------------------------
+
+def _client_address():
+    hops = current_app.config["PROXY_HOPS"]
+    if hops:
+        forwarded = [a.strip() for a in request.headers.get("X-Forwarded-For", "").split(",") if a.strip()]
+        if len(forwarded) >= hops:
+            return forwarded[-hops]
+    return request.remote_addr or "-"
+
+
+def _caller(cls):
+    address = _client_address()
+    if cls == "login":
+        data = request.get_json(silent=True) or {}
+        return f"{address} {str(data.get('email') or '').strip().lower()}"
+    auth = request.headers.get("Authorization", "")
+    if auth.lower().startswith("bearer "):
+        try:
+            claims = jwt.decode(auth.split(" ", 1)[1].strip(), current_app.config["JWT_SECRET"], algorithms=["HS256"])
+        except Exception:
+            claims = {}
+        sub = claims.get("sub") or claims.get("user_id")
+        if sub:
+            return f"user {sub}"
+    return address
+
+
+def _take(cls, key, rate, burst):
+    """Spend a token from ``key``'s bucket; seconds until one is due, or 0 when spent."""
+    now = time.monotonic()
+    k = (cls, key)
+    with _lock:
+        bucket = _buckets.get(k)
+        if bucket is None:
+            bucket = _buckets[k] = [burst, now]
+        else:
+            _buckets.move_to_end(k)
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            # An evicted bucket would have refilled anyway: it just starts full
+            while len(_buckets) > current_app.config["RATE_LIMIT_KEYS"]:
+                _buckets.popitem(last=False)
+            return 0
+        return (1 - bucket[0]) / rate if rate > 0 else math.inf
+
+
+def _rate_limit(view):
+    cls = getattr(view, "rate_class", None) or ("read" if request.method in ("GET", "HEAD") else "write")
+    limit = current_app.config["RATE_LIMITS"].get(cls)
+    if limit is None:
+        return None
+    wait = _take(cls, _caller(cls), *limit)
+    if not wait:
+        return None
+    RATE_LIMITED.inc((request.endpoint, cls))
+    resp = jsonify({"error": "Demasiadas solicitudes, intente de nuevo en unos segundos"})
+    resp.status_code = 429
+    resp.headers["Retry-After"] = str(max(1, math.ceil(min(wait, 3600))))
+    return resp
+
+
+# ---- Concurrency cap --------------------------------------------------------
+
+def _publish(name, pool):
+    SLOTS.set((name, "running"), pool.running)
+    SLOTS.set((name, "waiting"), pool.waiting)
+
+
+def _busy(reason):
+    ADMISSION_REJECTED.inc((request.endpoint, reason))
+    resp = jsonify({"error": "El servidor está ocupado, intente de nuevo"})
+    resp.status_code = 503
+    resp.headers["Retry-After"] = str(current_app.config["TIMEOUT_RETRY_AFTER"])
+    return resp
+
+
+def _acquire(name):
+    global _waiting
+    pool = _pools.get(name)
+    if pool is None:
+        return None  # pool left out of CONCURRENCY_LIMITS: not capped
+    if pool.slots.acquire(blocking=False):
+        got = True
+        ADMISSION_WAIT.observe((request.endpoint,), 0.0)
+        with _lock:
+            pool.running += 1
+            _publish(name, pool)
+    else:
+        with _lock:
+            full = _waiting >= current_app.config["ADMISSION_QUEUE_MAX"]
+            if not full:
+                _waiting += 1
+                pool.waiting += 1
+                _publish(name, pool)
+        if full:
+            return _busy("queue_full")
+        t0 = time.perf_counter()
+        got = pool.slots.acquire(timeout=current_app.config["ADMISSION_QUEUE_TIMEOUT_MS"] / 1000.0)
+        ADMISSION_WAIT.observe((request.endpoint,), time.perf_counter() - t0)
+        with _lock:
+            _waiting -= 1
+            pool.waiting -= 1
+            pool.running += got
+            _publish(name, pool)
+    if not got:
+        return _busy("timeout")
+    g.admission_pool = name
+    return None
+
+
+def _release(exc=None):
+    # Teardown: after a streamed body is fully sent (stream_with_context)
+    name = g.pop("admission_pool", None)
+    if name is None:
+        return
+    pool = _pools[name]
+    with _lock:
+        pool.running -= 1
+        _publish(name, pool)
+    pool.slots.release()
+
+
+# ---- Request hooks ----------------------------------------------------------
+
+def init_app(app):
+    _pools.clear()
+    _pools.update({name: _Pool(max(1, n)) for name, n in app.config["CONCURRENCY_LIMITS"].items()})
+
+    @app.before_request
+    def _admit():
+        if request.method == "OPTIONS" or request.endpoint is None:
+            return None
+        view = app.view_functions.get(request.endpoint)
+        resp = _rate_limit(view)
+        pool = getattr(view, "concurrency_pool", None)
+        if resp is None and pool is not None:
+            resp = _acquire(pool)
+        return resp
+
+    app.teardown_request(_release)
@@ -0,0 +1,323 @@
+"""ASGI entry point: async read endpoints, everything else through Flask.
+
+    uvicorn asgi:app --host 0.0.0.0 --port $PORT --workers 2
+    gunicorn -k uvicorn.workers.UvicornWorker -w 2 asgi:app
+
+(install requirements-asgi.txt first). The read-heavy routes below run on
+SQLAlchemy's asyncio engine with asyncpg, so a request waiting on Postgres
+holds a coroutine instead of one of the gthread worker's threads. They run
+the same compiled statements as the blueprints (statements.py) and encode
+through jsonio, so responses match the WSGI ones. Every other route,
+writes included, is served by the Flask app mounted underneath.
+
+GET /api/v1/eventos exists only here: a Server-Sent Events stream of
+inventory and order changes, fed by LISTEN on db.NOTIFY_CHANNEL. LISTEN
+needs a session, so it connects with DATABASE_URL and is disabled when that
+URL points at a transaction pooler.
+
+Browsers' EventSource can't set an Authorization header, so the stream also
+takes ?token= with a ticket from POST /api/v1/eventos/token. The ticket
+lasts SSE_TOKEN_SECONDS and is checked when the stream opens; an open
+stream outlives it. When a stream drops, EventSource reconnects with the
+same URL and gets 401 once the ticket has expired: the client then fetches
+a new ticket and opens a new EventSource.
+"""
+import asyncio
+import contextlib
+import json
+import time
+import uuid
+
+import asyncpg
+import jwt
+from a2wsgi import WSGIMiddleware
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import create_async_engine
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Mount, Route
+
+import db
+import jsonio
+import statements as stmts
+from app import CORS_ALLOWED, EVENTS_AUDIENCE, app as flask_app
+from blueprints.inventory import VERSION_HEADER, summary_query
+from blueprints.orders import order_detail_body
+
+config = flask_app.config
+
+
+def _async_url(url):
+    u = make_url(url).set(drivername="postgresql+asyncpg")
+    # asyncpg takes ssl=..., not libpq's sslmode=...
+    if "sslmode" in u.query:
+        u = u.update_query_dict({"ssl": u.query["sslmode"]}).difference_update_query(["sslmode"])
+    if stmts.is_transaction_pooler(url):
+        # PgBouncer in transaction mode can't keep asyncpg's named statements
+        u = u.update_query_dict({"prepared_statement_cache_size": "0"})
+    return u
+
+
+def _create_engine(url):
+    connect_args = {"timeout": config["DB_CONNECT_TIMEOUT"]}
+    if stmts.is_transaction_pooler(url):
+        connect_args["statement_cache_size"] = 0
+        connect_args["prepared_statement_name_func"] = lambda: f"__asyncpg_{uuid.uuid4()}__"
+    return create_async_engine(
+        _async_url(url),
+        pool_size=config["ASGI_DB_POOL_SIZE"],
+        max_overflow=0,
+        pool_pre_ping=True,
+        connect_args=connect_args,
+    )
+
+
+engine = _create_engine(config["DB_URL"])
+
+
+# ---- Helpers ----------------------------------------------------------------
+
+def json_response(obj, status=200, headers=None):
+    return Response(jsonio.dumps_bytes(obj), status_code=status, headers=headers, media_type="application/json")
+
+
+def _auth_user_id(request):
+    auth = request.headers.get("Authorization", "")
+    if not auth.lower().startswith("bearer "):
+        return None
+    token = auth.split(" ", 1)[1].strip()
+    try:
+        claims = jwt.decode(token, config["JWT_SECRET"], algorithms=["HS256"])
+        return claims.get("sub") or claims.get("user_id")
+    except Exception:
+        return None
+
+
+def _events_user_id(request):
+    token = request.query_params.get("token")
+    if not token:
+        return _auth_user_id(request)
+    try:
+        claims = jwt.decode(token, config["JWT_SECRET"], algorithms=["HS256"], audience=EVENTS_AUDIENCE)
+        return claims.get("sub")
+    except Exception:
+        return None
+
+
+async def _db_unavailable(request, exc):
+    print(f"[DB] {request.url.path}: {type(exc).__name__}: {exc}")
+    return json_response({"error": "Base de datos no disponible, intente de nuevo"}, 503, {"Retry-After": "5"})
+
+
+def _unauthorized():
+    return json_response({"error": "Unauthorized"}, 401)
+
+
+def _uuid_or_none(value):
+    try:
+        return str(uuid.UUID(str(value)))
+    except ValueError:
+        return None
+
+
+class ServerTiming:
+    """Pure ASGI middleware: Server-Timing app duration, as the WSGI side sends."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        t0 = time.perf_counter()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                if not any(k.lower() == b"server-timing" for k, _ in headers):
+                    dur = (time.perf_counter() - t0) * 1000
+                    headers.append((b"server-timing", f"app;dur={dur:.1f}".encode()))
+                    message["headers"] = headers
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+
+# ---- Read endpoints ---------------------------------------------------------
+
+async def inventory_summary(request):
+    stmt, params = summary_query(request.query_params)
+
+    read = {}
+
+    async def rows():
+        async with engine.connect() as conn:
+            read["version"] = (await conn.execute(stmts.CHANGES_VERSION.clause)).one().version
+            result = await conn.stream(stmt.clause, params)
+            async for row in result.mappings():
+                yield row
+
+    # First FETCH, and the version, before the 200 goes out (see jsonio.primed)
+    body = await jsonio.aprimed(jsonio.aiter_json_array(rows()))
+    return StreamingResponse(body, media_type="application/json", headers={VERSION_HEADER: str(read["version"])})
+
+
+async def list_orders(request):
+    if not _auth_user_id(request):
+        return _unauthorized()
+    async with engine.connect() as conn:
+        rows = (await conn.execute(stmts.ORDERS_LIST.clause)).mappings().all()
+    return json_response(rows)
+
+
+async def get_order(request):
+    if not _auth_user_id(request):
+        return _unauthorized()
+    pedido_id = _uuid_or_none(request.path_params["pedido_id"])
+    if pedido_id is None:
+        return json_response({"error": "Pedido no encontrado"}, 404)
+    async with engine.connect() as conn:
+        rows = (await conn.execute(stmts.ORDER_DETAIL.clause, {"id": pedido_id})).mappings().all()
+    if not rows:
+        return json_response({"error": "Pedido no encontrado"}, 404)
+    return json_response(order_detail_body(rows))
+
+
+async def list_clients(request):
+    if not _auth_user_id(request):
+        return _unauthorized()
+    q = (request.query_params.get("q") or "").strip()
+    try:
+        limit = max(1, min(int(request.query_params.get("limit") or 20), 50))
+    except ValueError:
+        return json_response({"error": "limit inválido"}, 400)
+    async with engine.connect() as conn:
+        if q:
+            result = await conn.execute(stmts.CLIENTS_SEARCH.clause, {"p": f"%{q.lower()}%", "lim": limit})
+        else:
+            result = await conn.execute(stmts.CLIENTS_LIST.clause, {"lim": limit})
+        rows = result.mappings().all()
+    return json_response(rows)
+
+
+# ---- SSE --------------------------------------------------------------------
+
+class EventHub:
+    """One LISTEN connection per process, fanned out to per-client queues."""
+
+    def __init__(self, url):
+        self.url = url
+        self.conn = None
+        self.subscribers = set()
+        self._lock = asyncio.Lock()
+
+    @property
+    def available(self):
+        return bool(self.url) and not stmts.is_transaction_pooler(self.url)
+
+    def _on_notify(self, connection, pid, channel, payload):
+        for q in list(self.subscribers):
+            if q.full():
+                q.get_nowait()  # slow client: drop its oldest event
+            q.put_nowait(payload)
+
+    async def _ensure_listening(self):
+        async with self._lock:
+            if self.conn is not None and not self.conn.is_closed():
+                return
+            dsn = make_url(self.url).set(drivername="postgresql").render_as_string(hide_password=False)
+            self.conn = await asyncpg.connect(dsn, timeout=config["DB_CONNECT_TIMEOUT"])
+            await self.conn.add_listener(db.NOTIFY_CHANNEL, self._on_notify)
+            print(f"[SSE] listening on {db.NOTIFY_CHANNEL}")
+
+    @contextlib.asynccontextmanager
+    async def subscribe(self):
+        await self._ensure_listening()
+        q = asyncio.Queue(maxsize=config["SSE_QUEUE_SIZE"])
+        self.subscribers.add(q)
+        try:
+            yield q
+        finally:
+            self.subscribers.discard(q)
+
+    async def close(self):
+        if self.conn is not None:
+            await self.conn.close()
+            self.conn = None
+
+
+hub = EventHub(config.get("DATABASE_URL"))
+
+
+async def events(request):
+    if not _events_user_id(request):
+        return _unauthorized()
+    if not hub.available:
+        return json_response({"error": "Eventos no disponibles"}, 503, {"Retry-After": "60"})
+    heartbeat = config["SSE_HEARTBEAT_SECONDS"]
+
+    async def stream():
+        try:
+            async with hub.subscribe() as q:
+                yield b"retry: 5000\n\n"
+                while True:
+                    try:
+                        payload = await asyncio.wait_for(q.get(), timeout=heartbeat)
+                    except asyncio.TimeoutError:
+                        if await request.is_disconnected():
+                            return
+                        yield b": ping\n\n"
+                        continue
+                    tipo = json.loads(payload).get("tipo") or "message"
+                    yield f"event: {tipo}\ndata: {payload}\n\n".encode()
+        except (OSError, SQLAlchemyError) as e:
+            print(f"[SSE] listener failed: {e}")
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# ---- App --------------------------------------------------------------------
+
+@contextlib.asynccontextmanager
+async def lifespan(_app):
+    # Same schema bootstrap as the WSGI workers; failures are retried lazily
+    # by the mounted Flask app on its first DB request.
+    try:
+        await asyncio.to_thread(db.warmup, flask_app)
+    except Exception as e:
+        print(f"[DB] warmup failed, will retry lazily: {e}")
+    yield
+    await hub.close()
+    await engine.dispose()
+
+
+app = Starlette(
+    routes=[
+        Route("/api/v1/inventario/resumen", inventory_summary, methods=["GET"]),
+        Route("/api/v1/pedidos", list_orders, methods=["GET"]),
+        Route("/api/v1/pedidos/{pedido_id}", get_order, methods=["GET"]),
+        Route("/api/v1/clientes", list_clients, methods=["GET"]),
+        Route("/api/v1/eventos", events, methods=["GET"]),
+        Mount("/", app=WSGIMiddleware(flask_app)),
+    ],
+    middleware=[
+        Middleware(ServerTiming),
+        Middleware(
+            CORSMiddleware,
+            allow_origins=CORS_ALLOWED,
+            allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
+            allow_headers=["Authorization", "Content-Type", db.WRITE_TOKEN_HEADER],
+            expose_headers=["Content-Type", db.WRITE_TOKEN_HEADER, VERSION_HEADER],
+            max_age=86400,
+        ),
+    ],
+    exception_handlers={SQLAlchemyError: _db_unavailable, OSError: _db_unavailable},
+    lifespan=lifespan,
+)
@@ -0,0 +1,8 @@
+"""Benchmarks for the API. Run from backend/, e.g. ``python -m bench.prepared``.
+
+End-to-end load: ``python -m bench.seed`` to fill a local database, then
+``python -m bench.load --output run.json`` against a running server, and
+``python -m bench.compare old.json run.json`` to compare two commits.
+``python -m bench.modes`` runs the read mix against the WSGI and ASGI
+servers side by side.
+"""
@@ -0,0 +1,193 @@
+"""Query-count budgets: fail when an endpoint runs more statements than it declares.
+
+    python -m bench.budgets [--url postgresql://...] [--verbose]
+
+Needs a database seeded with ``python -m bench.seed``. Every case below is
+sent through the Flask test client while a StatementRecorder counts the
+statements it runs. A case over its endpoint's ``@query_budget`` prints the
+statements it ran and the command exits 1. Batch item add runs at several
+batch sizes, so a count that grows with N fails here.
+"""
+import argparse
+import datetime
+import os
+import sys
+import uuid
+
+from sqlalchemy import text
+
+from bench.seed import BENCH_EMAIL, BENCH_PASSWORD
+
+BATCH_SIZES = (1, 10, 50)
+
+
+def _fixtures(conn):
+    fx = {}
+    fx["order_id"] = conn.execute(text(
+        "select pedido_id from public.pedido_items group by pedido_id order by count(*) desc limit 1"
+    )).scalar()
+    fx["client_id"] = conn.execute(text("select id from public.clientes limit 1")).scalar()
+    fx["products"] = conn.execute(text("""
+        select m.producto_id, p.referencia
+        from public.inventario_movimientos m
+        join public.productos p on p.id = m.producto_id
+        group by m.producto_id, p.referencia
+        having sum(case when m.clase='entrada' then m.cantidad else -m.cantidad end) > 10
+        limit :n
+    """), {"n": sum(BATCH_SIZES) + 1}).all()
+    # Delta sync token (changelog.py): the seed data is older, so the
+    # changes cases return what the budget run itself writes
+    fx["version"] = conn.execute(text("select pg_snapshot_xmin(pg_current_snapshot())::text::bigint")).scalar()
+    if not (fx["order_id"] and fx["client_id"] and len(fx["products"]) > sum(BATCH_SIZES)):
+        sys.exit("not enough seed data; run python -m bench.seed first")
+    return fx
+
+
+def _cases(fx, state):
+    """(label, method, path, body) — callables are resolved when the case runs, str bodies are CSV."""
+    today = datetime.date.today().isoformat()
+    tag = uuid.uuid4().hex[:8]
+    prods = fx["products"]
+    cases = [
+        ("me", "GET", "/api/v1/me", None),
+        ("update_prefs", "PUT", "/api/v1/users/me/prefs", {"prefs": {"colorMode": "light"}}),
+        ("admin_list_users", "GET", "/api/v1/admin/users", None),
+        ("admin_slow_queries", "GET", "/api/v1/admin/slow-queries", None),
+        ("events_token", "POST", "/api/v1/eventos/token", None),
+        ("inventory_summary", "GET", "/api/v1/inventario/resumen", None),
+        ("inventory_filtered", "GET", "/api/v1/inventario/resumen?f.color=azul&f.ancho=150", None),
+        ("inventory_facets", "GET", "/api/v1/inventario/facetas", None),
+        ("inventory_changes", "GET", f"/api/v1/inventario/cambios?since={fx['version']}", None),
+        ("availability", "POST", "/api/v1/inventario/disponibilidad", {
+            "productos": [str(pid) for pid, _ in prods[:10]] + [ref for _, ref in prods[10:20]],
+            "pedido_id": str(fx["order_id"]),
+        }),
+        ("orders_list", "GET", "/api/v1/pedidos", None),
+        ("orders_export", "GET", "/api/v1/pedidos/export?formato=csv&status=approved", None),
+        ("order_changes", "GET", f"/api/v1/pedidos/cambios?since={fx['version']}", None),
+        ("order_detail", "GET", f"/api/v1/pedidos/{fx['order_id']}", None),
+        ("sales_by_product", "GET", "/api/v1/reportes/ventas?por=producto", None),
+        ("sales_daily", "GET", "/api/v1/reportes/ventas?por=dia", None),
+        ("clients_list", "GET", "/api/v1/clientes", None),
+        ("clients_search", "GET", "/api/v1/clientes?q=cliente", None),
+        ("client_detail", "GET", f"/api/v1/clientes/{fx['client_id']}", None),
+        ("order_start", "POST", "/api/v1/pedidos/start", {
+            "cliente_id": str(fx["client_id"]), "fecha_entrega": today,
+        }),
+        ("orders_import", "POST", "/api/v1/pedidos/import", "pedido;cliente_id;fecha_entrega;referencia;cantidad\n" + "".join(
+            f"{n % 2};{fx['client_id']};{today};{ref};1\n" for n, (_, ref) in enumerate(prods[:20])
+        )),
+        ("item_add_by_ref", "POST", lambda: f"/api/v1/pedidos/{state['draft']}/items",
+         {"referencia": prods[0][1], "cantidad": 1}),
+    ]
+    offset = 1
+    for n in BATCH_SIZES:
+        lines = [{"producto_id": str(pid), "cantidad": 1} for pid, _ in prods[offset:offset + n]]
+        cases.append((f"item_add_batch_{n}", "POST", lambda: f"/api/v1/pedidos/{state['draft']}/items",
+                      {"items": lines}))
+        offset += n
+    cases += [
+        ("item_add_merge", "POST", lambda: f"/api/v1/pedidos/{state['draft']}/items",
+         {"items": [{"producto_id": str(pid), "cantidad": 1} for pid, _ in prods[:10]]}),
+        ("item_update", "PUT", lambda: f"/api/v1/pedidos/{state['draft']}/items/{state['item']}", {"cantidad": 1}),
+        ("item_delete", "DELETE", lambda: f"/api/v1/pedidos/{state['draft']}/items/{state['item']}", None),
+        ("order_submit", "POST", lambda: f"/api/v1/pedidos/{state['draft']}/submit", None),
+        ("order_approve", "POST", lambda: f"/api/v1/pedidos/{state['draft']}/approve", None),
+        ("order_delete", "DELETE", lambda: f"/api/v1/pedidos/{state['draft']}", None),
+        ("movement_create", "POST", "/api/v1/inventario/movimientos", {
+            "referencia": prods[0][1], "cantidad": 1, "clase": "entrada", "motivo": "ajuste",
+            "fecha_local": today, "hora_local": "08:00",
+        }),
+        ("product_create", "POST", "/api/v1/productos", {
+            "referencia": f"BUDGET-{tag}", "descripcion": "budget check", "precio_lista": 1,
+        }),
+        ("client_create", "POST", "/api/v1/clientes", {"nombre": f"Budget {tag}"}),
+        ("user_create", "POST", "/api/v1/admin/users", {
+            "nombre_completo": "Budget", "email": f"budget-{tag}@example.com", "password": "x", "profile": "viewer",
+        }),
+        ("user_delete", "DELETE", lambda: f"/api/v1/admin/users/{state['user']}", None),
+        ("job_enqueue", "POST", "/api/v1/jobs", {"tipo": "ledger_maintain"}),
+        ("job_get", "GET", lambda: f"/api/v1/jobs/{state['job']}", None),
+    ]
+    return cases
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--url", default=os.getenv("DATABASE_URL", ""))
+    ap.add_argument("--verbose", action="store_true", help="print statements for every case")
+    args = ap.parse_args(argv)
+    if not args.url:
+        sys.exit("DATABASE_URL (or --url) is required")
+
+    # Runner threads would claim the enqueued job on the recorded engine
+    os.environ["JOBS_WORKERS"] = "0"
+    # One user sends every case back to back: no rate limits
+    os.environ["RATE_LIMITS"] = ""
+    import db
+    db.use_url(args.url)
+    from app import app
+    from querybudget import StatementRecorder, budget_for, budgets
+
+    db.warmup(app)
+    engine = db.get_engine(app)
+    with engine.connect() as conn:
+        fx = _fixtures(conn)
+
+    client = app.test_client()
+    state = {}
+    failures = []
+    seen = set()
+    adapter = app.url_map.bind("localhost")
+
+    with StatementRecorder(engine) as rec:
+        login = client.post("/api/v1/auth/login", json={"email": BENCH_EMAIL, "password": BENCH_PASSWORD})
+        if login.status_code != 200:
+            sys.exit(f"bench login failed ({login.status_code})")
+        headers = {"Authorization": f"Bearer {login.get_json()['token']}"}
+        cases = [("login", "POST", "/api/v1/auth/login", {"email": BENCH_EMAIL, "password": BENCH_PASSWORD})]
+        cases += _cases(fx, state)
+
+        for label, method, path, body in cases:
+            path = path() if callable(path) else path
+            rec.reset()
+            # A str body is a CSV upload
+            payload = {"data": body, "content_type": "text/csv"} if isinstance(body, str) else {"json": body}
+            resp = client.open(path, method=method, headers=headers, **payload)
+            ran = rec.reset()
+            endpoint = adapter.match(path.split("?")[0], method=method)[0]
+            seen.add(endpoint)
+            budget = budget_for(app, endpoint)
+
+            data = resp.get_json(silent=True) or {}
+            if label == "order_start":
+                state["draft"] = data.get("pedido_id")
+            elif label == "item_add_by_ref":
+                state["item"] = data.get("item_id")
+            elif label == "user_create":
+                state["user"] = data.get("id")
+            elif label == "job_enqueue":
+                state["job"] = data.get("id")
+
+            ok = resp.status_code < 400 and (budget is None or len(ran) <= budget)
+            shown = "-" if budget is None else budget
+            print(f"{'ok  ' if ok else 'FAIL'} {label:<20} {endpoint:<32} {len(ran):>3} / {shown:<3} HTTP {resp.status_code}")
+            if budget is None:
+                print(f"     (no @query_budget on {endpoint})")
+            if not ok:
+                failures.append(label)
+            if not ok or args.verbose:
+                for i, sql in enumerate(ran, 1):
+                    print(f"     {i:>2}. " + " ".join(sql.split())[:400])
+
+    missing = sorted(set(budgets(app)) - seen)
+    if missing:
+        print("\nbudgeted endpoints not exercised: " + ", ".join(missing))
+    if failures:
+        print(f"\n{len(failures)} case(s) over budget or failing: {', '.join(failures)}")
+        sys.exit(1)
+    print("\nall endpoints within budget")
+
+
+if __name__ == "__main__":
+    main()
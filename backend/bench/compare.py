@@ -0,0 +1,42 @@
+"""Side-by-side diff of two bench.load reports.
+
+    python -m bench.compare before.json after.json
+"""
+import argparse
+import json
+
+FIELDS = ("throughput_rps", "p50_ms", "p95_ms", "p99_ms", "db_queries_per_request", "mean_bytes")
+
+
+def _delta(before, after):
+    if before is None or after is None:
+        return "n/a"
+    if before == 0:
+        return "+inf" if after else "0%"
+    return f"{(after - before) / before * 100:+.1f}%"
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("before")
+    ap.add_argument("after")
+    args = ap.parse_args(argv)
+
+    with open(args.before) as fh:
+        a = json.load(fh)
+    with open(args.after) as fh:
+        b = json.load(fh)
+
+    print(f"before: {a.get('commit')}  c={a.get('concurrency')}  {a.get('duration_s')}s")
+    print(f"after:  {b.get('commit')}  c={b.get('concurrency')}  {b.get('duration_s')}s")
+    for name in sorted(set(a["scenarios"]) | set(b["scenarios"])):
+        sa = a["scenarios"].get(name, {})
+        sb = b["scenarios"].get(name, {})
+        print(f"\n{name}")
+        for field in FIELDS:
+            va, vb = sa.get(field), sb.get(field)
+            print(f"  {field:<24} {str(va):>10} -> {str(vb):>10}  {_delta(va, vb)}")
+
+
+if __name__ == "__main__":
+    main()
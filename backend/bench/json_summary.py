@@ -0,0 +1,115 @@
+"""Micro-benchmark: JSON encoding of a 10k-row inventory summary.
+
+    python -m bench.json_summary [--rows 10000] [--repeat 20]
+
+Compares the pre-provider path (dict() per row, isoformat() loops and
+Flask's default provider) with jsonio.FastJSONProvider, buffered and
+streamed. No database needed: rows are synthetic but shaped like the
+real /inventario/resumen and /pedidos results.
+"""
+import argparse
+import datetime
+import decimal
+import json
+import statistics
+import sys
+import time
+import uuid
+from collections.abc import Mapping
+
+from flask import Flask, jsonify
+from flask.json.provider import DefaultJSONProvider
+
+import jsonio
+
+
+class _Row(Mapping):
+    """Stand-in for SQLAlchemy's RowMapping (a Mapping that is not a dict)."""
+
+    def __init__(self, **values):
+        self._values = values
+
+    def __getitem__(self, key):
+        return self._values[key]
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __len__(self):
+        return len(self._values)
+
+
+def summary_rows(n):
+    out = []
+    for i in range(n):
+        out.append(_Row(
+            id=uuid.uuid4(),
+            referencia=f"REF-{i:06d}",
+            descripcion=f"Tela algodón {i}",
+            precio_lista=decimal.Decimal("12500.00") + i,
+            caracteristicas={"color": "azul", "composicion": "algodon 100%", "ancho": 150, "gramaje": 180},
+            cantidad_actual=decimal.Decimal("340.50"),
+            cantidad_disponible=decimal.Decimal("120.25"),
+            fecha_entrega=datetime.date(2025, 1, 1) + datetime.timedelta(days=i % 365),
+            created_at=datetime.datetime(2025, 1, 1, 8, 30, tzinfo=datetime.timezone.utc),
+        ))
+    return out
+
+
+def legacy(rows):
+    # What list_orders/get_order did per row before the provider existed
+    out = []
+    for r in rows:
+        d = dict(r)
+        if isinstance(d.get("fecha_entrega"), datetime.date):
+            d["fecha_entrega"] = d["fecha_entrega"].isoformat()
+        if isinstance(d.get("created_at"), datetime.datetime):
+            d["created_at"] = d["created_at"].isoformat()
+        out.append(d)
+    return jsonify(out).get_data()
+
+
+def fast(rows):
+    return jsonify(rows).get_data()
+
+
+def streamed(rows):
+    return b"".join(jsonio.stream_json_array(iter(rows)).response)
+
+
+def _time(fn, rows, repeat):
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        body = fn(rows)
+        samples.append((time.perf_counter() - t0) * 1000)
+    return {"median_ms": round(statistics.median(samples), 2), "min_ms": round(min(samples), 2), "bytes": len(body)}
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--rows", type=int, default=10_000)
+    ap.add_argument("--repeat", type=int, default=20)
+    args = ap.parse_args(argv)
+
+    rows = summary_rows(args.rows)
+
+    old_app = Flask("legacy")
+    old_app.json = DefaultJSONProvider(old_app)
+    new_app = Flask("fast")
+    new_app.json = jsonio.FastJSONProvider(new_app)
+
+    report = {"rows": args.rows, "repeat": args.repeat, "orjson": jsonio.orjson is not None}
+    with old_app.app_context():
+        report["legacy"] = _time(legacy, rows, args.repeat)
+    with new_app.test_request_context():
+        report["fast"] = _time(fast, rows, args.repeat)
+        report["fast_streamed"] = _time(streamed, rows, args.repeat)
+    report["speedup"] = round(report["legacy"]["median_ms"] / report["fast"]["median_ms"], 2)
+
+    json.dump(report, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
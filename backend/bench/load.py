@@ -0,0 +1,253 @@
+"""Concurrent HTTP load against a running API, with machine-readable output.
+
+    python -m bench.load --base-url http://localhost:5000/api/v1 \\
+        --concurrency 16 --duration 30 --output bench_output.json
+
+Drives the real endpoints with a weighted scenario mix:
+
+    inventory_summary   GET  /inventario/resumen
+    orders_list         GET  /pedidos
+    order_detail        GET  /pedidos/<id>
+    order_item_add      POST /pedidos/<id>/items   (on a draft order made for the run)
+    clients_search      GET  /clientes?q=
+    login               POST /auth/login
+
+and reports p50/p95/p99 latency, throughput, response bytes and DB
+queries per request (read from the Server-Timing header). Results carry
+the git commit and run settings so two JSON reports can be compared with
+``python -m bench.compare before.json after.json``.
+
+Seed the database first with ``python -m bench.seed``, and start the API
+with RATE_LIMITS= (empty): every client thread here is the same bench
+user, so admission.py's per-user limits would throttle the run.
+"""
+import argparse
+import datetime
+import http.client
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+from bench.seed import BENCH_EMAIL, BENCH_PASSWORD
+
+DEFAULT_MIX = {
+    "inventory_summary": 2,
+    "orders_list": 3,
+    "order_detail": 6,
+    "order_item_add": 1,
+    "clients_search": 4,
+    "login": 1,
+}
+
+_QUERIES_RE = re.compile(r'db;[^,]*desc="(\d+) queries"')
+
+
+def percentile(samples, pct):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    idx = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[idx]
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except Exception:
+        return None
+
+
+class Client:
+    """One keep-alive HTTP connection per worker thread."""
+
+    def __init__(self, base_url, token=None, compress=True):
+        parts = urlsplit(base_url)
+        self.scheme = parts.scheme
+        self.netloc = parts.netloc
+        self.prefix = parts.path.rstrip("/")
+        self.token = token
+        self.compress = compress
+        self.conn = None
+
+    def _connect(self):
+        cls = http.client.HTTPSConnection if self.scheme == "https" else http.client.HTTPConnection
+        self.conn = cls(self.netloc, timeout=120)
+
+    def request(self, method, path, body=None):
+        headers = {"Content-Type": "application/json"}
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        if self.compress:
+            headers["Accept-Encoding"] = "br, gzip"
+        payload = json.dumps(body).encode() if body is not None else None
+        for attempt in (1, 2):
+            if self.conn is None:
+                self._connect()
+            try:
+                self.conn.request(method, self.prefix + path, body=payload, headers=headers)
+                resp = self.conn.getresponse()
+                data = resp.read()
+                return resp.status, resp.getheader("Server-Timing") or "", data
+            except (http.client.HTTPException, ConnectionError):
+                self.conn.close()
+                self.conn = None
+                if attempt == 2:
+                    raise
+
+
+class Fixture:
+    """Ids the scenarios pick from, collected once before the run."""
+
+    def __init__(self, base_url):
+        c = Client(base_url, compress=False)
+        status, _, data = c.request("POST", "/auth/login", {"email": BENCH_EMAIL, "password": BENCH_PASSWORD})
+        if status != 200:
+            sys.exit(f"bench login failed ({status}); seed with python -m bench.seed")
+        self.token = json.loads(data)["token"]
+        c.token = self.token
+
+        _, _, data = c.request("GET", "/pedidos")
+        self.order_ids = [o["id"] for o in json.loads(data)] or sys.exit("no pedidos to read")
+
+        _, _, data = c.request("GET", "/inventario/resumen")
+        products = json.loads(data)
+        self.product_ids = [p["id"] for p in products if float(p["cantidad_disponible"] or 0) > 10][:500]
+
+        _, _, data = c.request("GET", "/clientes?limit=50")
+        clients = json.loads(data)
+        self.client_terms = sorted({cl["nombre"].split()[-1] for cl in clients}) or ["a"]
+
+        status, _, data = c.request("POST", "/pedidos/start", {
+            "cliente_nombre": "Bench", "cliente_telefono": "0", "direccion_entrega": "bench",
+            "fecha_entrega": datetime.date.today().isoformat(),
+        })
+        self.draft_id = json.loads(data)["pedido_id"] if status == 201 else None
+
+
+def scenario_request(name, fx, rnd):
+    if name == "inventory_summary":
+        return "GET", "/inventario/resumen", None
+    if name == "orders_list":
+        return "GET", "/pedidos", None
+    if name == "order_detail":
+        return "GET", f"/pedidos/{rnd.choice(fx.order_ids)}", None
+    if name == "order_item_add":
+        return "POST", f"/pedidos/{fx.draft_id}/items", {"producto_id": rnd.choice(fx.product_ids), "cantidad": 0.01}
+    if name == "clients_search":
+        return "GET", f"/clientes?q={rnd.choice(fx.client_terms)}", None
+    if name == "login":
+        return "POST", "/auth/login", {"email": BENCH_EMAIL, "password": BENCH_PASSWORD}
+    raise ValueError(name)
+
+
+def run(base_url, concurrency, duration, mix, seed=1, compress=True):
+    fx = Fixture(base_url)
+    if not fx.draft_id or not fx.product_ids:
+        mix = {k: v for k, v in mix.items() if k != "order_item_add"}
+    names = [n for n, w in mix.items() for _ in range(w)]
+
+    results = {n: {"lat": [], "bytes": [], "queries": [], "errors": 0} for n in mix}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker(i):
+        rnd = random.Random(seed * 1000 + i)
+        client = Client(base_url, token=fx.token, compress=compress)
+        while time.perf_counter() < deadline:
+            name = rnd.choice(names)
+            method, path, body = scenario_request(name, fx, rnd)
+            t0 = time.perf_counter()
+            try:
+                status, timing, data = client.request(method, path, body)
+            except Exception:
+                status, timing, data = 0, "", b""
+            elapsed = (time.perf_counter() - t0) * 1000
+            m = _QUERIES_RE.search(timing)
+            with lock:
+                r = results[name]
+                if status >= 400 or status == 0:
+                    r["errors"] += 1
+                    continue
+                r["lat"].append(elapsed)
+                r["bytes"].append(len(data))
+                if m:
+                    r["queries"].append(int(m.group(1)))
+
+    t_start = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - t_start
+
+    scenarios = {}
+    for name, r in results.items():
+        lat = r["lat"]
+        scenarios[name] = {
+            "requests": len(lat),
+            "errors": r["errors"],
+            "throughput_rps": round(len(lat) / wall, 2),
+            "p50_ms": _round(percentile(lat, 50)),
+            "p95_ms": _round(percentile(lat, 95)),
+            "p99_ms": _round(percentile(lat, 99)),
+            "max_ms": _round(max(lat) if lat else None),
+            "mean_bytes": round(sum(r["bytes"]) / len(r["bytes"])) if r["bytes"] else None,
+            "db_queries_per_request": round(sum(r["queries"]) / len(r["queries"]), 2) if r["queries"] else None,
+        }
+    total = sum(s["requests"] for s in scenarios.values())
+    return {
+        "commit": git_commit(),
+        "started_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "base_url": base_url,
+        "concurrency": concurrency,
+        "duration_s": duration,
+        "compress": compress,
+        "mix": mix,
+        "total_requests": total,
+        "throughput_rps": round(total / wall, 2),
+        "scenarios": scenarios,
+    }
+
+
+def _round(v):
+    return None if v is None else round(v, 2)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--base-url", default=os.getenv("BENCH_BASE_URL", "http://localhost:5000/api/v1"))
+    ap.add_argument("--concurrency", type=int, default=16)
+    ap.add_argument("--duration", type=float, default=30.0, help="seconds")
+    ap.add_argument("--scenario", action="append", help="run only these scenarios (repeatable)")
+    ap.add_argument("--no-compress", action="store_true", help="don't send Accept-Encoding")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--output", help="write the JSON report here as well as to stdout")
+    args = ap.parse_args(argv)
+
+    mix = dict(DEFAULT_MIX)
+    if args.scenario:
+        unknown = set(args.scenario) - set(mix)
+        if unknown:
+            sys.exit(f"unknown scenarios: {sorted(unknown)}")
+        mix = {k: v for k, v in mix.items() if k in args.scenario}
+
+    report = run(args.base_url, args.concurrency, args.duration, mix, seed=args.seed,
+                 compress=not args.no_compress)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as fh:
+            fh.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""WSGI (gunicorn gthread) vs ASGI (asgi.py) under the same read load.
+
+Start both servers against the same seeded database, e.g.
+
+    gunicorn -c gunicorn.conf.py -k gthread --threads 8 -w 1 -b :5000 app:app
+    uvicorn asgi:app --port 5001 --workers 1
+
+then
+
+    python -m bench.modes --wsgi-url http://localhost:5000/api/v1 \\
+        --asgi-url http://localhost:5001/api/v1 --concurrency 200 --output modes.json
+
+Only the read scenarios that asgi.py serves natively are driven. The JSON
+report holds one bench.load report per mode.
+"""
+import argparse
+import json
+
+from bench import load
+
+READ_MIX = {
+    "inventory_summary": 1,
+    "orders_list": 3,
+    "order_detail": 6,
+    "clients_search": 4,
+}
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--wsgi-url", default="http://localhost:5000/api/v1")
+    ap.add_argument("--asgi-url", default="http://localhost:5001/api/v1")
+    ap.add_argument("--concurrency", type=int, default=200)
+    ap.add_argument("--duration", type=float, default=30.0, help="seconds per mode")
+    ap.add_argument("--output", help="write the JSON report here as well as to stdout")
+    args = ap.parse_args(argv)
+
+    report = {"concurrency": args.concurrency, "modes": {}}
+    for mode, url in (("wsgi", args.wsgi_url), ("asgi", args.asgi_url)):
+        report["modes"][mode] = load.run(url, args.concurrency, args.duration, READ_MIX)
+
+    print(f"{'scenario':<20} {'mode':<5} {'rps':>9} {'p50':>9} {'p95':>9} {'p99':>9} {'errors':>7}")
+    for name in READ_MIX:
+        for mode, r in report["modes"].items():
+            s = r["scenarios"][name]
+            print(f"{name:<20} {mode:<5} {s['throughput_rps']:>9} {s['p50_ms']!s:>9} "
+                  f"{s['p95_ms']!s:>9} {s['p99_ms']!s:>9} {s['errors']:>7}")
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as fh:
+            fh.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Compare plain vs server-side prepared execution of registry statements.
+
+    python -m bench.prepared --iterations 200 [--url postgresql://...]
+
+Needs a direct Postgres URL (not the transaction pooler, which cannot keep
+prepared statements). Prints one JSON document with per-mode latencies.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import QueuePool
+
+import statements as stmts
+
+
+def _percentile(samples, pct):
+    ordered = sorted(samples)
+    idx = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[idx]
+
+
+def _cases(conn):
+    cases = [
+        ("orders_list", stmts.ORDERS_LIST, {}),
+        ("clients_search", stmts.CLIENTS_SEARCH, {"p": "%a%", "lim": 20}),
+        ("product_by_ref", stmts.PRODUCT_BY_REF, {"r": "REF-000001"}),
+    ]
+    pid = conn.execute(text("select id from public.pedidos limit 1")).scalar()
+    if pid:
+        cases.append(("order_detail", stmts.ORDER_DETAIL, {"id": str(pid)}))
+    return cases
+
+
+def run_mode(url, mode, iterations):
+    eng = create_engine(url, future=True, poolclass=QueuePool, pool_size=1)
+    if mode == "prepared":
+        stmts.enable_prepared(eng)
+    out = {}
+    try:
+        with eng.connect() as conn:
+            for name, stmt, params in _cases(conn):
+                samples = []
+                for _ in range(iterations):
+                    t0 = time.perf_counter()
+                    stmts.run(conn, stmt, params).all()
+                    samples.append((time.perf_counter() - t0) * 1000)
+                conn.rollback()
+                out[name] = {
+                    "mean_ms": round(statistics.fmean(samples), 3),
+                    "p50_ms": round(_percentile(samples, 50), 3),
+                    "p95_ms": round(_percentile(samples, 95), 3),
+                }
+    finally:
+        eng.dispose()
+    return out
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--url", default=os.getenv("DATABASE_URL", ""))
+    ap.add_argument("--iterations", type=int, default=200)
+    ap.add_argument("--mode", choices=("plain", "prepared", "both"), default="both")
+    args = ap.parse_args(argv)
+
+    if not args.url:
+        sys.exit("DATABASE_URL (or --url) is required")
+    if stmts.is_transaction_pooler(args.url):
+        sys.exit("refusing to benchmark prepared statements through a transaction pooler")
+
+    modes = ("plain", "prepared") if args.mode == "both" else (args.mode,)
+    report = {"iterations": args.iterations, "modes": {m: run_mode(args.url, m, args.iterations) for m in modes}}
+    json.dump(report, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
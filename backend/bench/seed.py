@@ -0,0 +1,188 @@
+"""Seed a local Postgres with a synthetic textile dataset.
+
+    python -m bench.seed --scale small            # quick smoke data
+    python -m bench.seed --scale large --truncate # 50k productos, 5M movimientos,
+                                                  # 200k pedidos, 2M items
+
+Everything is generated server-side with generate_series and a fixed
+setseed(), so the same scale produces the same data on every run. The
+bench login is bench@example.com / bench (profile admin).
+
+Never point this at production: --truncate wipes the business tables.
+"""
+import argparse
+import datetime
+import os
+import sys
+import time
+
+from sqlalchemy import create_engine, text
+
+SCALES = {
+    #            productos  movimientos  pedidos   items  clientes  vendedores
+    "small":  dict(productos=2_000, movimientos=100_000, pedidos=5_000, items=50_000, clientes=500, vendedores=10),
+    "medium": dict(productos=10_000, movimientos=1_000_000, pedidos=50_000, items=500_000, clientes=2_000, vendedores=25),
+    "large":  dict(productos=50_000, movimientos=5_000_000, pedidos=200_000, items=2_000_000, clientes=10_000, vendedores=50),
+}
+
+BENCH_EMAIL = "bench@example.com"
+BENCH_PASSWORD = "bench"
+
+# Supabase provides these in production; a local database needs them.
+USERS_DDL = [
+    "create extension if not exists pgcrypto",
+    """
+    create table if not exists public.usuarios (
+      id uuid primary key default gen_random_uuid(),
+      nombre_completo text not null,
+      email text unique not null,
+      password_hash text not null,
+      profile text not null default 'viewer',
+      created_at timestamptz not null default now()
+    )
+    """,
+    """
+    create table if not exists public.usuarios_prefs (
+      user_id uuid primary key references public.usuarios(id),
+      prefs jsonb not null default '{}'::jsonb,
+      updated_at timestamptz not null default now()
+    )
+    """,
+]
+
+TRUNCATE = """
+    truncate public.pedido_items, public.pedidos, public.inventario_movimientos,
+             public.inventario_saldos, public.inventario_periodos, public.productos, public.clientes, public.usuarios_prefs, public.usuarios cascade
+"""
+
+STEPS = [
+    ("usuarios", """
+        insert into public.usuarios (nombre_completo, email, password_hash, profile)
+        select 'Bench Admin', :email, crypt(:password, gen_salt('bf', 4)), 'admin'
+        union all
+        select 'Vendedor ' || g, 'vendedor' || g || '@example.com', crypt('bench', gen_salt('bf', 4)), 'seller'
+        from generate_series(1, :vendedores) g
+        on conflict (email) do nothing
+    """),
+    ("productos", """
+        insert into public.productos (referencia, descripcion, precio_lista, caracteristicas)
+        select
+          'REF-' || lpad(g::text, 6, '0'),
+          (array['Tela','Lino','Denim','Jersey','Popelina','Gabardina'])[1 + g % 6] || ' ' || g,
+          round((5000 + random() * 45000)::numeric, 2),
+          jsonb_build_object(
+            'color', (array['azul','negro','blanco','rojo','verde','gris','beige'])[1 + (random() * 6)::int],
+            'composicion', (array['algodon','poliester','lino','lycra','mezcla'])[1 + (random() * 4)::int],
+            'ancho', (array[140,150,160,180])[1 + (random() * 3)::int],
+            'gramaje', 120 + (random() * 200)::int
+          )
+        from generate_series(1, :productos) g
+    """),
+    ("clientes", """
+        insert into public.clientes (nombre, direccion, direccion_entrega, email, telefono, persona_contacto, ciudad, pais)
+        select 'Cliente ' || g, 'Calle ' || g, 'Bodega ' || g, 'cliente' || g || '@example.com',
+               '300' || lpad(g::text, 7, '0'), 'Contacto ' || g,
+               (array['Bogota','Medellin','Cali','Lima','Quito'])[1 + g % 5], 'CO'
+        from generate_series(1, :clientes) g
+    """),
+    ("inventario_movimientos", """
+        with p as (select array_agg(id order by referencia) ids from public.productos),
+             u as (select id from public.usuarios where email = :email)
+        insert into public.inventario_movimientos
+          (producto_id, cantidad, clase, tipo, motivo, usuario_id, fecha_local, hora_local)
+        select
+          p.ids[1 + (g % array_length(p.ids, 1))],
+          round((1 + random() * 50)::numeric, 2),
+          case when random() < 0.8 then 'entrada' else 'salida' end,
+          'bench',
+          'ajuste',
+          u.id,
+          current_date - (random() * 730)::int,
+          time '08:00' + (random() * interval '10 hours')
+        from generate_series(1, :movimientos) g, p, u
+    """),
+    ("pedidos", """
+        with c as (select array_agg(id order by nombre) ids from public.clientes),
+             u as (select array_agg(id) ids from public.usuarios)
+        insert into public.pedidos
+          (status, cliente_id, cliente_nombre, cliente_telefono, direccion_entrega,
+           fecha_entrega, fecha_local, hora_local, usuario_id, created_at)
+        select
+          ((array['draft','submitted','approved','approved','approved','cancelled'])[1 + g % 6])::public.order_status,
+          c.ids[1 + g % array_length(c.ids, 1)],
+          'Cliente ' || (1 + g % array_length(c.ids, 1)),
+          '3000000000',
+          'Bodega ' || g,
+          current_date + (g % 30),
+          current_date - (g % 730),
+          time '09:00',
+          u.ids[1 + g % array_length(u.ids, 1)],
+          now() - (g % 730) * interval '1 day'
+        from generate_series(1, :pedidos) g, c, u
+    """),
+    ("pedido_items", """
+        with o as (select array_agg(id order by created_at, id) ids from public.pedidos),
+             p as (select array_agg(id order by referencia) ids,
+                          array_agg(referencia order by referencia) refs from public.productos)
+        insert into public.pedido_items (pedido_id, producto_id, referencia, descripcion, cantidad, precio)
+        select
+          o.ids[1 + (g / :lines) % array_length(o.ids, 1)],
+          p.ids[1 + ((g / :lines) * 131 + g % :lines) % array_length(p.ids, 1)],
+          p.refs[1 + ((g / :lines) * 131 + g % :lines) % array_length(p.ids, 1)],
+          'Item bench',
+          round((1 + random() * 5)::numeric, 2),
+          round((5000 + random() * 45000)::numeric, 2)
+        from generate_series(0, :items - 1) g, o, p
+    """),
+]
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--url", default=os.getenv("DATABASE_URL", ""))
+    ap.add_argument("--scale", choices=sorted(SCALES), default="small")
+    ap.add_argument("--truncate", action="store_true", help="wipe business tables first")
+    for key in SCALES["small"]:
+        ap.add_argument(f"--{key}", type=int, help=f"override {key} count")
+    args = ap.parse_args(argv)
+
+    if not args.url:
+        sys.exit("DATABASE_URL (or --url) is required")
+    counts = dict(SCALES[args.scale])
+    counts.update({k: getattr(args, k) for k in counts if getattr(args, k) is not None})
+    params = dict(counts, email=BENCH_EMAIL, password=BENCH_PASSWORD,
+                  lines=max(1, counts["items"] // max(1, counts["pedidos"])))
+
+    import db
+    db.use_url(args.url)
+    print(f"[DB] seeding {db.mask_url(args.url)}")
+    engine = create_engine(args.url, future=True)
+    with engine.begin() as conn:
+        for ddl in USERS_DDL:
+            conn.execute(text(ddl))
+
+    # Reuse the API's own schema bootstrap for the business tables
+    import ledger
+    from app import app
+    db.warmup(app)
+
+    with engine.begin() as conn:
+        if args.truncate:
+            conn.execute(text(TRUNCATE))
+        if ledger.is_partitioned(conn):
+            # Movements span the last two years: give each month its partition
+            ledger.ensure_partitions(conn, first=datetime.date.today() - datetime.timedelta(days=731))
+        conn.execute(text("select setseed(0.42)"))
+        for name, sql in STEPS:
+            t0 = time.perf_counter()
+            conn.execute(text(sql), params)
+            print(f"[seed] {name}: {time.perf_counter() - t0:.1f}s", file=sys.stderr)
+
+    with engine.connect() as conn:
+        conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+        conn.execute(text("analyze"))
+    print(f"[seed] done: {counts}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,13 +2,18 @@ from flask import Blueprint, request, jsonify, current_app
 from sqlalchemy import text
 import datetime
 
+import statements as stmts
+from db import read_only, route_read
+from querybudget import query_budget
+from timeouts import statement_timeout
+
 bp = Blueprint("clients", __name__)
 
 def get_engine():
     eng = current_app.config.get("ENGINE")
     if not eng:
         raise RuntimeError("DB engine is not available in app.config['ENGINE']")
-    return eng
+    return route_read(eng)
 
 def _auth_user_id():
     auth = request.headers.get("Authorization", "")
@@ -49,6 +54,9 @@ def init_schema(engine=None):
 # ---- Endpoints --------------------------------------------------------------
 
 @bp.get("/clientes")
+@query_budget(1)
+@statement_timeout(2000)
+@read_only
 def list_clients():
     # Require auth (consistent with other blueprints)
     if not _auth_user_id():
@@ -57,33 +65,17 @@ def list_clients():
     q = (request.args.get("q") or "").strip()
     limit = max(1, min(int(request.args.get("limit") or 20), 50))
 
-    sql = """
-      select id, nombre, direccion, direccion_entrega, email, telefono, persona_contacto, ciudad, pais
-      from public.clientes
-    """
-    params = {}
-    if q:
-        sql += """
-          where
-            lower(nombre) like :p or
-            lower(coalesce(email,'')) like :p or
-            lower(coalesce(telefono,'')) like :p or
-            lower(coalesce(persona_contacto,'')) like :p or
-            lower(coalesce(ciudad,'')) like :p or
-            lower(coalesce(pais,'')) like :p
-        """
-        params["p"] = f"%{q.lower()}%"
-
-    sql += " order by lower(nombre) asc limit :lim"
-    params["lim"] = limit
-
     eng = get_engine()
     with eng.begin() as conn:
-        rows = conn.execute(text(sql), params).mappings().all()
+        if q:
+            rows = stmts.run(conn, stmts.CLIENTS_SEARCH, {"p": f"%{q.lower()}%", "lim": limit}).mappings().all()
+        else:
+            rows = stmts.run(conn, stmts.CLIENTS_LIST, {"lim": limit}).mappings().all()
 
-    return jsonify([dict(r) for r in rows])
+    return jsonify(rows)
 
 @bp.post("/clientes")
+@query_budget(1)
 def create_client():
     uid = _auth_user_id()
     if not uid:
@@ -96,13 +88,9 @@ def create_client():
 
     eng = get_engine()
     with eng.begin() as conn:
-        row = conn.execute(
-            text("""
-              insert into public.clientes
-              (nombre, direccion, direccion_entrega, email, telefono, persona_contacto, ciudad, pais)
-              values (:n, :d, :de, :e, :t, :pc, :c, :p)
-              returning id
-            """),
+        row = stmts.run(
+            conn,
+            stmts.CLIENT_INSERT,
             {
                 "n": nombre,
                 "d": (b.get("direccion") or "").strip(),
@@ -118,20 +106,17 @@ def create_client():
     return jsonify({"id": row[0]}), 201
 
 @bp.get("/clientes/<uuid:cid>")
+@query_budget(1)
+@statement_timeout(2000)
+@read_only
 def get_client(cid):
     if not _auth_user_id():
         return jsonify({"error": "Unauthorized"}), 401
 
     eng = get_engine()
     with eng.begin() as conn:
-        r = conn.execute(
-            text("""
-              select id, nombre, direccion, direccion_entrega, email, telefono, persona_contacto, ciudad, pais
-              from public.clientes where id = :id
-            """),
-            {"id": str(cid)}
-        ).mappings().first()
+        r = stmts.run(conn, stmts.CLIENT_BY_ID, {"id": str(cid)}).mappings().first()
 
     if not r:
         return jsonify({"error": "No encontrado"}), 404
-    return jsonify(dict(r))
+    return jsonify(r)
@@ -1,8 +1,24 @@
 from flask import Blueprint, request, jsonify, current_app
 from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
 import jwt
 import datetime
 import json
+import re
+import uuid
+
+import changelog
+import jobs
+import jsonio
+import ledger
+import reconcile
+import resultcache
+import statements as stmts
+from admission import concurrency_limited
+from db import NOTIFY_CHANNEL, read_only, route_read, statement_triggers
+from querybudget import query_budget
+from resultcache import invalidates
+from timeouts import statement_timeout
 
 bp = Blueprint("inventory", __name__)
 
@@ -13,7 +29,7 @@ def get_engine():
     eng = current_app.config.get("ENGINE")
     if not eng:
         raise RuntimeError("DB engine is not available in app.config['ENGINE']")
-    return eng
+    return route_read(eng)
 
 def auth_user_id():
     auth = request.headers.get("Authorization", "")
@@ -40,66 +56,297 @@ def init_schema(engine=None):
           created_at timestamptz not null default now()
         )
         """))
+        # Facet filters (caracteristicas @@ jsonpath) and containment queries
         conn.execute(text("""
-        create table if not exists inventario_movimientos (
-          id uuid primary key default gen_random_uuid(),
-          producto_id uuid not null references productos(id) on delete cascade,
-          cantidad numeric(12,2) not null,
-          clase text not null,
-          tipo text not null,
-          motivo text not null,
-          usuario_id uuid not null,
-          fecha_local date not null,
-          hora_local time not null,
-          ubicacion text not null default 'principal',
-          created_at timestamptz not null default now()
-        )
+        create index if not exists productos_caracteristicas_idx
+        on public.productos using gin (caracteristicas jsonb_path_ops)
         """))
+        create_facets(conn)
+        # inventario_movimientos, its monthly partitions and the closed-period
+        # balances live in ledger.py
+        ledger.init_schema(conn, current_app.config["LEDGER_PARTITIONS_AHEAD"])
+        create_notify_trigger(conn, current_app.config["CHANGE_NOTIFY_ENABLED"])
+
+def create_facets(conn):
+    # Value counts per caracteristicas attribute for the filter sidebar,
+    # maintained row by row as products change (scalar values only)
+    fresh = conn.execute(text("select to_regclass('public.productos_facetas') is null")).scalar()
+    conn.execute(text("""
+    create table if not exists public.productos_facetas (
+      atributo text not null,
+      valor jsonb not null,
+      productos integer not null,
+      primary key (atributo, valor)
+    )
+    """))
+    conn.execute(text("""
+    create or replace function public.productos_facetas_sync() returns trigger
+    language plpgsql as $fn$
+    begin
+      if tg_op = 'UPDATE' and old.caracteristicas is not distinct from new.caracteristicas then
+        return null;
+      end if;
+      if tg_op in ('UPDATE', 'DELETE') then
+        update public.productos_facetas f set productos = f.productos - 1
+        from jsonb_each(old.caracteristicas) e
+        where f.atributo = e.key and f.valor = e.value;
+        delete from public.productos_facetas f
+        using jsonb_each(old.caracteristicas) e
+        where f.atributo = e.key and f.valor = e.value and f.productos <= 0;
+      end if;
+      if tg_op in ('INSERT', 'UPDATE') then
+        insert into public.productos_facetas (atributo, valor, productos)
+        select e.key, e.value, 1
+        from jsonb_each(new.caracteristicas) e
+        where jsonb_typeof(e.value) in ('string', 'number', 'boolean')
+        on conflict (atributo, valor) do update
+          set productos = public.productos_facetas.productos + 1;
+      end if;
+      return null;
+    end
+    $fn$
+    """))
+    conn.execute(text("drop trigger if exists productos_facetas_sync on public.productos"))
+    conn.execute(text("""
+    create trigger productos_facetas_sync
+    after insert or update or delete on public.productos
+    for each row execute function public.productos_facetas_sync()
+    """))
+    if fresh:
+        rebuild_facets(conn)
+
+def rebuild_facets(conn):
+    """Recount productos_facetas from the catalog (first install, or drift)."""
+    conn.execute(text("lock table public.productos_facetas in exclusive mode"))
+    conn.execute(text("delete from public.productos_facetas"))
+    conn.execute(text("""
+    insert into public.productos_facetas (atributo, valor, productos)
+    select e.key, e.value, count(*)
+    from public.productos, jsonb_each(caracteristicas) e
+    where jsonb_typeof(e.value) in ('string', 'number', 'boolean')
+    group by e.key, e.value
+    """))
+
+def create_notify_trigger(conn, enabled=True):
+    # Change feed for SSE clients (asgi.py) and the other workers' caches
+    # (cachebus.py): one NOTIFY per product a statement touched, deduplicated
+    # by Postgres within a transaction
+    conn.execute(text(f"""
+    create or replace function public.notify_inventario_movimiento() returns trigger
+    language plpgsql as $fn$
+    declare
+      pid uuid;
+    begin
+      if tg_op <> 'DELETE' then
+        for pid in select distinct producto_id from new_rows loop
+          perform pg_notify('{NOTIFY_CHANNEL}', json_build_object('tipo', 'inventario', 'producto_id', pid)::text);
+        end loop;
+      end if;
+      if tg_op <> 'INSERT' then
+        for pid in select distinct producto_id from old_rows loop
+          perform pg_notify('{NOTIFY_CHANNEL}', json_build_object('tipo', 'inventario', 'producto_id', pid)::text);
+        end loop;
+      end if;
+      return null;
+    end
+    $fn$
+    """))
+    statement_triggers(conn, "inventario_movimientos", "inventario_movimientos_notify",
+                       "notify_inventario_movimiento", enabled)
+
+# Attribute filters of /inventario/resumen are namespaced (f.color=azul):
+# any other parameter (q, cache busters, new options) is never a filter
+FACET_PREFIX = "f."
+_NUMBER_RE = re.compile(r"-?\d+(\.\d+)?")
+
+def facet_path(args):
+    """
+    jsonpath for the attribute filters in ``args`` (f.color=azul&f.ancho=150),
+    or None. Values of one attribute are OR-ed, attributes AND-ed; a value
+    that looks like a number or boolean also matches that JSON type.
+    Parameters without the FACET_PREFIX are not filters.
+    """
+    conds = []
+    for name in sorted(args.keys()):
+        attr = name[len(FACET_PREFIX):]
+        if not name.startswith(FACET_PREFIX) or not attr:
+            continue
+        key = f"$.{json.dumps(attr)}"
+        alts = []
+        for v in args.getlist(name):
+            alts.append(f"{key} == {json.dumps(v)}")
+            if _NUMBER_RE.fullmatch(v) or v in ("true", "false"):
+                alts.append(f"{key} == {v}")
+        conds.append("(" + " || ".join(alts) + ")")
+    return " && ".join(conds) or None
+
+def summary_query(args):
+    """(statement, params) for /inventario/resumen; shared with asgi.py."""
+    pedido_id = args.get("pedido_id")  # optional: exclude this order's reservations
+    filtro = facet_path(args)
+    # Reserved = items from draft/submitted orders; with pedido_id the
+    # reservations of that order are excluded (see statements.py)
+    if pedido_id and filtro:
+        return stmts.INVENTORY_SUMMARY_FILTERED_EXCLUDING, {"po": str(pedido_id), "filtro": filtro}
+    if pedido_id:
+        return stmts.INVENTORY_SUMMARY_EXCLUDING, {"po": str(pedido_id)}
+    if filtro:
+        return stmts.INVENTORY_SUMMARY_FILTERED, {"filtro": filtro}
+    return stmts.INVENTORY_SUMMARY, {}
+
+# Delta sync token of a summary body (GET /inventario/cambios?since=)
+VERSION_HEADER = "X-Inventario-Version"
 
 @bp.get("/inventario/resumen")
+@query_budget(2)
+@concurrency_limited("resumen")
+@statement_timeout(20000)
+@read_only
 def inventory_summary():
+    """
+    The catalog with stock, reserved and available per product. The
+    X-Inventario-Version header is the change-log version read just before
+    these rows; pass it to /inventario/cambios?since= for what changed after.
+    """
     eng = get_engine()
-    pedido_id = request.args.get("pedido_id")  # optional: exclude this order's reservations
-
-    # Build the reserved CTE conditionally:
-    # - no pedido_id: reserved = items from all draft/submitted orders
-    # - with pedido_id: reserved = items from other orders only (exclude this one)
-    where_extra = "and p.id <> :po" if pedido_id else ""
-    sql = text(f"""
-      with stock as (
-        select producto_id,
-               sum(case when clase='entrada' then cantidad else -cantidad end) as stock
-        from public.inventario_movimientos
-        group by producto_id
-      ),
-      reserved as (
-        select i.producto_id, sum(i.cantidad) as reservado
-        from public.pedido_items i
-        join public.pedidos p on p.id = i.pedido_id
-        where p.status in ('draft','submitted')
-          {where_extra}
-        group by i.producto_id
-      )
-      select
-        p.id,
-        p.referencia,
-        p.descripcion,
-        p.precio_lista,
-        p.caracteristicas,
-        coalesce(s.stock,0)                                   as cantidad_actual,
-        coalesce(s.stock,0) - coalesce(r.reservado,0)         as cantidad_disponible
-      from public.productos p
-      left join stock s on s.producto_id = p.id
-      left join reserved r on r.producto_id = p.id
-      order by p.referencia asc
-    """)
-    params = {"po": str(pedido_id)} if pedido_id else {}
-    with eng.begin() as conn:
-        rows = conn.execute(sql, params).mappings().all()
-    return jsonify([dict(r) for r in rows])
+    stmt, params = summary_query(request.args)
+
+    if current_app.config["RESULT_CACHE_MODE"] == "off":
+        # Whole catalog: stream it from a server-side cursor instead of
+        # building the full list of rows in memory
+        read = {}
+
+        def rows():
+            with eng.connect() as conn:
+                read["version"] = stmts.run(conn, stmts.CHANGES_VERSION).one().version
+                conn = conn.execution_options(stream_results=True, yield_per=jsonio.STREAM_CHUNK_ROWS)
+                yield from stmts.run(conn, stmt, params).mappings()
+
+        # The first rows, and so the version, are read before this returns
+        resp = jsonio.stream_json_array(rows())
+        resp.headers[VERSION_HEADER] = str(read["version"])
+        return resp
+
+    # Bursts of identical requests share one aggregation (resultcache.py);
+    # writes that move stock or reservations invalidate "inventory". The
+    # version is cached with the body, as its first line: a body computed
+    # before a write never goes out with a token taken after it.
+    def compute():
+        with eng.connect() as conn:
+            version = stmts.run(conn, stmts.CHANGES_VERSION).one().version
+            return b"%d\n" % version + jsonio.dumps_bytes(stmts.run(conn, stmt, params).mappings().all())
+
+    key = f"resumen:{params.get('po', '')}:{params.get('filtro', '')}"
+    version, _, body = resultcache.cached("inventory", key, compute).partition(b"\n")
+    resp = current_app.response_class(body, mimetype="application/json")
+    resp.headers[VERSION_HEADER] = version.decode()
+    return resp
+
+@bp.get("/inventario/facetas")
+@query_budget(1)
+@read_only
+def inventory_facets():
+    """
+    {atributo: [{"valor", "productos"}, ...]}, most common values first.
+    Filter the summary with f.<atributo>=<valor> (facet_path).
+    """
+    with get_engine().connect() as conn:
+        rows = stmts.run(conn, stmts.FACETS).all()
+    facets = {}
+    for atributo, valor, productos in rows:
+        facets.setdefault(atributo, []).append({"valor": valor, "productos": productos})
+    return jsonify(facets)
+
+
+MAX_AVAILABILITY_PRODUCTS = 500
 
+@bp.post("/inventario/disponibilidad")
+@query_budget(1)
+@read_only
+def products_availability():
+    """
+    Stock, reserved and available for a set of products, without computing
+    the whole catalog. Body: {"productos": [producto_id | referencia, ...],
+    "pedido_id": optional order whose own lines don't count as reserved}.
+    """
+    payload = request.get_json(silent=True) or {}
+    wanted = payload.get("productos")
+    pedido_id = payload.get("pedido_id")
+
+    if not isinstance(wanted, list) or not wanted:
+        return jsonify({"error": "productos must be a non-empty list"}), 400
+    if len(wanted) > MAX_AVAILABILITY_PRODUCTS:
+        return jsonify({"error": f"at most {MAX_AVAILABILITY_PRODUCTS} productos per request"}), 400
+    if pedido_id is not None:
+        try:
+            pedido_id = str(uuid.UUID(str(pedido_id)))
+        except ValueError:
+            return jsonify({"error": "pedido_id invalid"}), 400
+
+    # Each entry is a producto_id when it parses as a UUID, else a referencia
+    keys, ids, refs = [], set(), set()
+    for w in wanted:
+        if not isinstance(w, str) or not w.strip():
+            return jsonify({"error": "productos entries must be non-empty strings"}), 400
+        try:
+            key = str(uuid.UUID(w))
+            ids.add(key)
+        except ValueError:
+            key = w.strip()
+            refs.add(key)
+        keys.append(key)
+
+    with get_engine().connect() as conn:
+        rows = stmts.run(
+            conn, stmts.PRODUCTS_AVAILABILITY, {"ids": sorted(ids), "refs": sorted(refs), "po": pedido_id}
+        ).mappings().all()
+
+    found = {str(r["id"]) for r in rows} | {r["referencia"] for r in rows}
+    missing = [k for k in keys if k not in found]
+    return jsonify({"items": [dict(r) for r in rows], "not_found": missing})
+
+
+@bp.get("/inventario/cambios")
+@query_budget(2)
+@read_only
+def inventory_changes():
+    """
+    Products whose stock, availability or data changed since ``since`` (a
+    version from an earlier call), as summary rows, plus the ids of deleted
+    products. A client starts from the X-Inventario-Version header of the
+    /inventario/resumen it loaded: that version is read with the rows, and
+    cached with them. Don't start from a version fetched here separately:
+    the summary may be a cached body computed before writes below it.
+    Without ``since`` only the current version is returned. 410 when the
+    version is older than the change log keeps (changelog.py); the client
+    reloads in full.
+    """
+    since = request.args.get("since")
+    pedido_id = request.args.get("pedido_id")
+    try:
+        since = int(since) if since else None
+    except ValueError:
+        return jsonify({"error": "since must be an integer version"}), 400
+    if pedido_id is not None:
+        try:
+            pedido_id = str(uuid.UUID(pedido_id))
+        except ValueError:
+            return jsonify({"error": "pedido_id invalid"}), 400
+
+    with get_engine().connect() as conn:
+        version, horizon = stmts.run(conn, stmts.CHANGES_VERSION).one()
+        if since is None:
+            return jsonify({"version": version, "items": [], "deleted": []})
+        if horizon is not None and since <= horizon:
+            return jsonify({"error": "version too old, reload the inventory", "version": version}), 410
+        rows = stmts.run(conn, stmts.INVENTORY_CHANGES, {"since": since, "po": pedido_id}).mappings().all()
+
+    items, deleted = changelog.split(rows)
+    return jsonify({"version": version, "items": items, "deleted": deleted})
 
 @bp.post("/inventario/movimientos")
+@query_budget(2)
+@invalidates("inventory")
 def create_movement():
     user_id = auth_user_id()
     if not user_id:
@@ -138,38 +385,40 @@ def create_movement():
         return jsonify({"error": errors}), 400
 
     eng = get_engine()
-    with eng.begin() as conn:
-        if not producto_id:
-            row = conn.execute(
-                text("select id from productos where referencia = :r"),
-                {"r": referencia}
-            ).first()
-            if not row:
-                return jsonify({"error": "Product not found by referencia"}), 404
-            producto_id = row[0]
-
-        conn.execute(
-            text("""
-              insert into inventario_movimientos
-              (producto_id, cantidad, clase, tipo, motivo, usuario_id, fecha_local, hora_local, ubicacion)
-              values (:producto_id, :cantidad, :clase, :tipo, :motivo, :usuario_id, :fecha_local, :hora_local, :ubicacion)
-            """),
-            {
-                "producto_id": producto_id,
-                "cantidad": float(cantidad),
-                "clase": clase,
-                "tipo": tipo,
-                "motivo": motivo,
-                "usuario_id": user_id,
-                "fecha_local": fecha_local,
-                "hora_local": hora_local,
-                "ubicacion": ubicacion
-            }
-        )
+    try:
+        with eng.begin() as conn:
+            if not producto_id:
+                row = stmts.run(conn, stmts.PRODUCT_ID_BY_REF, {"r": referencia}).first()
+                if not row:
+                    return jsonify({"error": "Product not found by referencia"}), 404
+                producto_id = row[0]
+
+            stmts.run(
+                conn,
+                stmts.MOVEMENT_INSERT,
+                {
+                    "producto_id": producto_id,
+                    "cantidad": float(cantidad),
+                    "clase": clase,
+                    "tipo": tipo,
+                    "motivo": motivo,
+                    "usuario_id": user_id,
+                    "fecha_local": fecha_local,
+                    "hora_local": hora_local,
+                    "ubicacion": ubicacion
+                }
+            )
+    except DBAPIError as e:
+        # Month already closed and carried forward (ledger.py)
+        if not ledger.is_period_closed(e):
+            raise
+        return jsonify({"error": "fecha_local falls in a closed period"}), 409
 
     return jsonify({"ok": True}), 201
 
 @bp.post("/productos")
+@query_budget(1)
+@invalidates("inventory")
 def create_product():
     user_id = auth_user_id()
     if not user_id:
@@ -186,11 +435,55 @@ def create_product():
 
     eng = get_engine()
     with eng.begin() as conn:
-        conn.execute(
-            text("""
-              insert into productos (referencia, descripcion, precio_lista, caracteristicas)
-              values (:r, :d, :pl, :c::jsonb)
-            """),
-            {"r": referencia, "d": descripcion, "pl": float(precio), "c": json.dumps(caract, ensure_ascii=False)}
+        stmts.run(
+            conn,
+            stmts.PRODUCT_INSERT,
+            {"r": referencia, "d": descripcion, "pl": float(precio), "c": caract}
         )
     return jsonify({"ok": True}), 201
+
+
+# ---- Jobs -------------------------------------------------------------------
+# ledger.py's period operations, reconcile.py and the change log purge,
+# enqueued from POST /jobs (see jobs.py)
+
+@jobs.job("ledger_close", profiles=("admin",))
+def ledger_close_job(ctx, params):
+    through = ledger.parse_month(str(params.get("through")))
+    ledger.require_partitioned(ctx.engine)
+    closed = ledger.close_through(
+        ctx.engine, through,
+        progress=lambda done, total, month: ctx.progress(100.0 * done / total, f"cerrado {month:%Y-%m}", force=True),
+    )
+    return {"closed": [f"{m:%Y-%m}" for m in closed]}
+
+@jobs.job("ledger_archive", profiles=("admin",))
+def ledger_archive_job(ctx, params):
+    through = ledger.parse_month(str(params.get("through")))
+    ledger.require_partitioned(ctx.engine)
+    drop = bool(params.get("drop"))
+    done = ledger.archive_through(ctx.engine, through, ctx.app.config["LEDGER_ARCHIVE_SCHEMA"], drop)
+    return {"dropped" if drop else "archived": done}
+
+@jobs.job("ledger_maintain", profiles=("admin", "manager"))
+def ledger_maintain_job(ctx, params):
+    ledger.require_partitioned(ctx.engine)
+    with ctx.engine.begin() as conn:
+        return {"created": ledger.ensure_partitions(conn, ahead=ctx.app.config["LEDGER_PARTITIONS_AHEAD"])}
+
+@jobs.job("stock_reconcile", profiles=("admin",))
+def stock_reconcile_job(ctx, params):
+    cfg = ctx.app.config
+    return reconcile.run(
+        ctx.engine, fix=bool(params.get("fix")),
+        chunk=cfg["RECONCILE_CHUNK_SIZE"], pause_ratio=cfg["RECONCILE_PAUSE_RATIO"],
+        timeout_ms=cfg["DB_STATEMENT_TIMEOUT_MS"],
+        progress=lambda done, total: ctx.progress(
+            100.0 * done / max(total, 1), f"{done}/{total} productos", force=done >= total),
+    )
+
+@jobs.job("changes_purge", profiles=("admin", "manager"), every="CHANGES_PURGE_INTERVAL_SECONDS")
+def changes_purge_job(ctx, params):
+    hours = float(params.get("hours") or ctx.app.config["CHANGES_RETENTION_HOURS"])
+    with ctx.engine.begin() as conn:
+        return {"purged": changelog.purge(conn, hours)}
@@ -0,0 +1,75 @@
+from flask import Blueprint, request, jsonify, current_app
+import jwt
+
+import jobs
+import statements as stmts
+from querybudget import query_budget
+
+bp = Blueprint("jobs", __name__)
+
+def get_engine():
+    eng = current_app.config.get("ENGINE")
+    if not eng:
+        raise RuntimeError("DB engine is not available in app.config['ENGINE']")
+    return eng
+
+def _claims():
+    auth = request.headers.get("Authorization", "")
+    if not auth.lower().startswith("bearer "):
+        return None
+    token = auth.split(" ", 1)[1].strip()
+    try:
+        return jwt.decode(token, current_app.config["JWT_SECRET"], algorithms=["HS256"])
+    except Exception:
+        return None
+
+# ---- Schema bootstrap -------------------------------------------------------
+
+def init_schema(engine=None):
+    eng = engine or get_engine()
+    with eng.begin() as conn:
+        jobs.init_schema(conn)
+
+# ---- Endpoints --------------------------------------------------------------
+
+@bp.post("/jobs")
+@query_budget(1)
+def enqueue_job():
+    claims = _claims()
+    if not claims:
+        return jsonify({"error": "Unauthorized"}), 401
+    user_id = claims.get("sub") or claims.get("user_id")
+
+    body = request.get_json(silent=True) or {}
+    tipo = body.get("tipo")
+    params = body.get("params") or {}
+    if tipo not in jobs.KINDS:
+        return jsonify({"error": "tipo inválido", "tipos": sorted(jobs.KINDS)}), 400
+    if not isinstance(params, dict):
+        return jsonify({"error": "params debe ser un objeto"}), 400
+    if claims.get("profile") not in jobs.KINDS[tipo][1]:
+        return jsonify({"error": "No autorizado"}), 403
+
+    with get_engine().begin() as conn:
+        row = stmts.run(conn, stmts.JOB_INSERT, {"t": tipo, "p": params, "uid": user_id}).mappings().first()
+    jobs.wake()
+
+    resp = jsonify(row)
+    resp.status_code = 202
+    resp.headers["Location"] = f"{request.script_root}/api/v1/jobs/{row['id']}"
+    return resp
+
+@bp.get("/jobs/<uuid:job_id>")
+@query_budget(1)
+def get_job(job_id):
+    claims = _claims()
+    if not claims:
+        return jsonify({"error": "Unauthorized"}), 401
+    user_id = claims.get("sub") or claims.get("user_id")
+
+    with get_engine().begin() as conn:
+        row = stmts.run(conn, stmts.JOB_BY_ID, {"id": str(job_id)}).mappings().first()
+    # Owners see their jobs; admins and managers see everyone's
+    if not row or (str(row["usuario_id"]) != str(user_id) and claims.get("profile") not in ("admin", "manager")):
+        return jsonify({"error": "Job no encontrado"}), 404
+    return jsonify(row)
@@ -2,10 +2,23 @@ from flask import Blueprint, request, jsonify, current_app, g
 from sqlalchemy import text
 from sqlalchemy.exc import SQLAlchemyError
 import jwt
+import csv
 import datetime
 from decimal import Decimal
+import io
 import json
+import math
 import os
+import uuid
+
+import changelog
+import jsonio
+import statements as stmts
+from admission import concurrency_limited
+from db import NOTIFY_CHANNEL, read_only, route_read, statement_triggers
+from querybudget import query_budget
+from resultcache import invalidates
+from timeouts import StatementTimeout, statement_timeout
 
 bp = Blueprint("orders", __name__)
 
@@ -15,7 +28,7 @@ def get_engine():
   eng = current_app.config.get("ENGINE")
   if not eng:
     raise RuntimeError("DB engine not available")
-  return eng
+  return route_read(eng)
 
 # --- Auth helpers ------------------------------------------------------------
 
@@ -122,6 +135,18 @@ def init_schema(engine=None):
       created_at timestamptz not null default now()
     )
     """))
+    # Reservations are summed per product (availability lookups)
+    conn.execute(text("""
+        create index if not exists pedido_items_producto_idx on public.pedido_items (producto_id)
+    """))
+    # An order's lines in entry order (detail, export), and orders by local
+    # date for the export's range scans
+    conn.execute(text("""
+        create index if not exists pedido_items_pedido_idx on public.pedido_items (pedido_id, created_at)
+    """))
+    conn.execute(text("""
+        create index if not exists pedidos_fecha_local_idx on public.pedidos (fecha_local, id)
+    """))
 
     # --- approval audit columns (idempotent) ---
     conn.execute(text("alter table public.pedidos add column if not exists approved_at timestamptz"))
@@ -148,9 +173,60 @@ def init_schema(engine=None):
     $do$;
     """))
 
+    # Change feed for SSE clients (asgi.py) and the other workers' caches
+    # (cachebus.py): one NOTIFY per order / product a statement touched. Item
+    # changes also move the product's reserved quantity, so they notify
+    # inventory listeners too.
+    enabled = current_app.config["CHANGE_NOTIFY_ENABLED"]
+    conn.execute(text(f"""
+    create or replace function public.notify_pedido() returns trigger
+    language plpgsql as $fn$
+    declare
+      r record;
+    begin
+      if tg_op = 'DELETE' then
+        for r in select distinct id, status from old_rows loop
+          perform pg_notify('{NOTIFY_CHANNEL}', json_build_object('tipo', 'pedido', 'pedido_id', r.id, 'status', r.status)::text);
+        end loop;
+      else
+        for r in select distinct id, status from new_rows loop
+          perform pg_notify('{NOTIFY_CHANNEL}', json_build_object('tipo', 'pedido', 'pedido_id', r.id, 'status', r.status)::text);
+        end loop;
+      end if;
+      return null;
+    end
+    $fn$
+    """))
+    conn.execute(text(f"""
+    create or replace function public.notify_pedido_item() returns trigger
+    language plpgsql as $fn$
+    declare
+      r record;
+    begin
+      if tg_op <> 'DELETE' then
+        for r in select distinct pedido_id, producto_id from new_rows loop
+          perform pg_notify('{NOTIFY_CHANNEL}', json_build_object('tipo', 'pedido', 'pedido_id', r.pedido_id)::text);
+          perform pg_notify('{NOTIFY_CHANNEL}', json_build_object('tipo', 'inventario', 'producto_id', r.producto_id)::text);
+        end loop;
+      end if;
+      if tg_op <> 'INSERT' then
+        for r in select distinct pedido_id, producto_id from old_rows loop
+          perform pg_notify('{NOTIFY_CHANNEL}', json_build_object('tipo', 'pedido', 'pedido_id', r.pedido_id)::text);
+          perform pg_notify('{NOTIFY_CHANNEL}', json_build_object('tipo', 'inventario', 'producto_id', r.producto_id)::text);
+        end loop;
+      end if;
+      return null;
+    end
+    $fn$
+    """))
+    statement_triggers(conn, "pedidos", "pedidos_notify", "notify_pedido", enabled)
+    statement_triggers(conn, "pedido_items", "pedido_items_notify", "notify_pedido_item", enabled)
+
 # --- Routes ------------------------------------------------------------------
 
 @bp.post("/pedidos/<uuid:pedido_id>/approve")
+@query_budget(2)
+@invalidates("inventory")
 def approve_order(pedido_id):
   # Must be manager
   if not _require_approver():
@@ -169,10 +245,7 @@ def approve_order(pedido_id):
   try:
     with engine.begin() as conn:
       # Ensure order exists & not already approved
-      head = conn.execute(
-          text("select id, status from public.pedidos where id = :id"),
-          {"id": str(pedido_id)}
-      ).mappings().first()
+      head = stmts.run(conn, stmts.ORDER_STATUS_BY_ID, {"id": str(pedido_id)}).mappings().first()
       if not head:
         return jsonify({"ok": False, "message": "Pedido no encontrado"}), 404
 
@@ -184,22 +257,13 @@ def approve_order(pedido_id):
       last_err = None
       for st in [c for c in candidates if c]:
         try:
-          r = conn.execute(
-              text("""
-                update public.pedidos
-                set status = :st,
-                    approved_at = now(),
-                    approved_by = :uid,
-                    approved_fecha_local = current_date,
-                    approved_hora_local = current_time
-                where id = :id
-                returning id, status, approved_at, approved_by, approved_fecha_local, approved_hora_local
-              """),
-              {"st": st, "id": str(pedido_id), "uid": str(approver_id)}
-          )
+          r = stmts.run(conn, stmts.ORDER_APPROVE, {"st": st, "id": str(pedido_id), "uid": str(approver_id)})
           row = r.fetchone()
           if row:
             break
+        except StatementTimeout:
+          # Not a rejected label: the 503 handler answers (timeouts.py)
+          raise
         except SQLAlchemyError as e:
           last_err = e
           continue
@@ -213,24 +277,15 @@ def approve_order(pedido_id):
           "message": "No se pudo actualizar el estado. Revise los valores del enum order_status o defina APPROVED_STATUS."
         }), 409
 
-      # Serialize
-      approved_at = row.approved_at.isoformat() if isinstance(row.approved_at, datetime.datetime) else None
-      return jsonify({
-        "ok": True,
-        "pedido": {
-          "id": str(row.id),
-          "status": row.status,
-          "approved_at": approved_at,
-          "approved_by": str(row.approved_by) if row.approved_by else None,
-          "approved_fecha_local": row.approved_fecha_local.isoformat() if isinstance(row.approved_fecha_local, datetime.date) else None,
-          "approved_hora_local": row.approved_hora_local.isoformat(timespec="minutes") if isinstance(row.approved_hora_local, datetime.time) else None,
-        }
-      })
+      return jsonify({"ok": True, "pedido": row._mapping})
+  except StatementTimeout:
+    raise
   except SQLAlchemyError:
     current_app.logger.exception("Error aprobando pedido")
     return jsonify({"ok": False, "message": "Error del servidor"}), 500
 
 @bp.post("/pedidos/start")
+@query_budget(2)
 def start_order():
   user_id = auth_user_id()
   if not user_id:
@@ -249,13 +304,7 @@ def start_order():
   if cliente_id and not nombre:
     eng = get_engine()
     with eng.begin() as conn:
-      row = conn.execute(
-          text("""
-            select nombre, telefono, coalesce(direccion_entrega, direccion) as dir_ent
-            from public.clientes where id = :cid
-          """),
-          {"cid": str(cliente_id)}
-      ).mappings().first()
+      row = stmts.run(conn, stmts.CLIENT_ORDER_DEFAULTS, {"cid": str(cliente_id)}).mappings().first()
     if not row:
       return jsonify({"error": "cliente_id inválido"}), 400
     nombre = row["nombre"] or nombre
@@ -286,13 +335,9 @@ def start_order():
 
   eng = get_engine()
   with eng.begin() as conn:
-    row = conn.execute(
-        text("""
-          insert into public.pedidos
-          (cliente_id, cliente_nombre, cliente_telefono, direccion_entrega, fecha_entrega, usuario_id, fecha_local, hora_local)
-          values (:cid, :n, :t, :d, :fe, :uid, coalesce(:fl, current_date), coalesce(:hl, current_time))
-          returning id
-        """),
+    row = stmts.run(
+        conn,
+        stmts.ORDER_INSERT,
         {
           "cid": str(cliente_id) if cliente_id else None,
           "n": nombre,
@@ -307,94 +352,171 @@ def start_order():
   return jsonify({"pedido_id": row[0]}), 201
 
 @bp.get("/pedidos")
+@query_budget(1)
+@statement_timeout(5000)
+@read_only
 def list_orders():
   user_id = auth_user_id()
   if not user_id:
     return jsonify({"error": "Unauthorized"}), 401
 
   eng = get_engine()
-  sql = text("""
-    with totals as (
-      select
-        i.pedido_id,
-        sum(i.cantidad) as items_count,
-        sum(i.cantidad * i.precio) as total
-      from public.pedido_items i
-      group by i.pedido_id
-    )
-    select
-      p.id, p.status, p.cliente_nombre, p.cliente_telefono, p.direccion_entrega,
-      p.fecha_entrega, p.created_at,
-      coalesce(t.items_count,0) as items_count,
-      coalesce(t.total,0) as total
-    from public.pedidos p
-    left join totals t on t.pedido_id = p.id
-    order by p.created_at desc
-    limit 200
-  """)
   with eng.begin() as conn:
-    rows = conn.execute(sql).mappings().all()
+    rows = stmts.run(conn, stmts.ORDERS_LIST).mappings().all()
 
-  out = []
-  for r in rows:
-    d = dict(r)
-    if isinstance(d.get("fecha_entrega"), datetime.date):
-      d["fecha_entrega"] = d["fecha_entrega"].isoformat()
-    if isinstance(d.get("created_at"), datetime.datetime):
-      d["created_at"] = d["created_at"].isoformat()
-    out.append(d)
-  return jsonify(out)
+  return jsonify(rows)
+
+@bp.get("/pedidos/cambios")
+@query_budget(2)
+@statement_timeout(5000)
+@read_only
+def list_order_changes():
+  """
+  Orders created, changed or deleted since ``since`` (a version from an
+  earlier call): list rows plus the ids of deleted orders. Without ``since``
+  only the current version is returned; 410 when it is older than the
+  change log keeps (changelog.py).
+  """
+  user_id = auth_user_id()
+  if not user_id:
+    return jsonify({"error": "Unauthorized"}), 401
+  since = request.args.get("since")
+  try:
+    since = int(since) if since else None
+  except ValueError:
+    return jsonify({"error": "since debe ser un número de versión"}), 400
+
+  eng = get_engine()
+  with eng.begin() as conn:
+    version, horizon = stmts.run(conn, stmts.CHANGES_VERSION).one()
+    if since is None:
+      return jsonify({"version": version, "items": [], "deleted": []})
+    if horizon is not None and since <= horizon:
+      return jsonify({"error": "Versión demasiado antigua, recargar pedidos", "version": version}), 410
+    rows = stmts.run(conn, stmts.ORDERS_CHANGES, {"since": since}).mappings().all()
+
+  items, deleted = changelog.split(rows)
+  return jsonify({"version": version, "items": items, "deleted": deleted})
+
+EXPORT_FORMATS = ("ndjson", "csv")
+
+def _csv_value(v):
+  # Same text as the JSON wire format (jsonio.py)
+  if v is None:
+    return ""
+  if isinstance(v, datetime.time):
+    return v.isoformat(timespec="minutes")
+  if isinstance(v, (datetime.date, datetime.datetime)):
+    return v.isoformat()
+  return str(v)
+
+def _csv_line(values):
+  buf = io.StringIO()
+  csv.writer(buf).writerow(values)
+  return buf.getvalue().encode("utf-8")
+
+def _iter_csv(result, chunk_rows):
+  buf = io.StringIO()
+  out = csv.writer(buf)
+  out.writerow(result.keys())
+  n = 0
+  for row in result:
+    out.writerow([_csv_value(v) for v in row])
+    n += 1
+    if n >= chunk_rows:
+      yield buf.getvalue().encode("utf-8")
+      buf.seek(0)
+      buf.truncate()
+      n = 0
+  yield buf.getvalue().encode("utf-8")
+
+@bp.get("/pedidos/export")
+@query_budget(1)
+@concurrency_limited("export")
+@read_only
+def export_orders():
+  """
+  Every order line with its order, flattened, for reporting:
+  ?formato=ndjson|csv&desde=YYYY-MM-DD&hasta=YYYY-MM-DD&status=approved&status=...
+  (fecha_local range, inclusive; every status by default). Rows come off a
+  server-side cursor and are written in chunks as they're fetched, so
+  memory stays flat however many lines match. Each FETCH is a statement of
+  its own under the statement timeout, and gthread workers heartbeat from
+  their main thread, so a long download doesn't trip gunicorn's timeout.
+
+  The status only covers the first FETCH. If a later one fails, the file
+  ends with an error line, {"error": ...} in ndjson and a row starting with
+  #ERROR in csv, and the connection is dropped before the chunked body is
+  complete. A file that doesn't end that way has every matching line.
+  """
+  user_id = auth_user_id()
+  if not user_id:
+    return jsonify({"error": "Unauthorized"}), 401
+
+  formato = (request.args.get("formato") or "ndjson").lower()
+  if formato not in EXPORT_FORMATS:
+    return jsonify({"error": "formato debe ser ndjson o csv"}), 400
+  bounds = {}
+  for name in ("desde", "hasta"):
+    v = request.args.get(name)
+    try:
+      bounds[name] = datetime.date.fromisoformat(v) if v else None
+    except ValueError:
+      return jsonify({"error": f"{name} inválida (YYYY-MM-DD)"}), 400
+  statuses = request.args.getlist("status") or sorted(ORDER_STATUSES)
+  if not set(statuses) <= ORDER_STATUSES:
+    return jsonify({"error": f"status debe ser uno de {sorted(ORDER_STATUSES)}"}), 400
+
+  eng = get_engine()
+  params = {**bounds, "statuses": statuses}
+
+  def stream(encode):
+    with eng.connect() as conn:
+      conn = conn.execution_options(stream_results=True, yield_per=jsonio.STREAM_CHUNK_ROWS)
+      yield from encode(stmts.run(conn, stmts.ORDERS_EXPORT, params))
+
+  if formato == "ndjson":
+    return jsonio.stream_ndjson(stream(lambda res: res.mappings()))
+
+  name = "_".join(["pedidos"] + [d.isoformat() for d in bounds.values() if d])
+  return jsonio.stream_chunks(
+    stream(lambda res: _iter_csv(res, jsonio.STREAM_CHUNK_ROWS)), _csv_line(["#ERROR", jsonio.STREAM_ERROR]),
+    "text/csv", headers={"Content-Disposition": f'attachment; filename="{name}.csv"'},
+  )
 
 @bp.get("/pedidos/<uuid:pedido_id>")
+@query_budget(1)
+@statement_timeout(2000)
+@read_only
 def get_order(pedido_id):
   user_id = auth_user_id()
   if not user_id:
     return jsonify({"error": "Unauthorized"}), 401
   eng = get_engine()
   with eng.begin() as conn:
-    head = conn.execute(
-        text("""select id, status, cliente_nombre, cliente_telefono, direccion_entrega,
-                       fecha_entrega, fecha_local, hora_local, created_at,
-                       approved_at, approved_by, approved_fecha_local, approved_hora_local
-               from public.pedidos where id = :id"""),
-        {"id": str(pedido_id)}
-    ).mappings().first()
-    if not head:
-      return jsonify({"error": "Pedido no encontrado"}), 404
-
-    items = conn.execute(
-        text("""select id, pedido_id, producto_id, referencia, descripcion, cantidad, precio, created_at
-                from public.pedido_items where pedido_id = :id order by created_at asc"""),
-        {"id": str(pedido_id)}
-    ).mappings().all()
-
-  # Serialize date/time fields to ISO strings
-  h = dict(head)
-  if isinstance(h.get("fecha_entrega"), datetime.date):
-    h["fecha_entrega"] = h["fecha_entrega"].isoformat()
-  if isinstance(h.get("fecha_local"), datetime.date):
-    h["fecha_local"] = h["fecha_local"].isoformat()
-  if isinstance(h.get("hora_local"), datetime.time):
-    h["hora_local"] = h["hora_local"].isoformat(timespec="minutes")
-  if isinstance(h.get("created_at"), datetime.datetime):
-    h["created_at"] = h["created_at"].isoformat()
-  if isinstance(h.get("approved_at"), datetime.datetime):
-    h["approved_at"] = h["approved_at"].isoformat()
-  if isinstance(h.get("approved_fecha_local"), datetime.date):
-    h["approved_fecha_local"] = h["approved_fecha_local"].isoformat()
-  if isinstance(h.get("approved_hora_local"), datetime.time):
-    h["approved_hora_local"] = h["approved_hora_local"].isoformat(timespec="minutes")
-  if h.get("approved_by"):
-    h["approved_by"] = str(h["approved_by"])
-
-  out_items = []
-  for i in items:
-    d = dict(i)
-    if isinstance(d.get("created_at"), datetime.datetime):
-      d["created_at"] = d["created_at"].isoformat()
-    out_items.append(d)
-
-  return jsonify({"pedido": h, "items": out_items})
+    rows = stmts.run(conn, stmts.ORDER_DETAIL, {"id": str(pedido_id)}).mappings().all()
+  if not rows:
+    return jsonify({"error": "Pedido no encontrado"}), 404
+  return jsonify(order_detail_body(rows))
+
+def order_detail_body(rows):
+  """{"pedido", "items"} from ORDER_DETAIL rows (shared with asgi.py)."""
+  # One row per item (or a single row with null item_* when the order is empty)
+  head = {k: v for k, v in rows[0].items() if not k.startswith("item_")}
+  items = [
+    {
+      "id": r["item_id"],
+      "pedido_id": head["id"],
+      "producto_id": r["item_producto_id"],
+      "referencia": r["item_referencia"],
+      "descripcion": r["item_descripcion"],
+      "cantidad": r["item_cantidad"],
+      "precio": r["item_precio"],
+      "created_at": r["item_created_at"],
+    }
+    for r in rows if r["item_id"] is not None
+  ]
+  return {"pedido": head, "items": items}
 
 def _available_for_order(conn, producto_id, pedido_id):
   """
@@ -403,143 +525,430 @@ def _available_for_order(conn, producto_id, pedido_id):
   (It does NOT subtract what is already in this order; callers should do that
   if they need the remaining headroom for this order.)
   """
-  stock = conn.execute(
-      text("""select coalesce(sum(case when clase='entrada' then cantidad else -cantidad end),0)
-              from public.inventario_movimientos
-              where producto_id = :pid"""),
-      {"pid": producto_id}
+  available = stmts.run(
+      conn, stmts.PRODUCT_AVAILABLE, {"pid": str(producto_id), "po": str(pedido_id)}
   ).scalar() or 0
-
-  reserved_others = conn.execute(
-      text("""select coalesce(sum(i.cantidad),0)
-              from public.pedido_items i
-              join public.pedidos p on p.id = i.pedido_id
-              where i.producto_id = :pid
-                and p.status in ('draft','submitted')
-                and p.id <> :po"""),
-      {"pid": producto_id, "po": str(pedido_id)}
-  ).scalar() or 0
-
-  return float(stock) - float(reserved_others)
+  return float(available)
+
+def _num(x):
+  return int(x) if float(x).is_integer() else x
+
+def _parse_lines(b):
+  """Normalize the request body to a list of lines; returns (lines, error)."""
+  raw = b["items"] if isinstance(b.get("items"), list) else [b]
+  if not raw:
+    return None, "items vacío"
+  lines = []
+  for idx, it in enumerate(raw):
+    if not isinstance(it, dict):
+      return None, f"items[{idx}] inválido"
+    try:
+      qty = float(it.get("cantidad"))
+    except Exception:
+      qty = 0.0
+    if qty <= 0:
+      return None, "cantidad debe ser > 0" if len(raw) == 1 else f"items[{idx}]: cantidad debe ser > 0"
+    pid = it.get("producto_id")
+    if pid:
+      try:
+        pid = str(uuid.UUID(str(pid)))
+      except ValueError:
+        pid = "invalid:" + str(pid)
+    lines.append({
+      "producto_id": pid,
+      "referencia": it.get("referencia"),
+      "cantidad": qty,
+      "precio": it.get("precio"),
+    })
+  return lines, None
 
 @bp.post("/pedidos/<uuid:pedido_id>/items")
+@query_budget(4)
+@invalidates("inventory")
 def add_or_update_item(pedido_id):
   """
   Add items by SUMMING quantity when the product already exists in the order.
   Clamp to available (stock - reserved_others - current_in_this_order).
   Returns metadata for UI feedback: merged, added, final_qty, note.
+
+  Accepts one line ({producto_id|referencia, cantidad, precio}) or a batch
+  ({"items": [line, ...]}); a batch is resolved and written set-wise, so the
+  number of statements doesn't grow with the number of lines.
   """
   user_id = auth_user_id()
   if not user_id:
     return jsonify({"error": "Unauthorized"}), 401
 
   b = request.get_json(force=True) or {}
-  cantidad = b.get("cantidad")
-  precio = b.get("precio")
-  producto_id = b.get("producto_id")
-  referencia = b.get("referencia")
-
-  # cantidad must be > 0
-  try:
-    requested_qty = float(cantidad)
-  except Exception:
-    return jsonify({"error": "cantidad debe ser > 0"}), 400
-  if requested_qty <= 0:
-    return jsonify({"error": "cantidad debe ser > 0"}), 400
+  batch = isinstance(b.get("items"), list)
+  lines, err = _parse_lines(b)
+  if err:
+    return jsonify({"error": err}), 400
 
+  po = str(pedido_id)
   eng = get_engine()
   with eng.begin() as conn:
-    # Resolve product
-    if not producto_id:
-      row = conn.execute(
-        text("select id, referencia, descripcion, precio_lista from public.productos where referencia = :r"),
-        {"r": referencia}
-      ).mappings().first()
-    else:
-      row = conn.execute(
-        text("select id, referencia, descripcion, precio_lista from public.productos where id = :id"),
-        {"id": producto_id}
-      ).mappings().first()
-    if not row:
-      return jsonify({"error": "Producto no encontrado"}), 404
-
-    # Base price (keep existing row price when merging unless an explicit price is provided)
-    precio_final = float(precio) if isinstance(precio, (int, float)) else float(row["precio_lista"] or 0)
-
-    # Total available for THIS order ignoring what's already in it
-    available_total = _available_for_order(conn, row["id"], pedido_id)
-
-    # Check if item already exists in this order
-    existing = conn.execute(
-      text("select id, cantidad, precio from public.pedido_items where pedido_id = :po and producto_id = :pid"),
-      {"po": str(pedido_id), "pid": row["id"]}
-    ).mappings().first()
-
-    existing_qty = float(existing["cantidad"]) if existing else 0.0
-    remaining_headroom = max(0.0, float(available_total) - existing_qty)
-
-    # How much can we actually add now?
-    to_add = max(0.0, min(requested_qty, remaining_headroom))
-
-    # If nothing can be added, return OK with details (keeps UI flow simple)
-    if to_add <= 0.0:
-      return jsonify({
-        "ok": True,
-        "item_id": str(existing["id"]) if existing else None,
-        "merged": bool(existing),
-        "added": 0,
-        "final_qty": int(existing_qty) if float(existing_qty).is_integer() else existing_qty,
-        "note": "Sin stock disponible para aumentar cantidad."
+    # Resolve products, availability and existing lines in one round trip
+    ids = sorted({l["producto_id"] for l in lines if l["producto_id"] and not l["producto_id"].startswith("invalid:")})
+    refs = sorted({l["referencia"] for l in lines if not l["producto_id"] and l["referencia"]})
+    found = stmts.run(conn, stmts.ORDER_LINES_RESOLVE, {"ids": ids, "refs": refs, "po": po}).mappings().all() if ids or refs else []
+    by_id = {str(r["id"]): r for r in found}
+    by_ref = {r["referencia"]: r for r in found}
+
+    missing = []
+    for l in lines:
+      row = by_id.get(l["producto_id"]) if l["producto_id"] else by_ref.get(l["referencia"])
+      if not row:
+        missing.append(l["producto_id"] or l["referencia"])
+      l["row"] = row
+    if missing:
+      if not batch:
+        return jsonify({"error": "Producto no encontrado"}), 404
+      return jsonify({"error": "Producto no encontrado", "productos": missing}), 404
+
+    # Walk the lines in order; repeated products accumulate on the same line
+    state = {}
+    results = []
+    for l in lines:
+      row = l["row"]
+      pid = str(row["id"])
+      st = state.get(pid)
+      if st is None:
+        st = state[pid] = {
+          "available": float(row["available"] or 0),
+          "item_id": row["item_id"],
+          "qty": float(row["item_cantidad"]) if row["item_id"] else 0.0,
+          "price": float(row["item_precio"]) if row["item_id"] else None,
+          "row": row,
+          "new": False,
+          "dirty": False,
+        }
+      exists = st["item_id"] is not None or st["new"]
+      remaining_headroom = max(0.0, st["available"] - st["qty"])
+      to_add = max(0.0, min(l["cantidad"], remaining_headroom))
+      precio = l["precio"]
+
+      # If nothing can be added, report OK with details (keeps UI flow simple)
+      if to_add <= 0.0:
+        results.append({"pid": pid, "merged": exists, "added": 0, "final_qty": _num(st["qty"]),
+                        "note": "Sin stock disponible para aumentar cantidad.", "status": 200})
+        continue
+
+      if exists:
+        # Keep current price unless an explicit price was provided in this call
+        if isinstance(precio, (int, float)):
+          st["price"] = float(precio)
+        st["qty"] += to_add
+        st["dirty"] = not st["new"]
+        results.append({"pid": pid, "merged": True, "added": _num(to_add), "final_qty": _num(st["qty"]),
+                        "note": "Cantidad acumulada y limitada por stock.", "status": 200})
+      else:
+        # New line: insert clamped quantity
+        st["price"] = float(precio) if isinstance(precio, (int, float)) else float(row["precio_lista"] or 0)
+        st["qty"] = to_add
+        st["new"] = True
+        results.append({"pid": pid, "merged": False, "added": _num(to_add), "final_qty": _num(to_add),
+                        "note": "Ítem creado y cantidad limitada por stock si aplica.", "status": 201})
+
+    updates = [st for st in state.values() if st["dirty"]]
+    if updates:
+      stmts.run(conn, stmts.ORDER_ITEMS_UPDATE_MANY, {
+        "ids": [str(st["item_id"]) for st in updates],
+        "cs": [st["qty"] for st in updates],
+        "ps": [st["price"] for st in updates],
       })
 
-    if existing:
-      # Keep current price unless an explicit price was provided in this call
-      new_price = float(precio) if isinstance(precio, (int, float)) else float(existing["precio"])
-      new_qty = existing_qty + to_add
-
-      conn.execute(
-        text("""update public.pedido_items
-                set cantidad = :c, precio = :p
-                where id = :id"""),
-        {"c": new_qty, "p": new_price, "id": existing["id"]}
-      )
-
-      return jsonify({
-        "ok": True,
-        "item_id": str(existing["id"]),
-        "merged": True,
-        "added": int(to_add) if float(to_add).is_integer() else to_add,
-        "final_qty": int(new_qty) if float(new_qty).is_integer() else new_qty,
-        "note": "Cantidad acumulada y limitada por stock."
-      }), 200
-
-    # New line: insert clamped quantity
-    ins_qty = to_add  # remaining_headroom already applied
-    item_id = conn.execute(
-      text("""insert into public.pedido_items
-              (pedido_id, producto_id, referencia, descripcion, cantidad, precio)
-              values (:po, :pid, :ref, :desc, :c, :p)
-              returning id"""),
-      {
-        "po": str(pedido_id),
-        "pid": row["id"],
-        "ref": row["referencia"],
-        "desc": row["descripcion"],
-        "c": ins_qty,
-        "p": precio_final
-      }
-    ).scalar()
-
-    return jsonify({
+    inserts = [st for st in state.values() if st["new"]]
+    if inserts:
+      created = stmts.run(conn, stmts.ORDER_ITEMS_INSERT_MANY, {
+        "po": po,
+        "pids": [str(st["row"]["id"]) for st in inserts],
+        "refs": [st["row"]["referencia"] for st in inserts],
+        "descs": [st["row"]["descripcion"] for st in inserts],
+        "cs": [st["qty"] for st in inserts],
+        "ps": [st["price"] for st in inserts],
+      }).all()
+      for item_id, producto_id in created:
+        state[str(producto_id)]["item_id"] = item_id
+
+  out = []
+  for r in results:
+    item_id = state[r["pid"]]["item_id"]
+    out.append({
       "ok": True,
-      "item_id": str(item_id),
-      "merged": False,
-      "added": int(ins_qty) if float(ins_qty).is_integer() else ins_qty,
-      "final_qty": int(ins_qty) if float(ins_qty).is_integer() else ins_qty,
-      "note": "Ítem creado y cantidad limitada por stock si aplica."
-    }), 201
+      "item_id": str(item_id) if item_id else None,
+      "merged": r["merged"],
+      "added": r["added"],
+      "final_qty": r["final_qty"],
+      "note": r["note"],
+    })
+
+  if batch:
+    created_any = any(r["status"] == 201 for r in results)
+    return jsonify({"ok": True, "items": out}), 201 if created_any else 200
+  return jsonify(out[0]), results[0]["status"]
+
+# --- Bulk import -------------------------------------------------------------
+
+MAX_IMPORT_LINES = 5000
+IMPORT_TYPES = ("text/csv", "application/x-ndjson", "application/ndjson")
+IMPORT_ORDER_FIELDS = (
+  "cliente_id", "cliente_email", "cliente_nombre", "cliente_telefono", "direccion_entrega", "fecha_entrega",
+)
+# No order: ORDER_LINES_RESOLVE then counts every open order's reservations
+_NO_ORDER = "00000000-0000-0000-0000-000000000000"
+
+def _import_text(v):
+  if v is None:
+    return None
+  return str(v).strip() or None
+
+# Bound of pedido_items' numeric(12,2) columns
+IMPORT_NUMBER_LIMIT = 1e10
+
+def _import_number(v):
+  """float from a JSON number or a spreadsheet cell ("12,5" too); None if
+  invalid, not finite ("nan", "inf") or too large for numeric(12,2)."""
+  if isinstance(v, bool):
+    return None
+  if isinstance(v, (int, float)):
+    n = float(v)
+  else:
+    s = _import_text(v)
+    if s is None:
+      return None
+    if "," in s and "." not in s:
+      s = s.replace(",", ".")
+    try:
+      n = float(s)
+    except ValueError:
+      return None
+  if not math.isfinite(n) or abs(n) >= IMPORT_NUMBER_LIMIT:
+    return None
+  return n
+
+def _import_rows():
+  """[(line number, row dict)] from a CSV (header row, "," ";" or tab) or NDJSON body; returns (rows, error)."""
+  body = request.get_data(as_text=True).lstrip("\ufeff")  # Excel writes a BOM
+  rows = []
+  if request.mimetype == "text/csv":
+    try:
+      dialect = csv.Sniffer().sniff(body.split("\n", 1)[0], delimiters=",;\t")
+    except csv.Error:
+      dialect = csv.excel
+    reader = csv.DictReader(io.StringIO(body), dialect=dialect)
+    for r in reader:
+      rows.append((reader.line_num, {(k or "").strip().lower(): v for k, v in r.items() if k is not None}))
+  else:
+    for n, line in enumerate(body.splitlines(), 1):
+      if not line.strip():
+        continue
+      try:
+        obj = json.loads(line)
+      except ValueError:
+        return None, f"línea {n}: JSON inválido"
+      if not isinstance(obj, dict):
+        return None, f"línea {n}: se esperaba un objeto"
+      rows.append((n, obj))
+  return rows, None
+
+@bp.post("/pedidos/import")
+@query_budget(4)
+@concurrency_limited("import")
+@invalidates("inventory")
+def import_orders():
+  """
+  Create many orders and their lines in one transaction, from CSV (with a
+  header row) or NDJSON, one order line per row:
+
+    pedido            groups rows into orders (without it the file is one order)
+    cliente_id | cliente_email, or cliente_nombre + cliente_telefono + direccion_entrega
+    fecha_entrega     YYYY-MM-DD
+    producto_id | referencia, cantidad, precio (optional, default precio_lista)
+
+  Order fields may be on any row of their order; the client fills in the
+  missing ones, as in /pedidos/start. Clients and products are resolved
+  set-wise and quantities clamped to availability like add_or_update_item,
+  in file order, so orders in the same file don't promise the same stock
+  twice. Any invalid row rejects the file (400 listing every error) and
+  nothing is written. Otherwise 201 with the orders and a result per line.
+  """
+  user_id = auth_user_id()
+  if not user_id:
+    return jsonify({"error": "Unauthorized"}), 401
+
+  if request.mimetype not in IMPORT_TYPES:
+    return jsonify({"error": "Content-Type debe ser text/csv o application/x-ndjson"}), 415
+  raw, err = _import_rows()
+  if err:
+    return jsonify({"error": err}), 400
+  if not raw:
+    return jsonify({"error": "archivo vacío"}), 400
+  if len(raw) > MAX_IMPORT_LINES:
+    return jsonify({"error": f"máximo {MAX_IMPORT_LINES} líneas por importación"}), 400
+
+  errors = []
+  orders = {}
+  lines = []
+  for linea, r in raw:
+    key = _import_text(r.get("pedido"))
+    o = orders.setdefault(key, {"key": key, "fields": {}, "lines": []})
+    for f in IMPORT_ORDER_FIELDS:
+      v = _import_text(r.get(f))
+      if v and f not in o["fields"]:
+        o["fields"][f] = v
+
+    pid = _import_text(r.get("producto_id"))
+    ref = _import_text(r.get("referencia"))
+    qty = _import_number(r.get("cantidad"))
+    precio = None
+    if _import_text(r.get("precio")) is not None:
+      precio = _import_number(r.get("precio"))
+      if precio is None or precio < 0:
+        errors.append({"linea": linea, "error": "precio inválido"})
+    if pid:
+      try:
+        pid = str(uuid.UUID(pid))
+      except ValueError:
+        errors.append({"linea": linea, "error": "producto_id inválido"})
+        pid = None
+    elif not ref:
+      errors.append({"linea": linea, "error": "producto_id o referencia requerido"})
+    if qty is None:
+      errors.append({"linea": linea, "error": "cantidad inválida"})
+    elif qty <= 0:
+      errors.append({"linea": linea, "error": "cantidad debe ser > 0"})
+    line = {"linea": linea, "producto_id": pid, "referencia": ref, "cantidad": qty or 0.0, "precio": precio}
+    o["lines"].append(line)
+    lines.append(line)
+
+  cids, emails = set(), set()
+  for o in orders.values():
+    f = o["fields"]
+    if f.get("cliente_id"):
+      try:
+        f["cliente_id"] = str(uuid.UUID(f["cliente_id"]))
+        cids.add(f["cliente_id"])
+      except ValueError:
+        errors.append({"pedido": o["key"], "error": "cliente_id inválido"})
+        del f["cliente_id"]
+    elif f.get("cliente_email"):
+      f["cliente_email"] = f["cliente_email"].lower()
+      emails.add(f["cliente_email"])
+
+  eng = get_engine()
+  with eng.begin() as conn:
+    # Every client and product of the file, with availability, in two lookups
+    clients = stmts.run(conn, stmts.CLIENTS_ORDER_DEFAULTS_MANY, {
+      "ids": sorted(cids), "emails": sorted(emails),
+    }).mappings().all() if cids or emails else []
+    by_cid = {str(c["id"]): c for c in clients}
+    by_email = {c["email"]: c for c in clients if c["email"]}
+
+    ids = sorted({l["producto_id"] for l in lines if l["producto_id"]})
+    refs = sorted({l["referencia"] for l in lines if not l["producto_id"] and l["referencia"]})
+    found = stmts.run(conn, stmts.ORDER_LINES_RESOLVE, {
+      "ids": ids, "refs": refs, "po": _NO_ORDER,
+    }).mappings().all() if ids or refs else []
+    by_id = {str(p["id"]): p for p in found}
+    by_ref = {p["referencia"]: p for p in found}
+
+    for l in lines:
+      if l["producto_id"] or l["referencia"]:
+        l["row"] = by_id.get(l["producto_id"]) if l["producto_id"] else by_ref.get(l["referencia"])
+        if not l["row"]:
+          errors.append({"linea": l["linea"], "error": "Producto no encontrado"})
+
+    for o in orders.values():
+      f = o["fields"]
+      client = None
+      if f.get("cliente_id"):
+        client = by_cid.get(f["cliente_id"])
+        if not client:
+          errors.append({"pedido": o["key"], "error": "cliente_id inválido"})
+      elif f.get("cliente_email"):
+        client = by_email.get(f["cliente_email"])
+        if not client:
+          errors.append({"pedido": o["key"], "error": "cliente_email no encontrado"})
+      o["cliente_id"] = str(client["id"]) if client else None
+      o["nombre"] = f.get("cliente_nombre") or (client and client["nombre"]) or None
+      o["tel"] = f.get("cliente_telefono") or (client and client["telefono"]) or None
+      o["dir"] = f.get("direccion_entrega") or (client and client["dir_ent"]) or None
+      if client or not (f.get("cliente_id") or f.get("cliente_email")):
+        if not o["nombre"]:
+          errors.append({"pedido": o["key"], "error": "cliente_nombre requerido (o cliente_id / cliente_email)"})
+        if not o["tel"]:
+          errors.append({"pedido": o["key"], "error": "cliente_telefono requerido"})
+        if not o["dir"]:
+          errors.append({"pedido": o["key"], "error": "direccion_entrega requerida"})
+      try:
+        o["fecha_entrega"] = datetime.date.fromisoformat(str(f.get("fecha_entrega"))).isoformat()
+      except Exception:
+        errors.append({"pedido": o["key"], "error": "fecha_entrega inválida (YYYY-MM-DD)"})
+
+    if errors:
+      return jsonify({"error": "Importación rechazada", "errores": errors}), 400
+
+    # Walk the file in order. Availability is shared by all its orders;
+    # repeated products accumulate on the same line of an order.
+    headroom = {}
+    results = []
+    for o in orders.values():
+      o["id"] = str(uuid.uuid4())
+      state = {}
+      for l in o["lines"]:
+        row = l["row"]
+        pid = str(row["id"])
+        available = headroom.setdefault(pid, max(0.0, float(row["available"] or 0)))
+        st = state.get(pid)
+        to_add = max(0.0, min(l["cantidad"], available))
+        result = {"linea": l["linea"], "pedido_id": o["id"], "producto_id": pid, "merged": st is not None}
+        if to_add <= 0.0:
+          result.update(added=0, final_qty=_num(st["qty"]) if st else 0,
+                        note="Sin stock disponible para aumentar cantidad.")
+        elif st:
+          if l["precio"] is not None:
+            st["price"] = l["precio"]
+          st["qty"] += to_add
+          result.update(added=_num(to_add), final_qty=_num(st["qty"]), note="Cantidad acumulada y limitada por stock.")
+        else:
+          price = l["precio"] if l["precio"] is not None else float(row["precio_lista"] or 0)
+          st = state[pid] = {"row": row, "qty": to_add, "price": price}
+          result.update(added=_num(to_add), final_qty=_num(to_add),
+                        note="Ítem creado y cantidad limitada por stock si aplica.")
+        headroom[pid] = available - to_add
+        results.append(result)
+      o["items"] = list(state.values())
+
+    stmts.run(conn, stmts.ORDERS_IMPORT, {
+      "uid": user_id,
+      "ids": [o["id"] for o in orders.values()],
+      "cids": [o["cliente_id"] for o in orders.values()],
+      "ns": [o["nombre"] for o in orders.values()],
+      "ts": [o["tel"] for o in orders.values()],
+      "ds": [o["dir"] for o in orders.values()],
+      "fes": [o["fecha_entrega"] for o in orders.values()],
+    })
+    items = [(o["id"], st) for o in orders.values() for st in o["items"]]
+    if items:
+      stmts.run(conn, stmts.ORDER_ITEMS_IMPORT, {
+        "pos": [po for po, _ in items],
+        "pids": [str(st["row"]["id"]) for _, st in items],
+        "refs": [st["row"]["referencia"] for _, st in items],
+        "descs": [st["row"]["descripcion"] for _, st in items],
+        "cs": [st["qty"] for _, st in items],
+        "ps": [st["price"] for _, st in items],
+      })
+
+  return jsonify({
+    "ok": True,
+    "pedidos": [{"pedido": o["key"], "pedido_id": o["id"], "items": len(o["items"])} for o in orders.values()],
+    "lineas": results,
+  }), 201
 
 @bp.put("/pedidos/<uuid:pedido_id>/items/<uuid:item_id>")
+@query_budget(3)
+@invalidates("inventory")
 def update_item(pedido_id, item_id):
   user_id = auth_user_id()
   if not user_id:
@@ -552,10 +961,7 @@ def update_item(pedido_id, item_id):
 
   eng = get_engine()
   with eng.begin() as conn:
-    item = conn.execute(
-      text("select id, producto_id, cantidad, precio from public.pedido_items where id = :id and pedido_id = :po"),
-      {"id": str(item_id), "po": str(pedido_id)}
-    ).mappings().first()
+    item = stmts.run(conn, stmts.ORDER_ITEM_BY_ID, {"id": str(item_id), "po": str(pedido_id)}).mappings().first()
     if not item:
       return jsonify({"error": "Ítem no encontrado"}), 404
 
@@ -569,43 +975,40 @@ def update_item(pedido_id, item_id):
     if new_qty > float(available_total):
       return jsonify({"error": f"Cantidad solicitada supera el disponible ({available_total:g})"}), 400
 
-    conn.execute(
-      text("update public.pedido_items set cantidad = :c, precio = :p where id = :id"),
-      {"c": new_qty, "p": new_price, "id": str(item_id)}
-    )
+    stmts.run(conn, stmts.ORDER_ITEM_UPDATE, {"c": new_qty, "p": new_price, "id": str(item_id)})
 
   return jsonify({"ok": True})
 
 @bp.delete("/pedidos/<uuid:pedido_id>/items/<uuid:item_id>")
+@query_budget(1)
+@invalidates("inventory")
 def delete_item(pedido_id, item_id):
   user_id = auth_user_id()
   if not user_id:
     return jsonify({"error": "Unauthorized"}), 401
   eng = get_engine()
   with eng.begin() as conn:
-    conn.execute(
-      text("delete from public.pedido_items where id = :id and pedido_id = :po"),
-      {"id": str(item_id), "po": str(pedido_id)}
-    )
+    stmts.run(conn, stmts.ORDER_ITEM_DELETE, {"id": str(item_id), "po": str(pedido_id)})
   return jsonify({"ok": True})
 
 @bp.post("/pedidos/<uuid:pedido_id>/submit")
+@query_budget(1)
+@invalidates("inventory")
 def submit_order(pedido_id):
   user_id = auth_user_id()
   if not user_id:
     return jsonify({"error": "Unauthorized"}), 401
   eng = get_engine()
   with eng.begin() as conn:
-    conn.execute(
-      text("update public.pedidos set status = 'submitted' where id = :id"),
-      {"id": str(pedido_id)}
-    )
+    stmts.run(conn, stmts.ORDER_SUBMIT, {"id": str(pedido_id)})
   return jsonify({"ok": True})
 
 # REPLACE the existing delete endpoint with this one
 
 @bp.route("/pedidos/<uuid:pedido_id>", methods=["DELETE"])
 @bp.route("/pedidos/<pedido_id>", methods=["DELETE"])  # also accept string ids
+@query_budget(2)
+@invalidates("inventory")
 def delete_order(pedido_id):
   user_id = auth_user_id()
   if not user_id:
@@ -617,11 +1020,8 @@ def delete_order(pedido_id):
   eng = get_engine()
   with eng.begin() as conn:
     # remove items first (in case FK doesn't cascade)
-    conn.execute(text("delete from public.pedido_items where pedido_id = :pid"), {"pid": pid})
-    gone = conn.execute(
-      text("delete from public.pedidos where id = :pid returning id"),
-      {"pid": pid}
-    ).first()
+    stmts.run(conn, stmts.ORDER_ITEMS_DELETE_ALL, {"pid": pid})
+    gone = stmts.run(conn, stmts.ORDER_DELETE, {"pid": pid}).first()
     if not gone:
       return jsonify({"error": "Pedido no encontrado"}), 404
 
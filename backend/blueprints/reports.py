@@ -0,0 +1,95 @@
+from flask import Blueprint, request, jsonify, current_app
+import datetime
+import jwt
+
+import jobs
+import sales
+import statements as stmts
+from db import read_only, route_read
+from querybudget import query_budget
+from timeouts import statement_timeout
+
+bp = Blueprint("reports", __name__)
+
+# ?por= -> statement over the matching rollup
+SALES_GROUPINGS = {
+    "producto": stmts.SALES_BY_PRODUCT,
+    "cliente": stmts.SALES_BY_CLIENT,
+    "vendedor": stmts.SALES_BY_SELLER,
+    "dia": stmts.SALES_DAILY,
+}
+
+DEFAULT_DAYS = 30
+
+def get_engine():
+    eng = current_app.config.get("ENGINE")
+    if not eng:
+        raise RuntimeError("DB engine is not available in app.config['ENGINE']")
+    return route_read(eng)
+
+def _claims():
+    auth = request.headers.get("Authorization", "")
+    if not auth.lower().startswith("bearer "):
+        return None
+    token = auth.split(" ", 1)[1].strip()
+    try:
+        return jwt.decode(token, current_app.config["JWT_SECRET"], algorithms=["HS256"])
+    except Exception:
+        return None
+
+# ---- Endpoints --------------------------------------------------------------
+
+@bp.get("/reportes/ventas")
+@query_budget(2)
+@statement_timeout(5000)
+@read_only
+def sales_report():
+    """
+    Sales of approved orders by producto, cliente, vendedor or dia:
+    ?por=producto&desde=YYYY-MM-DD&hasta=YYYY-MM-DD&limit=50 (approval day,
+    inclusive; the last DEFAULT_DAYS days by default). Read from the daily
+    rollups, so the cost follows the number of days and keys, not of order
+    lines. ``actualizado`` is when the rollups were last refreshed
+    (sales.py); orders approved since then aren't counted yet.
+    """
+    claims = _claims()
+    if not claims:
+        return jsonify({"error": "Unauthorized"}), 401
+    if claims.get("profile") not in ("admin", "manager"):
+        return jsonify({"error": "No autorizado"}), 403
+
+    por = request.args.get("por") or "producto"
+    if por not in SALES_GROUPINGS:
+        return jsonify({"error": f"por debe ser uno de {sorted(SALES_GROUPINGS)}"}), 400
+    bounds = {}
+    for name in ("desde", "hasta"):
+        v = request.args.get(name)
+        try:
+            bounds[name] = datetime.date.fromisoformat(v) if v else None
+        except ValueError:
+            return jsonify({"error": f"{name} inválida (YYYY-MM-DD)"}), 400
+    hasta = bounds["hasta"] or datetime.date.today()
+    desde = bounds["desde"] or hasta - datetime.timedelta(days=DEFAULT_DAYS - 1)
+    if desde > hasta:
+        return jsonify({"error": "desde no puede ser posterior a hasta"}), 400
+    try:
+        limit = max(1, min(int(request.args.get("limit") or (366 if por == "dia" else 50)), 1000))
+    except ValueError:
+        return jsonify({"error": "limit inválido"}), 400
+
+    with get_engine().begin() as conn:
+        actualizado = stmts.run(conn, stmts.SALES_STATE).scalar()
+        rows = stmts.run(conn, SALES_GROUPINGS[por], {"desde": desde, "hasta": hasta, "lim": limit}).mappings().all()
+
+    return jsonify({
+        "por": por, "desde": desde.isoformat(), "hasta": hasta.isoformat(),
+        "actualizado": actualizado, "items": rows,
+    })
+
+# ---- Jobs -------------------------------------------------------------------
+# sales.py's rollup refresh: scheduled every SALES_REFRESH_INTERVAL_SECONDS,
+# also enqueued from POST /jobs (see jobs.py)
+
+@jobs.job("sales_refresh", profiles=("admin", "manager"), every="SALES_REFRESH_INTERVAL_SECONDS")
+def sales_refresh_job(ctx, params):
+    return sales.refresh(ctx.engine, full=bool(params.get("full")))
@@ -0,0 +1,157 @@
+"""Cross-worker cache invalidation over Postgres LISTEN/NOTIFY.
+
+Each gunicorn worker keeps its own in-memory caches (usercache.py, and
+resultcache.py in local mode). A write served by one worker evicts its own
+copy directly. The other workers learn about it from this bus: one thread
+per worker holds a LISTEN connection and hands every message to the
+subscribed caches.
+
+Two channels feed it:
+
+    db.NOTIFY_CHANNEL      the change feed the schema triggers already emit
+                           for inventario_movimientos, pedidos and
+                           pedido_items (also streamed to SSE clients);
+                           EVENT_SCOPES maps its "tipo" to cache scopes.
+    stmts.CACHE_CHANNEL    explicit {"scope", "key", "origin"} messages that
+                           write statements emit with pg_notify in the same
+                           statement (see PREFS_UPSERT, USER_DELETE).
+
+NOTIFY is transactional: listeners hear about a write only once it has
+committed, and never about one that rolled back. A message from this
+worker's own origin is skipped, because that worker already evicted.
+
+Caches subscribe with ``fn(scope, key)``. A ``key`` of None means the whole
+scope, and a ``scope`` of None means everything. Everything is flushed
+whenever the listener (re)connects, since messages sent while it was away
+are lost. LISTEN needs a session, so the bus connects with DATABASE_URL and
+stays off when that URL points at a transaction pooler. In that case the
+caches' TTLs alone bound staleness.
+"""
+import json
+import os
+import select
+import socket
+import threading
+
+import psycopg2
+from sqlalchemy.engine import make_url
+
+import db
+import metrics
+import statements as stmts
+
+# Domain events (db.NOTIFY_CHANNEL) -> cache scopes they make stale. Item
+# changes move reservations and order status changes release them, so
+# both touch the inventory summary.
+EVENT_SCOPES = {
+    "inventario": ("inventory",),
+    "pedido": ("inventory",),
+}
+
+KEEPALIVE_SECONDS = 30  # idle probe, so a dead connection is noticed
+
+MESSAGES = metrics.counter("cache_bus_messages_total", "Invalidation messages received, by scope.", ("scope",))
+CONNECTED = metrics.gauge("cache_bus_connected", "1 while this worker's invalidation listener is connected.", ())
+
+_subscribers = []
+_state = {"pid": None, "thread": None, "stop": threading.Event()}
+_lock = threading.Lock()
+
+
+def subscribe(fn):
+    """Call ``fn(scope, key)`` for every invalidation this worker hears about."""
+    _subscribers.append(fn)
+    return fn
+
+
+def origin():
+    """This worker's id in CACHE_CHANNEL messages (per process: workers fork)."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _publish_local(scope, key):
+    for fn in _subscribers:
+        try:
+            fn(scope, key)
+        except Exception as e:
+            print(f"[CACHE] subscriber {getattr(fn, '__qualname__', fn)} failed: {e}")
+
+
+def _dispatch(channel, payload):
+    try:
+        msg = json.loads(payload)
+    except ValueError:
+        return
+    if channel == stmts.CACHE_CHANNEL:
+        if msg.get("origin") == origin():
+            return
+        scopes, key = (msg.get("scope"),), msg.get("key")
+    else:
+        scopes, key = EVENT_SCOPES.get(msg.get("tipo"), ()), None
+    for scope in scopes:
+        if scope:
+            MESSAGES.inc((scope,))
+            _publish_local(scope, key)
+
+
+def _listen(url, connect_timeout):
+    dsn = make_url(url).set(drivername="postgresql").render_as_string(hide_password=False)
+    backoff = 1
+    while not _state["stop"].is_set():
+        conn = None
+        try:
+            conn = psycopg2.connect(dsn, connect_timeout=connect_timeout, application_name="gestor-cachebus")
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute(f"listen {db.NOTIFY_CHANNEL}")
+                cur.execute(f"listen {stmts.CACHE_CHANNEL}")
+            # Whatever changed while nobody listened is unknown: start clean
+            _publish_local(None, None)
+            CONNECTED.set((), 1)
+            print(f"[CACHE] invalidation bus listening (pid {os.getpid()})")
+            backoff = 1
+            while not _state["stop"].is_set():
+                if select.select([conn], [], [], KEEPALIVE_SECONDS) == ([], [], []):
+                    with conn.cursor() as cur:
+                        cur.execute("select 1")
+                else:
+                    conn.poll()
+                while conn.notifies:
+                    n = conn.notifies.pop(0)
+                    _dispatch(n.channel, n.payload)
+        except Exception as e:
+            CONNECTED.set((), 0)
+            print(f"[CACHE] invalidation bus down, retrying in {backoff}s: {e}")
+        finally:
+            if conn is not None:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+        _state["stop"].wait(backoff)
+        backoff = min(backoff * 2, 30)
+
+
+def ensure_listener(app):
+    """Start this process's listener thread once (again after a fork)."""
+    if _state["pid"] == os.getpid():
+        return
+    with _lock:
+        if _state["pid"] == os.getpid():
+            return
+        _state["pid"] = os.getpid()
+        url = app.config.get("DATABASE_URL")
+        if not app.config["CACHE_BUS_ENABLED"] or not url:
+            return
+        if stmts.is_transaction_pooler(url):
+            print("[CACHE] invalidation bus off: DATABASE_URL is a transaction pooler (LISTEN needs a session)")
+            return
+        _state["thread"] = threading.Thread(
+            target=_listen, args=(url, app.config["DB_CONNECT_TIMEOUT"]), name="cachebus", daemon=True)
+        _state["thread"].start()
+
+
+def init_app(app):
+    @app.before_request
+    def _start_listener():
+        ensure_listener(app)
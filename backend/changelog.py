@@ -0,0 +1,148 @@
+"""Change log behind the delta sync endpoints (GET /inventario/cambios,
+GET /pedidos/cambios).
+
+Statement-level triggers append one row per entity a statement touched to
+public.cambios, in the same transaction as the write, so every write path
+is covered, including psql, jobs and imports:
+
+    producto   a movement (stock), an order line or an order status change
+               (reservations), or the product row itself
+    pedido     the order row or one of its lines
+
+Each row carries the id of the transaction that wrote it. A client's
+version token is the xmin of the snapshot the endpoint read with: every
+transaction below it had finished by then, so its changes were in that
+response or an earlier one. "What changed since N" is then every logged
+entity with xid >= N. A transaction still running at read time gets an xid
+at or above the token, so its changes show up on the next call even
+though they commit later. Answers may repeat an entity; patching it twice
+is harmless.
+
+Deletions are not flagged in the log. An entity that was logged but no
+longer exists is returned as a tombstone.
+
+The log keeps CHANGES_RETENTION_HOURS of history. The "changes_purge" job
+trims it, and the job runners enqueue it every
+CHANGES_PURGE_INTERVAL_SECONDS (jobs.py). Purging records the highest xid
+it removed, and a token at or below it gets 410: that client reloads in
+full.
+"""
+from sqlalchemy import text
+
+from db import statement_triggers
+
+def init_schema(engine):
+    with engine.begin() as conn:
+        conn.execute(text("""
+        create table if not exists public.cambios (
+          xid bigint not null default pg_current_xact_id()::text::bigint,
+          entidad text not null,
+          entidad_id uuid not null,
+          at timestamptz not null default now()
+        )
+        """))
+        conn.execute(text("create index if not exists cambios_entidad_xid_idx on public.cambios (entidad, xid)"))
+        conn.execute(text("create index if not exists cambios_at_idx on public.cambios (at)"))
+        # Highest xid purged so far (single row)
+        conn.execute(text("""
+        create table if not exists public.cambios_horizonte (
+          id boolean primary key default true check (id),
+          xid bigint not null
+        )
+        """))
+
+        # productos logs its own id, the ledger the product a movement moved
+        conn.execute(text("""
+        create or replace function public.cambios_producto() returns trigger
+        language plpgsql as $fn$
+        begin
+          if tg_table_name = 'productos' then
+            if tg_op = 'DELETE' then
+              insert into public.cambios (entidad, entidad_id) select 'producto', id from old_rows;
+            else
+              insert into public.cambios (entidad, entidad_id) select 'producto', id from new_rows;
+            end if;
+          elsif tg_op = 'DELETE' then
+            insert into public.cambios (entidad, entidad_id) select distinct 'producto', producto_id from old_rows;
+          else
+            insert into public.cambios (entidad, entidad_id) select distinct 'producto', producto_id from new_rows;
+            if tg_op = 'UPDATE' then
+              insert into public.cambios (entidad, entidad_id)
+              select distinct 'producto', o.producto_id
+              from old_rows o join new_rows n on n.id = o.id
+              where o.producto_id <> n.producto_id;
+            end if;
+          end if;
+          return null;
+        end
+        $fn$
+        """))
+        # Order lines change the order and the product's reservations; a
+        # status change reserves or releases every line of the order
+        conn.execute(text("""
+        create or replace function public.cambios_pedido() returns trigger
+        language plpgsql as $fn$
+        begin
+          if tg_table_name = 'pedido_items' then
+            if tg_op = 'DELETE' then
+              insert into public.cambios (entidad, entidad_id)
+              select 'pedido', pedido_id from old_rows union select 'producto', producto_id from old_rows;
+            else
+              insert into public.cambios (entidad, entidad_id)
+              select 'pedido', pedido_id from new_rows union select 'producto', producto_id from new_rows;
+            end if;
+            if tg_op = 'UPDATE' then
+              insert into public.cambios (entidad, entidad_id)
+              select distinct 'producto', o.producto_id
+              from old_rows o join new_rows n on n.id = o.id
+              where o.producto_id <> n.producto_id;
+            end if;
+          elsif tg_op = 'DELETE' then
+            insert into public.cambios (entidad, entidad_id) select 'pedido', id from old_rows;
+          else
+            insert into public.cambios (entidad, entidad_id) select 'pedido', id from new_rows;
+            if tg_op = 'UPDATE' then
+              insert into public.cambios (entidad, entidad_id)
+              select distinct 'producto', i.producto_id
+              from old_rows o join new_rows n on n.id = o.id
+              join public.pedido_items i on i.pedido_id = n.id
+              where o.status is distinct from n.status;
+            end if;
+          end if;
+          return null;
+        end
+        $fn$
+        """))
+        for table, fn in (
+            ("inventario_movimientos", "cambios_producto"),
+            ("productos", "cambios_producto"),
+            ("pedidos", "cambios_pedido"),
+            ("pedido_items", "cambios_pedido"),
+        ):
+            statement_triggers(conn, table, f"{table}_cambios", fn)
+
+
+def purge(conn, hours):
+    """Drop log rows older than ``hours``; returns how many went."""
+    return conn.execute(text("""
+        with gone as (
+          delete from public.cambios where at < now() - :h * interval '1 hour' returning xid
+        ),
+        horizon as (
+          insert into public.cambios_horizonte (id, xid)
+          select true, max(xid) from gone having count(*) > 0
+          on conflict (id) do update set xid = greatest(public.cambios_horizonte.xid, excluded.xid)
+        )
+        select count(*) from gone
+    """), {"h": hours}).scalar()
+
+
+def split(rows):
+    """(items, deleted ids) from *_CHANGES rows."""
+    items, deleted = [], []
+    for r in rows:
+        if r["deleted"]:
+            deleted.append(r["id"])
+        else:
+            items.append({k: v for k, v in r.items() if k != "deleted"})
+    return items, deleted
@@ -0,0 +1,95 @@
+"""Content-negotiated gzip / brotli compression for API responses.
+
+Registered as an after-request hook, so endpoints don't change. Buffered
+responses are compressed when they are at least COMPRESS_MIN_SIZE bytes;
+streamed responses (jsonio.stream_json_array) are compressed chunk by chunk
+with a sync flush after each chunk so the client keeps receiving data.
+brotli is optional: without it only gzip is offered.
+"""
+import zlib
+
+from flask import current_app, request
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only
+    brotli = None
+
+COMPRESSIBLE_TYPES = {
+    "application/json",
+    "application/x-ndjson",
+    "text/csv",
+    "text/plain",
+    "text/event-stream",
+}
+
+
+def init_app(app):
+    app.after_request(_compress_response)
+
+
+def _choose_encoding():
+    accepted = request.accept_encodings
+    if brotli is not None and accepted["br"] > 0:
+        return "br"
+    if accepted["gzip"] > 0:
+        return "gzip"
+    return None
+
+
+def _compressor(encoding, config):
+    if encoding == "br":
+        c = brotli.Compressor(quality=config["COMPRESS_BR_LEVEL"])
+        return c.process, c.flush, c.finish
+    # wbits=31 -> gzip container
+    c = zlib.compressobj(config["COMPRESS_LEVEL"], zlib.DEFLATED, 31)
+    return c.compress, (lambda: c.flush(zlib.Z_SYNC_FLUSH)), c.flush
+
+
+def _compress_stream(chunks, encoding, config):
+    compress, flush, finish = _compressor(encoding, config)
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode("utf-8")
+            out = compress(chunk) + flush()
+            if out:
+                yield out
+        yield finish()
+    finally:
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            close()
+
+
+def _compress_response(resp):
+    config = current_app.config
+
+    if not config["COMPRESS_ENABLED"] or not request.path.startswith("/api/"):
+        return resp
+    if resp.status_code < 200 or resp.status_code in (204, 304) or request.method == "HEAD":
+        return resp
+    if "Content-Encoding" in resp.headers or resp.mimetype not in COMPRESSIBLE_TYPES:
+        return resp
+
+    resp.vary.add("Accept-Encoding")
+    encoding = _choose_encoding()
+    if encoding is None:
+        return resp
+
+    if resp.is_streamed:
+        resp.response = _compress_stream(resp.response, encoding, config)
+        resp.headers.pop("Content-Length", None)
+        resp.headers["Content-Encoding"] = encoding
+        return resp
+
+    data = resp.get_data()
+    if len(data) < config["COMPRESS_MIN_SIZE"]:
+        return resp
+    compress, _, finish = _compressor(encoding, config)
+    body = compress(data) + finish()
+    if len(body) >= len(data):
+        return resp
+    resp.set_data(body)
+    resp.headers["Content-Encoding"] = encoding
+    return resp
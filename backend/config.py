@@ -18,9 +18,114 @@ def _parse_origins(val: str) -> list[str]:
     # CSV form: "https://a.com, https://b.com"
     return [part.strip() for part in s.split(",") if part.strip()]
 
+def _parse_ints(val: str) -> dict[str, int]:
+    """"name=n,name=n" -> {name: n}."""
+    out = {}
+    for part in (val or "").split(","):
+        if "=" in part:
+            name, n = part.split("=", 1)
+            out[name.strip()] = int(n)
+    return out
+
+def _parse_rates(val: str) -> dict[str, tuple[float, float]]:
+    """"class=rate/burst,..." -> {class: (tokens per second, bucket size)}."""
+    out = {}
+    for part in (val or "").split(","):
+        if "=" in part:
+            name, spec = part.split("=", 1)
+            rate, _, burst = spec.partition("/")
+            out[name.strip()] = (float(rate), float(burst or rate))
+    return out
+
 class Config:
     PORT = int(os.getenv("PORT", "5000"))
     DATABASE_URL = os.getenv("DATABASE_URL", "")
+    DATABASE_URL_POOLED = os.getenv("DATABASE_URL_POOLED", "")
+    # Optional hot standby for @read_only views (see db.route_read)
+    DATABASE_URL_REPLICA = os.getenv("DATABASE_URL_REPLICA", "")
+    REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "5"))
+    REPLICA_LAG_CHECK_SECONDS = float(os.getenv("REPLICA_LAG_CHECK_SECONDS", "2"))
+    READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", "10"))
+    # Seconds; keeps readiness probes and lazy warmup from hanging on a dead DB
+    DB_CONNECT_TIMEOUT = int(os.getenv("DB_CONNECT_TIMEOUT", "10"))
+    # plain | prepared | auto — "auto" prepares server-side only on direct
+    # (non transaction-pooler) connections; see statements.py
+    DB_STATEMENT_MODE = os.getenv("DB_STATEMENT_MODE", "plain")
+    DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+    # Statement budgets (timeouts.py): default per transaction, per-endpoint
+    # overrides ("orders.list_orders=2000,login=3000") and the whole-request
+    # deadline that caps them
+    DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "8000"))
+    STATEMENT_TIMEOUTS = _parse_ints(os.getenv("STATEMENT_TIMEOUTS", ""))
+    REQUEST_DEADLINE_MS = int(os.getenv("REQUEST_DEADLINE_MS", "30000"))
+    TIMEOUT_RETRY_AFTER = int(os.getenv("TIMEOUT_RETRY_AFTER", "5"))
+    # Slow-statement log (slowlog.py); DB_SLOW_QUERY_MS=0 disables it
+    DB_SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", "500"))
+    DB_SLOW_QUERY_RING = int(os.getenv("DB_SLOW_QUERY_RING", "100"))
+    DB_EXPLAIN_SAMPLE_RATE = float(os.getenv("DB_EXPLAIN_SAMPLE_RATE", "0"))
+    DB_EXPLAIN_TIMEOUT_MS = int(os.getenv("DB_EXPLAIN_TIMEOUT_MS", "15000"))
+    # ledger.py: monthly partitions kept ahead of the calendar, and where
+    # archived (detached) partitions of closed periods go
+    LEDGER_PARTITIONS_AHEAD = int(os.getenv("LEDGER_PARTITIONS_AHEAD", "3"))
+    LEDGER_ARCHIVE_SCHEMA = os.getenv("LEDGER_ARCHIVE_SCHEMA", "archivo")
+    # jobs.py: runner threads per web worker (0 = only `python -m jobs`
+    # processes run jobs), idle poll interval, and when a silent running job
+    # is presumed dead and retried
+    JOBS_WORKERS = int(os.getenv("JOBS_WORKERS", "1"))
+    JOBS_POLL_SECONDS = float(os.getenv("JOBS_POLL_SECONDS", "5"))
+    JOBS_STALE_SECONDS = float(os.getenv("JOBS_STALE_SECONDS", "300"))
+    JOBS_MAX_ATTEMPTS = int(os.getenv("JOBS_MAX_ATTEMPTS", "3"))
+    # reconcile.py: products per chunk, and idle time after each chunk as a
+    # multiple of the time it took (1 = at most half the database time)
+    RECONCILE_CHUNK_SIZE = int(os.getenv("RECONCILE_CHUNK_SIZE", "500"))
+    RECONCILE_PAUSE_RATIO = float(os.getenv("RECONCILE_PAUSE_RATIO", "1"))
+    # changelog.py: history kept for delta sync; older versions get 410. The
+    # job runners enqueue "changes_purge" this often (0: only when enqueued)
+    CHANGES_RETENTION_HOURS = float(os.getenv("CHANGES_RETENTION_HOURS", "168"))
+    CHANGES_PURGE_INTERVAL_SECONDS = float(os.getenv("CHANGES_PURGE_INTERVAL_SECONDS", "3600"))
+    # sales.py: the job runners enqueue "sales_refresh" this often (0: only
+    # when enqueued or run from cron)
+    SALES_REFRESH_INTERVAL_SECONDS = float(os.getenv("SALES_REFRESH_INTERVAL_SECONDS", "300"))
+    # admission.py: per-caller token buckets by endpoint class (per worker;
+    # RATE_LIMITS= turns them off); slots per @concurrency_limited pool (per
+    # worker), how long a request may wait for one and how many may wait
+    RATE_LIMITS = _parse_rates(os.getenv("RATE_LIMITS", "read=10/40,write=5/20,login=0.2/5"))
+    RATE_LIMIT_KEYS = int(os.getenv("RATE_LIMIT_KEYS", "10000"))
+    # Reverse proxies in front of the app that append to X-Forwarded-For
+    # (1 on Render); 0 keys anonymous callers by the socket address
+    PROXY_HOPS = int(os.getenv("PROXY_HOPS", "0"))
+    CONCURRENCY_LIMITS = _parse_ints(os.getenv("CONCURRENCY_LIMITS", "resumen=2,export=1,import=1"))
+    ADMISSION_QUEUE_TIMEOUT_MS = int(os.getenv("ADMISSION_QUEUE_TIMEOUT_MS", "10000"))
+    ADMISSION_QUEUE_MAX = int(os.getenv("ADMISSION_QUEUE_MAX", "2"))
+    # asgi.py: async engine pool per process, SSE heartbeat and per-client backlog
+    ASGI_DB_POOL_SIZE = int(os.getenv("ASGI_DB_POOL_SIZE", "20"))
+    SSE_HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", "15"))
+    SSE_QUEUE_SIZE = int(os.getenv("SSE_QUEUE_SIZE", "100"))
+    # Lifetime of the ?token= tickets EventSource connects with (app.py)
+    SSE_TOKEN_SECONDS = int(os.getenv("SSE_TOKEN_SECONDS", "60"))
+    # usercache.py: (user, prefs) per worker for /me; the TTL bounds staleness
+    # after a write served by another worker
+    USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", "60"))
+    USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+    # Change-feed NOTIFY triggers on the ledger and orders (db.NOTIFY_CHANNEL),
+    # read by SSE clients (asgi.py) and the invalidation bus. Off: neither
+    # hears about those writes, and other workers' caches expire on their TTL
+    CHANGE_NOTIFY_ENABLED = os.getenv("CHANGE_NOTIFY_ENABLED", "1").lower() not in ("0", "false", "no")
+    # cachebus.py: LISTEN/NOTIFY thread per worker that evicts other workers'
+    # cache entries after a write (needs a session: off behind a transaction pooler)
+    CACHE_BUS_ENABLED = os.getenv("CACHE_BUS_ENABLED", "1").lower() not in ("0", "false", "no")
+    # resultcache.py: off | local (per worker) | shared (unlogged Postgres
+    # table, one computation per burst across workers); TTL and local size
+    RESULT_CACHE_MODE = os.getenv("RESULT_CACHE_MODE", "local").lower()
+    RESULT_CACHE_TTL_SECONDS = float(os.getenv("RESULT_CACHE_TTL_SECONDS", "2"))
+    RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "64"))
+    # Bearer token required by /api/v1/metrics when set
+    METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+    # Response compression (see compression.py); levels: gzip 1-9, brotli 0-11
+    COMPRESS_ENABLED = os.getenv("COMPRESS_ENABLED", "1").lower() not in ("0", "false", "no")
+    COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "1024"))
+    COMPRESS_LEVEL = int(os.getenv("COMPRESS_LEVEL", "6"))
+    COMPRESS_BR_LEVEL = int(os.getenv("COMPRESS_BR_LEVEL", "5"))
     JWT_SECRET = os.getenv("JWT_SECRET", "change-me")
     # FIX: only one default arg to getenv; then parse into a list
     CORS_ORIGINS = _parse_origins(
@@ -0,0 +1,28 @@
+import os
+
+# Shared by Procfile and render.yaml (CLI flags still win for workers/threads).
+#
+# With preload_app the master imports app.py once and, when WARMUP_ON_PRELOAD
+# is on, runs the DB warmup (engine + schema bootstrap) before forking, so
+# every worker starts warm. A failed warmup is not fatal: workers retry lazily.
+preload_app = os.getenv("GUNICORN_PRELOAD", "1").lower() not in ("0", "false", "no")
+warmup_on_preload = os.getenv("WARMUP_ON_PRELOAD", "1").lower() not in ("0", "false", "no")
+
+
+def when_ready(server):
+    if not (preload_app and warmup_on_preload):
+        return
+    import db
+    from app import app
+    try:
+        db.warmup(app)
+    except Exception as e:
+        server.log.warning("DB warmup in master failed, workers will retry lazily: %s", e)
+
+
+def post_fork(server, worker):
+    if not preload_app:
+        return
+    import db
+    from app import app
+    db.dispose_after_fork(app)
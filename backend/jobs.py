@@ -0,0 +1,312 @@
+"""Background jobs: a Postgres-backed queue and a small pool of runner threads.
+
+Heavy work (bulk imports, exports, ledger close, reports) is enqueued as a
+row in public.jobs and runs on a runner thread. A gthread request thread
+only does the insert. Each web worker runs JOBS_WORKERS runner threads,
+started on its first request. For CPU-heavy kinds, set JOBS_WORKERS=0 on
+the web service and run a separate worker instead:
+
+    python -m jobs --workers 2
+
+Runners claim queued jobs with FOR UPDATE SKIP LOCKED, so any number of
+processes can share the table. While a handler runs, a timer thread
+refreshes its job's heartbeat_at every third of JOBS_STALE_SECONDS, so a
+handler may spend longer than that in one statement without reporting
+progress. If the heartbeat goes quiet for JOBS_STALE_SECONDS (its worker
+died), another runner claims the job again, up to JOBS_MAX_ATTEMPTS.
+
+Handlers are registered per kind:
+
+    @jobs.job("ledger_close", profiles=("admin",))
+    def ledger_close(ctx, params):
+        ctx.progress(50, "closing 2026-06")
+        return {"closed": [...]}          # stored as the job's result (JSON)
+
+A kind registered with ``every="SOME_INTERVAL_SECONDS"`` is also enqueued
+by the runners themselves, with no params, once that config value's
+seconds have passed since the last one was created and none is waiting or
+running (0 turns it off). This needs a runner somewhere: JOBS_WORKERS on
+the web service, or ``python -m jobs``.
+"""
+import argparse
+import os
+import signal
+import sys
+import threading
+import time
+import traceback
+
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.sql import bindparam
+
+import metrics
+
+STATUSES = ("queued", "running", "done", "failed")
+
+FINISHED = metrics.counter("jobs_finished_total", "Background jobs finished, by kind and status.", ("tipo", "status"))
+DURATION = metrics.histogram(
+    "job_duration_seconds", "Background job run time, by kind.", ("tipo",),
+    (0.1, 0.5, 1, 5, 15, 60, 300, 900, 3600))
+
+KINDS = {}     # tipo -> (handler, allowed profiles)
+SCHEDULE = {}  # tipo -> config key of its interval in seconds
+
+_runner = {"pid": None, "threads": [], "wake": threading.Event(), "stop": threading.Event()}
+_lock = threading.Lock()
+
+
+def job(tipo, profiles=("admin", "manager"), every=None):
+    """Register ``fn(ctx, params) -> result`` as the handler for ``tipo``.
+
+    ``every`` names the config value with the interval the runners enqueue
+    it at on their own.
+    """
+    def decorate(fn):
+        if tipo in KINDS:
+            raise ValueError(f"job kind {tipo!r} registered twice")
+        KINDS[tipo] = (fn, tuple(profiles))
+        if every:
+            SCHEDULE[tipo] = every
+        return fn
+    return decorate
+
+
+# ---- Queue SQL --------------------------------------------------------------
+
+# Oldest queued job first; a running job whose heartbeat went stale is
+# claimable again (its worker is gone) until it runs out of attempts
+_CLAIM = text("""
+    update public.jobs j
+    set status = 'running', attempts = j.attempts + 1, worker = :worker,
+        started_at = now(), heartbeat_at = now()
+    where j.id = (
+      select id from public.jobs
+      where tipo = any(:kinds)
+        and (status = 'queued'
+             or (status = 'running' and heartbeat_at < now() - make_interval(secs => :stale)))
+        and attempts < :max_attempts
+      order by created_at
+      for update skip locked
+      limit 1
+    )
+    returning j.id, j.tipo, j.params, j.usuario_id, j.attempts
+""")
+
+_GIVE_UP = text("""
+    update public.jobs
+    set status = 'failed', finished_at = now(), error = 'worker lost after ' || attempts || ' attempts'
+    where status = 'running' and heartbeat_at < now() - make_interval(secs => :stale)
+      and attempts >= :max_attempts
+""")
+
+# Scheduled kinds: one runner at a time checks; others skip the round
+_SCHEDULE = text("""
+    insert into public.jobs (tipo)
+    select :tipo
+    where pg_try_advisory_xact_lock(hashtext('jobs_schedule'))
+      and not exists (
+        select 1 from public.jobs
+        where tipo = :tipo
+          and (status in ('queued', 'running') or created_at > now() - make_interval(secs => :every))
+      )
+""")
+
+_PROGRESS = text("""
+    update public.jobs set progress = :progress, message = :message, heartbeat_at = now()
+    where id = :id and worker = :worker
+""")
+
+_HEARTBEAT = text("""
+    update public.jobs set heartbeat_at = now()
+    where id = :id and worker = :worker and status = 'running'
+""")
+
+_FINISH = text("""
+    update public.jobs
+    set status = :status, progress = case when :status = 'done' then 100 else progress end,
+        result = :result, error = :error, finished_at = now(), heartbeat_at = now()
+    where id = :id and worker = :worker
+""").bindparams(bindparam("result", type_=JSONB(none_as_null=True)))
+
+
+def init_schema(conn):
+    conn.execute(text("""
+    create table if not exists public.jobs (
+      id uuid primary key default gen_random_uuid(),
+      tipo text not null,
+      params jsonb not null default '{}'::jsonb,
+      status text not null default 'queued' check (status in ('queued','running','done','failed')),
+      progress numeric(5,2) not null default 0,
+      message text,
+      result jsonb,
+      error text,
+      usuario_id uuid,
+      attempts int not null default 0,
+      worker text,
+      created_at timestamptz not null default now(),
+      started_at timestamptz,
+      heartbeat_at timestamptz,
+      finished_at timestamptz
+    )
+    """))
+    conn.execute(text("""
+    create index if not exists jobs_pending_idx on public.jobs (created_at)
+    where status in ('queued','running')
+    """))
+    conn.execute(text("create index if not exists jobs_tipo_created_idx on public.jobs (tipo, created_at)"))
+
+
+# ---- Running ----------------------------------------------------------------
+
+class JobContext:
+    """What a handler gets: its app, engine and params, plus progress reporting."""
+
+    def __init__(self, app, engine, row, worker):
+        self.app = app
+        self.engine = engine
+        self.job_id = row.id
+        self.tipo = row.tipo
+        self.params = row.params or {}
+        self.usuario_id = row.usuario_id
+        self.worker = worker
+        self._last_report = 0.0
+
+    def progress(self, percent, message=None, force=False):
+        """Record progress (0-100). Throttled to once a second."""
+        now = time.monotonic()
+        if not force and now - self._last_report < 1.0:
+            return
+        self._last_report = now
+        with self.engine.begin() as conn:
+            conn.execute(_PROGRESS, {
+                "id": self.job_id, "worker": self.worker,
+                "progress": max(0.0, min(float(percent), 100.0)), "message": message,
+            })
+
+
+def _heartbeat(engine, job_id, worker, every, stop):
+    # Runs beside the handler: it only stops with the handler or with the
+    # process, which is what JOBS_STALE_SECONDS is meant to detect
+    while not stop.wait(every):
+        try:
+            with engine.begin() as conn:
+                conn.execute(_HEARTBEAT, {"id": job_id, "worker": worker})
+        except Exception as e:
+            print(f"[JOBS] heartbeat for {job_id} failed: {e}")
+
+
+def _worker_name():
+    return f"{os.uname().nodename}:{os.getpid()}:{threading.current_thread().name}"
+
+
+def run_one(app, engine):
+    """Claim and run one job; returns False when nothing was waiting."""
+    worker = _worker_name()
+    cfg = app.config
+    with engine.begin() as conn:
+        conn.execute(_GIVE_UP, {"stale": cfg["JOBS_STALE_SECONDS"], "max_attempts": cfg["JOBS_MAX_ATTEMPTS"]})
+        for tipo, key in SCHEDULE.items():
+            if cfg[key] > 0:
+                conn.execute(_SCHEDULE, {"tipo": tipo, "every": cfg[key]})
+        row = conn.execute(_CLAIM, {
+            "worker": worker, "kinds": list(KINDS),
+            "stale": cfg["JOBS_STALE_SECONDS"], "max_attempts": cfg["JOBS_MAX_ATTEMPTS"],
+        }).first()
+    if row is None:
+        return False
+
+    handler, _ = KINDS[row.tipo]
+    ctx = JobContext(app, engine, row, worker)
+    t0 = time.perf_counter()
+    status, result, error = "done", None, None
+    print(f"[JOBS] {row.tipo} {row.id} started (attempt {row.attempts})")
+    stop = threading.Event()
+    threading.Thread(
+        target=_heartbeat, args=(engine, row.id, worker, cfg["JOBS_STALE_SECONDS"] / 3, stop),
+        name=f"{threading.current_thread().name}-heartbeat", daemon=True,
+    ).start()
+    try:
+        with app.app_context():
+            result = handler(ctx, ctx.params)
+    except Exception as e:
+        status, error = "failed", f"{type(e).__name__}: {e}"
+        traceback.print_exc()
+    finally:
+        stop.set()
+    elapsed = time.perf_counter() - t0
+    with engine.begin() as conn:
+        conn.execute(_FINISH, {"id": row.id, "worker": worker, "status": status, "result": result, "error": error})
+    FINISHED.inc((row.tipo, status))
+    DURATION.observe((row.tipo,), elapsed)
+    print(f"[JOBS] {row.tipo} {row.id} {status} in {elapsed:.1f}s")
+    return True
+
+
+def _loop(app):
+    import db
+    poll = app.config["JOBS_POLL_SECONDS"]
+    while not _runner["stop"].is_set():
+        try:
+            db.warmup(app)
+            if run_one(app, db.get_engine(app)):
+                continue  # there may be more waiting
+        except Exception as e:
+            print(f"[JOBS] runner error, retrying in {poll:g}s: {e}")
+        _runner["wake"].wait(poll)
+        _runner["wake"].clear()
+
+
+def ensure_runner(app, workers=None):
+    """Start this process's runner threads once (again after a fork)."""
+    workers = app.config["JOBS_WORKERS"] if workers is None else workers
+    if workers <= 0 or _runner["pid"] == os.getpid():
+        return
+    with _lock:
+        if _runner["pid"] == os.getpid():
+            return
+        _runner["threads"] = [
+            threading.Thread(target=_loop, args=(app,), name=f"jobs-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for t in _runner["threads"]:
+            t.start()
+        _runner["pid"] = os.getpid()
+
+
+def wake():
+    """Have an idle runner in this process poll now instead of at the next interval."""
+    _runner["wake"].set()
+
+
+def init_app(app):
+    @app.before_request
+    def _start_runner():
+        ensure_runner(app)
+
+
+# ---- CLI --------------------------------------------------------------------
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Run background jobs outside the web workers.")
+    ap.add_argument("--workers", type=int, default=2, help="runner threads")
+    args = ap.parse_args(argv)
+
+    from app import app
+    signal.signal(signal.SIGTERM, lambda *_: _runner["stop"].set())
+    ensure_runner(app, workers=args.workers)
+    print(f"[JOBS] {args.workers} runner(s) for: {', '.join(sorted(KINDS)) or '(no kinds)'}")
+    try:
+        while not _runner["stop"].wait(1):
+            pass
+    except KeyboardInterrupt:
+        pass
+    _runner["stop"].set()
+    wake()
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    # Use the module app.py's imports register kinds on, not this __main__ copy
+    import jobs
+    jobs.main()
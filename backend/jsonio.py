@@ -0,0 +1,231 @@
+"""JSON encoding for API responses.
+
+``FastJSONProvider`` replaces Flask's default provider so handlers can pass
+SQLAlchemy rows straight to ``jsonify``: Decimal, date, time, datetime and
+UUID values are encoded in the same pass as the rest of the payload, with
+no per-row conversion loop in the endpoints. orjson is used when installed;
+otherwise the stdlib encoder runs with the same ``default`` hook.
+
+Wire formats (unchanged from the hand-written conversions they replace):
+    datetime / date -> ISO 8601
+    time            -> "HH:MM"
+    Decimal         -> string, e.g. "12.50" (no float rounding)
+    UUID            -> canonical string
+"""
+import datetime
+import decimal
+import json
+import uuid
+from collections.abc import Mapping
+
+from flask import Response, request, stream_with_context
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # optional: stdlib fallback
+    orjson = None
+
+# Rows per encoded chunk when streaming arrays
+STREAM_CHUNK_ROWS = 500
+
+
+def _default(o):
+    # Ordered by frequency in our payloads (numeric columns, rows, timestamps)
+    if isinstance(o, decimal.Decimal):
+        return str(o)
+    if isinstance(o, Mapping):  # SQLAlchemy RowMapping
+        return dict(o)
+    if isinstance(o, datetime.datetime):
+        return o.isoformat()
+    if isinstance(o, datetime.date):
+        return o.isoformat()
+    if isinstance(o, datetime.time):
+        return o.isoformat(timespec="minutes")
+    if isinstance(o, uuid.UUID):
+        return str(o)
+    if hasattr(o, "_mapping"):  # SQLAlchemy Row
+        return dict(o._mapping)
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+if orjson is not None:
+    # Datetimes go through _default so "HH:MM" times and isoformat() match
+    # the stdlib path byte for byte.
+    _ORJSON_OPTS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+    def dumps_bytes(obj):
+        return orjson.dumps(obj, default=_default, option=_ORJSON_OPTS)
+else:
+    _encoder = json.JSONEncoder(default=_default, ensure_ascii=False, separators=(",", ":"))
+
+    def dumps_bytes(obj):
+        return _encoder.encode(obj).encode("utf-8")
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    default = staticmethod(_default)
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            kwargs.setdefault("default", _default)
+            return json.dumps(obj, **kwargs)
+        return dumps_bytes(obj).decode("utf-8")
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps_bytes(obj), mimetype=self.mimetype)
+
+
+# ---- Streaming --------------------------------------------------------------
+# A streamed response sends its 200 before the query has finished. Two
+# things keep a failure from passing for a complete (if short) answer:
+#
+#   primed()     the first chunk, and with it the query's first FETCH, is
+#                produced in the view, so the database being unreachable or
+#                the statement timeout firing still raises there and gets
+#                its 503.
+#   _guarded()   a failure after that ends the body with an error marker
+#                (the array is left open, so it doesn't parse), and the
+#                error is re-raised, so the server drops the connection
+#                without ending the chunked response.
+
+# Error text of the marker a failed stream ends with
+STREAM_ERROR = "Respuesta incompleta: la consulta falló, intente de nuevo"
+
+
+def _iter_array(rows, chunk_rows):
+    # The opening bracket goes out with the first rows: the first chunk is
+    # the first FETCH (see primed)
+    sep = b"["
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= chunk_rows:
+            yield sep + dumps_bytes(batch)[1:-1]
+            sep = b","
+            batch = []
+    if batch:
+        yield sep + dumps_bytes(batch)[1:-1] + b"]"
+    else:
+        yield b"[]" if sep == b"[" else b"]"
+
+
+def primed(chunks):
+    """Produce the first of ``chunks`` now; an equivalent iterator of all of them."""
+    it = iter(chunks)
+    try:
+        first = next(it)
+    except StopIteration:
+        return iter(())
+    return _resumed(first, it)
+
+
+def _resumed(first, it):
+    try:
+        yield first
+        yield from it
+    finally:
+        close = getattr(it, "close", None)
+        if close is not None:
+            close()  # the client went away after the first chunk
+
+
+def _guarded(chunks, marker):
+    started = False
+    try:
+        for chunk in chunks:
+            yield chunk
+            started = True
+    except Exception as e:
+        if not started:
+            raise  # nothing sent yet: primed() raises it in the view
+        print(f"[STREAM] {request.method} {request.path} failed mid-response: {type(e).__name__}: {e}")
+        yield marker
+        raise
+
+
+def stream_chunks(chunks, marker, mimetype, **kwargs):
+    """Stream already-encoded ``chunks``, primed and guarded as above.
+
+    ``marker`` is what the body ends with when a chunk after the first one
+    fails; keyword arguments go to the Response.
+    """
+    body = stream_with_context(_guarded(chunks, marker))
+    return Response(primed(body), mimetype=mimetype, **kwargs)
+
+
+def stream_json_array(rows, chunk_rows=STREAM_CHUNK_ROWS):
+    """Stream an iterable of rows as a JSON array without materializing it.
+
+    ``rows`` may be a generator that keeps a server-side cursor open; it is
+    consumed inside the request context while the response is written. On
+    a failure part-way the body ends with ``{"error": STREAM_ERROR}`` after
+    the last rows sent, which leaves the array unclosed.
+    """
+    marker = b"\n" + dumps_bytes({"error": STREAM_ERROR})
+    return stream_chunks(_iter_array(rows, chunk_rows), marker, "application/json")
+
+
+async def aiter_json_array(rows, chunk_rows=STREAM_CHUNK_ROWS):
+    """Async counterpart of the streaming encoder, for asgi.py."""
+    sep = b"["
+    batch = []
+    started = False
+    try:
+        async for row in rows:
+            batch.append(row)
+            if len(batch) >= chunk_rows:
+                yield sep + dumps_bytes(batch)[1:-1]
+                started = True
+                sep = b","
+                batch = []
+    except Exception as e:
+        if not started:
+            raise
+        print(f"[STREAM] failed mid-response: {type(e).__name__}: {e}")
+        yield b"\n" + dumps_bytes({"error": STREAM_ERROR})
+        raise
+    if batch:
+        yield sep + dumps_bytes(batch)[1:-1] + b"]"
+    else:
+        yield b"[]" if sep == b"[" else b"]"
+
+
+async def aprimed(chunks):
+    """Async primed(): await the first chunk now, in the endpoint."""
+    try:
+        first = await chunks.__anext__()
+    except StopAsyncIteration:
+        first = None
+
+    async def resumed():
+        if first is None:
+            return
+        yield first
+        async for chunk in chunks:
+            yield chunk
+
+    return resumed()
+
+
+def _iter_ndjson(rows, chunk_rows):
+    batch = []
+    for row in rows:
+        batch.append(dumps_bytes(row))
+        if len(batch) >= chunk_rows:
+            yield b"\n".join(batch) + b"\n"
+            batch = []
+    if batch:
+        yield b"\n".join(batch) + b"\n"
+
+
+def stream_ndjson(rows, chunk_rows=STREAM_CHUNK_ROWS):
+    """Stream rows as newline-delimited JSON, one object per line.
+
+    Same contract as ``stream_json_array``: ``rows`` is consumed lazily
+    inside the request context. On a failure part-way the last line is
+    ``{"error": STREAM_ERROR}``.
+    """
+    marker = dumps_bytes({"error": STREAM_ERROR}) + b"\n"
+    return stream_chunks(_iter_ndjson(rows, chunk_rows), marker, "application/x-ndjson")
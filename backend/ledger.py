@@ -0,0 +1,408 @@
+"""Monthly partitions of inventario_movimientos, period close and archival.
+
+    python -m ledger status
+    python -m ledger migrate [--keep-legacy]       # one-off: plain table -> partitions
+    python -m ledger maintain                      # next LEDGER_PARTITIONS_AHEAD months
+    python -m ledger close --through 2026-06       # carry balances forward
+    python -m ledger archive --through 2025-12 [--drop]
+
+The ledger is range-partitioned by month on fecha_local, with a default
+partition catching dates outside the created range. Closing a month writes
+every product's running balance at its end to inventario_saldos and records
+the month in inventario_periodos. After that a trigger rejects movements
+dated in it. Stock reads (statements.py) add the last carried balance to
+the movements of the open months only, so closed partitions are pruned at
+execution time. They can then be detached into LEDGER_ARCHIVE_SCHEMA, or
+dropped, without changing any stock figure.
+
+Warmup creates the tables and keeps partitions ahead of the calendar. An
+existing unpartitioned table is left alone until ``migrate`` is run.
+"""
+import argparse
+import datetime
+import os
+import sys
+
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+
+TABLE = "inventario_movimientos"
+DEFAULT_PARTITION = f"{TABLE}_default"
+
+# SQLSTATE raised by the closed-period trigger
+PERIOD_CLOSED = "GTL01"
+
+_COLUMNS = (
+    "id, producto_id, cantidad, clase, tipo, motivo, usuario_id, "
+    "fecha_local, hora_local, ubicacion, created_at"
+)
+
+# Serializes partition DDL between workers warming up at the same time
+_PARTITION_LOCK = "select pg_advisory_xact_lock(hashtext('ledger_partitions'))"
+
+
+# ---- Months -----------------------------------------------------------------
+
+def month_start(d):
+    return datetime.date(d.year, d.month, 1)
+
+
+def add_months(d, n):
+    y, m = divmod(d.year * 12 + d.month - 1 + n, 12)
+    return datetime.date(y, m + 1, 1)
+
+
+def parse_month(s):
+    """'2026-06' -> date(2026, 6, 1)."""
+    try:
+        return datetime.datetime.strptime(s, "%Y-%m").date()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected YYYY-MM, got {s!r}")
+
+
+def partition_name(month):
+    return f"{TABLE}_p{month:%Y_%m}"
+
+
+# ---- Schema -----------------------------------------------------------------
+
+def relkind(conn, name=TABLE):
+    """'p' partitioned, 'r' plain table, None when missing."""
+    return conn.execute(text("""
+        select c.relkind from pg_class c join pg_namespace n on n.oid = c.relnamespace
+        where n.nspname = 'public' and c.relname = :t
+    """), {"t": name}).scalar()
+
+
+def is_partitioned(conn):
+    return relkind(conn) == "p"
+
+
+def create_table(conn):
+    # The partition key has to be part of the primary key
+    conn.execute(text(f"""
+    create table if not exists public.{TABLE} (
+      id uuid not null default gen_random_uuid(),
+      producto_id uuid not null references public.productos(id) on delete cascade,
+      cantidad numeric(12,2) not null,
+      clase text not null,
+      tipo text not null,
+      motivo text not null,
+      usuario_id uuid not null,
+      fecha_local date not null,
+      hora_local time not null,
+      ubicacion text not null default 'principal',
+      created_at timestamptz not null default now(),
+      primary key (id, fecha_local)
+    ) partition by range (fecha_local)
+    """))
+    conn.execute(text(f"create table if not exists public.{DEFAULT_PARTITION} partition of public.{TABLE} default"))
+    conn.execute(text(f"""
+    create index if not exists {TABLE}_producto_fecha_idx on public.{TABLE} (producto_id, fecha_local)
+    """))
+
+
+def init_schema(conn, partitions_ahead):
+    """Called from the inventory blueprint's init_schema, after productos exists."""
+    kind = relkind(conn)
+    if kind is None:
+        create_table(conn)
+    elif kind != "p":
+        print(f"[DB] {TABLE} is not partitioned; run `python -m ledger migrate`")
+
+    conn.execute(text("""
+    create table if not exists public.inventario_periodos (
+      periodo date primary key check (periodo = date_trunc('month', periodo)::date),
+      cerrado_at timestamptz not null default now(),
+      archivado_at timestamptz
+    )
+    """))
+    conn.execute(text("""
+    create table if not exists public.inventario_saldos (
+      periodo date not null references public.inventario_periodos(periodo) on delete cascade,
+      producto_id uuid not null references public.productos(id) on delete cascade,
+      cantidad numeric(14,2) not null,
+      primary key (periodo, producto_id)
+    )
+    """))
+
+    # Closed months are immutable: their balance is already carried forward.
+    # The check runs per row with a fresh snapshot, so a movement that waited
+    # on close_period's lock sees the period it was aimed at as closed.
+    conn.execute(text(f"""
+    create or replace function public.inventario_periodo_abierto() returns trigger
+    language plpgsql as $fn$
+    declare
+      abierto date;
+    begin
+      select (max(periodo) + interval '1 month')::date into abierto from public.inventario_periodos;
+      if abierto is not null
+         and ((tg_op <> 'INSERT' and old.fecha_local < abierto)
+              or (tg_op <> 'DELETE' and new.fecha_local < abierto)) then
+        raise exception 'fecha_local en periodo cerrado (abierto desde %)', abierto
+          using errcode = '{PERIOD_CLOSED}';
+      end if;
+      if tg_op = 'DELETE' then return old; end if;
+      return new;
+    end
+    $fn$
+    """))
+    conn.execute(text(f"drop trigger if exists {TABLE}_periodo_abierto on public.{TABLE}"))
+    conn.execute(text(f"""
+    create trigger {TABLE}_periodo_abierto
+    before insert or update or delete on public.{TABLE}
+    for each row execute function public.inventario_periodo_abierto()
+    """))
+
+    if is_partitioned(conn):
+        ensure_partitions(conn, ahead=partitions_ahead)
+
+
+def is_period_closed(exc):
+    """True for the DBAPIError raised when a write hits a closed month."""
+    return isinstance(exc, DBAPIError) and getattr(exc.orig, "pgcode", None) == PERIOD_CLOSED
+
+
+# ---- Partitions -------------------------------------------------------------
+
+def ensure_partition(conn, month):
+    """Create the partition for ``month``; returns False if it already exists.
+
+    Rows that landed in the default partition for that month are moved into
+    the new partition.
+    """
+    name = partition_name(month)
+    if conn.execute(text("select to_regclass(:n)"), {"n": f"public.{name}"}).scalar():
+        return False
+    lo, hi = month, add_months(month, 1)
+    bound = f"for values from ('{lo}') to ('{hi}')"
+    stranded = conn.execute(text(f"""
+        select exists (select 1 from public.{DEFAULT_PARTITION} where fecha_local >= :lo and fecha_local < :hi)
+    """), {"lo": lo, "hi": hi}).scalar()
+    if not stranded:
+        conn.execute(text(f"create table public.{name} partition of public.{TABLE} {bound}"))
+        return True
+
+    # Postgres refuses a new partition while the default holds rows for its
+    # range: take the default out, create, move the rows, put it back
+    conn.execute(text(f"alter table public.{TABLE} detach partition public.{DEFAULT_PARTITION}"))
+    conn.execute(text(f"create table public.{name} partition of public.{TABLE} {bound}"))
+    conn.execute(text(f"""
+        insert into public.{TABLE} ({_COLUMNS})
+        select {_COLUMNS} from public.{DEFAULT_PARTITION} where fecha_local >= :lo and fecha_local < :hi
+    """), {"lo": lo, "hi": hi})
+    conn.execute(text(f"""
+        delete from public.{DEFAULT_PARTITION} where fecha_local >= :lo and fecha_local < :hi
+    """), {"lo": lo, "hi": hi})
+    conn.execute(text(f"alter table public.{TABLE} attach partition public.{DEFAULT_PARTITION} default"))
+    return True
+
+
+def ensure_partitions(conn, first=None, ahead=3):
+    """Partitions from ``first``'s month (default: this month) to ``ahead`` months out."""
+    conn.execute(text(_PARTITION_LOCK))
+    today = month_start(datetime.date.today())
+    month = month_start(first) if first else today
+    created = []
+    while month <= add_months(today, ahead):
+        if ensure_partition(conn, month):
+            created.append(partition_name(month))
+        month = add_months(month, 1)
+    if created:
+        print(f"[DB] {TABLE}: created {', '.join(created)}")
+    return created
+
+
+def partitions(conn):
+    """(name, bound, estimated rows) for every attached partition."""
+    return conn.execute(text(f"""
+        select c.relname, pg_get_expr(c.relpartbound, c.oid), greatest(c.reltuples, 0)::bigint
+        from pg_inherits i join pg_class c on c.oid = i.inhrelid
+        where i.inhparent = 'public.{TABLE}'::regclass
+        order by c.relname
+    """)).all()
+
+
+def migrate(conn, keep_legacy=False):
+    """Move a plain inventario_movimientos into a partitioned one; returns rows copied."""
+    if is_partitioned(conn):
+        return None
+    legacy = f"{TABLE}_legacy"
+    conn.execute(text(f"lock table public.{TABLE} in access exclusive mode"))
+    first = conn.execute(text(f"select min(fecha_local) from public.{TABLE}")).scalar()
+    conn.execute(text(f"alter table public.{TABLE} rename to {legacy}"))
+    conn.execute(text(f"alter index public.{TABLE}_pkey rename to {legacy}_pkey"))
+    conn.execute(text(f"drop trigger if exists {TABLE}_notify on public.{legacy}"))
+    conn.execute(text(f"drop trigger if exists {TABLE}_periodo_abierto on public.{legacy}"))
+
+    create_table(conn)
+    ensure_partitions(conn, first=first)
+    copied = conn.execute(text(f"""
+        insert into public.{TABLE} ({_COLUMNS}) select {_COLUMNS} from public.{legacy}
+    """)).rowcount
+    if not keep_legacy:
+        conn.execute(text(f"drop table public.{legacy}"))
+    return copied
+
+
+# ---- Periods ----------------------------------------------------------------
+
+def open_from(conn):
+    """First month still open for movements, or None before any close."""
+    last = conn.execute(text("select max(periodo) from public.inventario_periodos")).scalar()
+    return add_months(last, 1) if last else None
+
+
+def close_period(conn, month):
+    """Close one month: carry every product's balance at its end forward."""
+    prev = add_months(month, -1)
+    conn.execute(text("lock table public.inventario_periodos in share row exclusive mode"))
+    if open_from(conn) not in (None, month):
+        raise ValueError(f"{month:%Y-%m} is not the next open period")
+    ensure_partition(conn, month)
+    # Holds off writers to this month until the close commits; the trigger
+    # then turns them away
+    conn.execute(text(f"lock table public.{partition_name(month)} in share mode"))
+    conn.execute(text("insert into public.inventario_periodos (periodo) values (:p)"), {"p": month})
+    return conn.execute(text(f"""
+        insert into public.inventario_saldos (periodo, producto_id, cantidad)
+        select :p, producto_id, sum(qty)
+        from (
+          select producto_id, cantidad as qty
+          from public.inventario_saldos where periodo = :prev
+          union all
+          select producto_id, case when clase='entrada' then cantidad else -cantidad end
+          from public.{TABLE} where fecha_local >= :p and fecha_local < :next
+        ) t
+        group by producto_id
+        having sum(qty) <> 0
+    """), {"p": month, "prev": prev, "next": add_months(month, 1)}).rowcount
+
+
+def require_partitioned(engine):
+    with engine.connect() as conn:
+        if not is_partitioned(conn):
+            raise ValueError(f"{TABLE} is not partitioned; run `python -m ledger migrate` first")
+
+
+def close_through(engine, through, progress=None):
+    """Close every open month up to and including ``through``, one transaction each.
+
+    ``progress(done, total, month)`` is called after each month.
+    """
+    if through >= month_start(datetime.date.today()):
+        raise ValueError("only months that have ended can be closed")
+    with engine.connect() as conn:
+        month = open_from(conn)
+        if month is None:
+            first = conn.execute(text(f"select min(fecha_local) from public.{TABLE}")).scalar()
+            month = month_start(first) if first else None
+    total = 0 if month is None else max(0, (through.year - month.year) * 12 + through.month - month.month + 1)
+    closed = []
+    while month is not None and month <= through:
+        with engine.begin() as conn:
+            carried = close_period(conn, month)
+        print(f"closed {month:%Y-%m}: {carried} balances carried forward")
+        closed.append(month)
+        if progress:
+            progress(len(closed), total, month)
+        month = add_months(month, 1)
+    return closed
+
+
+def archive_through(engine, through, schema, drop=False):
+    """Detach the partitions of closed months up to ``through``."""
+    done = []
+    with engine.begin() as conn:
+        last_closed = conn.execute(text("select max(periodo) from public.inventario_periodos")).scalar()
+        if last_closed is None or through > last_closed:
+            raise ValueError("only closed periods can be archived; run `close` first")
+        months = conn.execute(text("""
+            select periodo from public.inventario_periodos
+            where periodo <= :t and archivado_at is null order by periodo
+        """), {"t": through}).scalars().all()
+        if not drop:
+            conn.execute(text(f"create schema if not exists {schema}"))
+        for month in months:
+            name = partition_name(month)
+            if conn.execute(text("select to_regclass(:n)"), {"n": f"public.{name}"}).scalar():
+                conn.execute(text(f"alter table public.{TABLE} detach partition public.{name}"))
+                if drop:
+                    conn.execute(text(f"drop table public.{name}"))
+                else:
+                    conn.execute(text(f"alter table public.{name} set schema {schema}"))
+                done.append(name)
+            conn.execute(text("update public.inventario_periodos set archivado_at = now() where periodo = :p"),
+                         {"p": month})
+    return done
+
+
+# ---- CLI --------------------------------------------------------------------
+
+def _status(conn):
+    kind = relkind(conn)
+    print(f"{TABLE}: " + {"p": "partitioned", "r": "not partitioned", None: "missing"}.get(kind, kind))
+    opened = open_from(conn)
+    print(f"open from: {opened:%Y-%m}" if opened else "open from: (no closed periods)")
+    for name, bound, rows in (partitions(conn) if kind == "p" else []):
+        print(f"  {name:<40} {bound:<60} ~{rows} rows")
+    for periodo, cerrado, archivado in conn.execute(text("""
+        select periodo, cerrado_at, archivado_at from public.inventario_periodos order by periodo
+    """)):
+        print(f"  {periodo:%Y-%m} closed {cerrado:%Y-%m-%d}" + (f", archived {archivado:%Y-%m-%d}" if archivado else ""))
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--url", default=os.getenv("DATABASE_URL", ""))
+    sub = ap.add_subparsers(dest="command", required=True)
+    sub.add_parser("status", help="partitions and closed periods")
+    p = sub.add_parser("migrate", help="convert an unpartitioned table, moving its rows")
+    p.add_argument("--keep-legacy", action="store_true", help=f"keep the old table as {TABLE}_legacy")
+    sub.add_parser("maintain", help="create partitions up to LEDGER_PARTITIONS_AHEAD months out")
+    p = sub.add_parser("close", help="close months and carry their balances forward")
+    p.add_argument("--through", type=parse_month, required=True, metavar="YYYY-MM")
+    p = sub.add_parser("archive", help="detach the partitions of closed months")
+    p.add_argument("--through", type=parse_month, required=True, metavar="YYYY-MM")
+    p.add_argument("--drop", action="store_true", help="drop the partitions instead of moving them")
+    args = ap.parse_args(argv)
+    if not args.url:
+        sys.exit("DATABASE_URL (or --url) is required")
+
+    import db
+    db.use_url(args.url)
+    from app import app
+    from blueprints.inventory import create_notify_trigger
+
+    engine = db.get_engine(app)
+    if args.command == "migrate":
+        with engine.begin() as conn:
+            copied = migrate(conn, keep_legacy=args.keep_legacy)
+            if copied is not None:
+                create_notify_trigger(conn, app.config["CHANGE_NOTIFY_ENABLED"])
+        print(f"{TABLE} already partitioned" if copied is None else f"moved {copied} rows into partitions")
+    db.warmup(app)
+
+    with engine.begin() as conn:
+        partitioned = is_partitioned(conn)
+        if args.command == "status":
+            _status(conn)
+            return
+        if args.command == "maintain":
+            if partitioned:
+                ensure_partitions(conn, ahead=app.config["LEDGER_PARTITIONS_AHEAD"])
+            return
+    if args.command in ("close", "archive") and not partitioned:
+        sys.exit(f"{TABLE} is not partitioned; run `python -m ledger migrate` first")
+    try:
+        if args.command == "close":
+            close_through(engine, args.through)
+        elif args.command == "archive":
+            for name in archive_through(engine, args.through, app.config["LEDGER_ARCHIVE_SCHEMA"], args.drop):
+                print(("dropped " if args.drop else f"archived to {app.config['LEDGER_ARCHIVE_SCHEMA']}: ") + name)
+    except ValueError as e:
+        sys.exit(str(e))
+
+
+if __name__ == "__main__":
+    main()
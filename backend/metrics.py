@@ -0,0 +1,245 @@
+"""Per-request instrumentation exposed in Prometheus text format.
+
+Request hooks time every request and SQLAlchemy cursor events count the
+queries and DB time it spends; both feed per-endpoint histograms that
+``render()`` serializes for /api/v1/metrics. A ``Server-Timing`` header
+carries the same numbers to the browser's devtools.
+
+Metrics live in process memory: each gunicorn worker reports its own
+series, labelled with ``pid`` so scrapes from different workers don't
+overwrite each other.
+"""
+import math
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+_lock = threading.Lock()
+
+
+def _fmt_value(value):
+    # Whole numbers as integers (byte totals, counts), the rest at full
+    # precision: :g kept six significant digits, so a byte counter past a
+    # megabyte stopped moving
+    value = float(value)
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if math.isnan(value):
+        return "NaN"
+    if value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.values = {}  # labels tuple -> float
+
+    def inc(self, labels, amount=1.0):
+        with _lock:
+            self.values[labels] = self.values.get(labels, 0.0) + amount
+
+    def lines(self, label_names, prefix=()):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        with _lock:
+            items = sorted(self.values.items())
+        for labels, value in items:
+            yield f"{self.name}{_fmt_labels(label_names, prefix + labels)} {_fmt_value(value)}"
+
+
+class Gauge:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.values = {}  # labels tuple -> float
+
+    def set(self, labels, value):
+        with _lock:
+            self.values[labels] = float(value)
+
+    def lines(self, label_names, prefix=()):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} gauge"
+        with _lock:
+            items = sorted(self.values.items())
+        for labels, value in items:
+            yield f"{self.name}{_fmt_labels(label_names, prefix + labels)} {_fmt_value(value)}"
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self.values = {}  # labels tuple -> [bucket counts..., sum, count]
+
+    def observe(self, labels, value):
+        idx = bisect_left(self.buckets, value)
+        with _lock:
+            series = self.values.get(labels)
+            if series is None:
+                series = self.values[labels] = [0] * len(self.buckets) + [0.0, 0]
+            if idx < len(self.buckets):
+                series[idx] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def lines(self, label_names, prefix=()):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with _lock:
+            items = sorted((k, list(v)) for k, v in self.values.items())
+        for labels, series in items:
+            labels = prefix + labels
+            cumulative = 0
+            for bound, n in zip(self.buckets, series):
+                cumulative += n
+                le = _fmt_labels(label_names + ("le",), labels + (_fmt_value(bound),))
+                yield f"{self.name}_bucket{le} {cumulative}"
+            inf = _fmt_labels(label_names + ("le",), labels + ("+Inf",))
+            yield f"{self.name}_bucket{inf} {series[-1]}"
+            yield f"{self.name}_sum{_fmt_labels(label_names, labels)} {_fmt_value(series[-2])}"
+            yield f"{self.name}_count{_fmt_labels(label_names, labels)} {series[-1]}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _fmt_labels(names, values):
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+# metric -> label names
+REGISTRY = {}
+
+
+def counter(name, help_text, label_names):
+    m = Counter(name, help_text)
+    REGISTRY[name] = (m, tuple(label_names))
+    return m
+
+
+def gauge(name, help_text, label_names):
+    m = Gauge(name, help_text)
+    REGISTRY[name] = (m, tuple(label_names))
+    return m
+
+
+def histogram(name, help_text, label_names, buckets):
+    m = Histogram(name, help_text, buckets)
+    REGISTRY[name] = (m, tuple(label_names))
+    return m
+
+
+REQUESTS = counter(
+    "http_requests_total", "Requests by endpoint, method and status.", ("endpoint", "method", "status"))
+LATENCY = histogram(
+    "http_request_duration_seconds", "Handler latency (until the response object is ready).",
+    ("endpoint", "method"), LATENCY_BUCKETS)
+REQUEST_QUERIES = histogram(
+    "http_request_db_queries", "DB statements executed per request.", ("endpoint",), QUERY_COUNT_BUCKETS)
+REQUEST_DB_TIME = histogram(
+    "http_request_db_seconds", "Time spent in DB statements per request.", ("endpoint",), LATENCY_BUCKETS)
+RESPONSE_SIZE = histogram(
+    "http_response_size_bytes", "Response body size on the wire (buffered responses only).",
+    ("endpoint",), SIZE_BUCKETS)
+DB_QUERIES = counter("db_queries_total", "DB statements executed, by engine.", ("engine",))
+DB_TIME = counter("db_query_seconds_total", "Time spent in DB statements, by engine.", ("engine",))
+DB_ROUTED = counter(
+    "db_read_routing_total", "Engine chosen for read-only endpoints, and why.", ("engine", "reason"))
+DB_REPLICA_LAG = gauge("db_replica_lag_seconds", "Replay lag of the read replica at the last check.", ())
+
+
+def render():
+    pid = (str(os.getpid()),)
+    out = []
+    for metric, label_names in REGISTRY.values():
+        out.extend(metric.lines(("pid",) + label_names, pid))
+    return "\n".join(out) + "\n"
+
+
+# ---- DB instrumentation -----------------------------------------------------
+
+def instrument_engine(engine, role="primary"):
+    """Count statements and DB time per request and per engine."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        DB_QUERIES.inc((role,))
+        DB_TIME.inc((role,), elapsed)
+        stats = g.get("request_stats") if has_request_context() else None
+        if stats is not None:
+            stats.queries += 1
+            stats.db_time += elapsed
+
+    return engine
+
+
+# ---- Request hooks ----------------------------------------------------------
+
+def init_app(app):
+    app.before_request(_start_timer)
+    app.after_request(_record)
+
+
+class RequestStats:
+    __slots__ = ("t0", "queries", "db_time")
+
+    def __init__(self):
+        self.t0 = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+
+
+def _start_timer():
+    g.request_stats = RequestStats()
+
+
+def _observe(endpoint, method, status, stats, size=None):
+    REQUESTS.inc((endpoint, method, status))
+    LATENCY.observe((endpoint, method), time.perf_counter() - stats.t0)
+    REQUEST_QUERIES.observe((endpoint,), stats.queries)
+    REQUEST_DB_TIME.observe((endpoint,), stats.db_time)
+    if size is not None:
+        RESPONSE_SIZE.observe((endpoint,), size)
+
+
+def _record(resp):
+    stats = g.get("request_stats")
+    if stats is None:
+        return resp
+    endpoint = request.endpoint or "unmatched"
+    elapsed = time.perf_counter() - stats.t0
+
+    if resp.is_streamed:
+        # Rows are still being read; observe once the body has been sent.
+        # (Server-Timing below can only describe the work done so far.)
+        method, status = request.method, str(resp.status_code)
+        resp.call_on_close(lambda: _observe(endpoint, method, status, stats))
+    else:
+        _observe(endpoint, request.method, str(resp.status_code), stats, resp.calculate_content_length() or 0)
+
+    resp.headers["Server-Timing"] = (
+        f'app;dur={elapsed * 1000:.1f}, db;dur={stats.db_time * 1000:.1f};desc="{stats.queries} queries"'
+    )
+    origin = request.headers.get("Origin")
+    if origin and origin in current_app.config.get("CORS_ORIGINS", ()):
+        resp.headers["Timing-Allow-Origin"] = origin
+    return resp
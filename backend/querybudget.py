@@ -0,0 +1,70 @@
+"""Per-endpoint query budgets.
+
+Handlers declare the most statements a request may issue:
+
+    @bp.get("/pedidos/<uuid:pedido_id>")
+    @query_budget(1)
+    def get_order(pedido_id): ...
+
+``bench.budgets`` replays representative requests through the Flask test
+client, records every statement with ``StatementRecorder`` and fails when
+an endpoint goes over its budget, printing the statements it ran.
+"""
+import threading
+
+from sqlalchemy import event
+
+
+def query_budget(max_queries):
+    def decorate(fn):
+        fn.query_budget = max_queries
+        return fn
+    return decorate
+
+
+def budget_for(app, endpoint):
+    return getattr(app.view_functions.get(endpoint), "query_budget", None)
+
+
+def budgets(app):
+    """endpoint -> declared budget, for every view that declares one."""
+    return {
+        name: fn.query_budget
+        for name, fn in app.view_functions.items()
+        if getattr(fn, "query_budget", None) is not None
+    }
+
+
+class StatementRecorder:
+    """Collects the SQL an engine runs while active.
+
+    PREPARE statements are not counted: in prepared mode they run once per
+    pooled connection, not per request.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = []
+        self._lock = threading.Lock()
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        head = statement.lstrip()
+        if head[:10].lower() == "set local ":
+            # timeouts.py's statement_timeout prefix rides on the first statement
+            head = head.split(";", 1)[-1].lstrip()
+        if head[:8].lower() == "prepare ":
+            return
+        with self._lock:
+            self.statements.append(statement)
+
+    def __enter__(self):
+        event.listen(self.engine, "before_cursor_execute", self._on_execute)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, "before_cursor_execute", self._on_execute)
+
+    def reset(self):
+        with self._lock:
+            taken, self.statements = self.statements, []
+        return taken
@@ -0,0 +1,243 @@
+"""Reconcile derived inventory tables against the data they come from.
+
+    python -m reconcile                 # report drift
+    python -m reconcile --fix           # and repair it
+    python -m reconcile --chunk 200 --pause 2
+
+also enqueueable as the "stock_reconcile" job ({"fix": true}).
+
+Checked here:
+
+    inventario_saldos     the balance carried forward by each closed month.
+                          It must equal the previous month's balance plus
+                          that month's movements, recomputed from
+                          inventario_movimientos for every closed month
+                          whose partition is still attached. The newest
+                          archived month's balance is trusted as the base,
+                          since its movements are gone.
+    productos_facetas     the per-value product counts behind the facet
+                          sidebar, recounted from productos.caracteristicas.
+
+Live stock and reservations are computed from the ledger and pedido_items
+on every read (statements.py), so they have no stored copy that could
+drift. Derived counters added later belong in this walk.
+
+Products are walked in keyset order (id), RECONCILE_CHUNK_SIZE at a time,
+one short transaction per chunk. After each chunk the walk sleeps
+RECONCILE_PAUSE_RATIO times as long as the chunk took, so it holds at most
+a bounded share of database time and can run during business hours.
+Closed months can't take new movements (ledger.py's trigger), so a chunk
+sees the same numbers whether or not requests are writing meanwhile.
+"""
+import argparse
+import os
+import sys
+import time
+from collections import Counter
+
+from sqlalchemy import text
+
+import ledger
+
+# Next chunk: its last id and how many products it holds
+_CHUNK = text("""
+    select (array_agg(id order by id desc))[1], count(*) from (
+      select id from public.productos where id > :after order by id limit :lim
+    ) c
+""")
+
+# Expected balance per (product, closed month) for one chunk of products:
+# base balance plus the running sum of monthly movements, next to the
+# stored one. Zero balances aren't stored (close_period skips them).
+_SALDOS_DRIFT = text(f"""
+    with prod as (
+      select id from public.productos where id > :after and id <= :upto
+    ),
+    periods as (
+      select periodo from public.inventario_periodos where periodo between :first and :last
+    ),
+    monthly as (
+      select producto_id, date_trunc('month', fecha_local)::date as periodo,
+             sum(case when clase='entrada' then cantidad else -cantidad end) as qty
+      from public.{ledger.TABLE}
+      where producto_id in (select id from prod)
+        and fecha_local >= :first and fecha_local < :next
+      group by 1, 2
+    ),
+    expected as (
+      select prod.id as producto_id, periods.periodo,
+             coalesce(b.cantidad, 0)
+               + sum(coalesce(monthly.qty, 0)) over (partition by prod.id order by periods.periodo) as cantidad
+      from prod
+      cross join periods
+      left join monthly on monthly.producto_id = prod.id and monthly.periodo = periods.periodo
+      left join public.inventario_saldos b on b.periodo = :base and b.producto_id = prod.id
+    ),
+    stored as (
+      select producto_id, periodo, cantidad from public.inventario_saldos
+      where periodo between :first and :last and producto_id in (select id from prod)
+    )
+    select coalesce(e.producto_id, s.producto_id) as producto_id,
+           coalesce(e.periodo, s.periodo) as periodo,
+           coalesce(e.cantidad, 0) as esperado,
+           coalesce(s.cantidad, 0) as registrado
+    from expected e
+    full join stored s on s.producto_id = e.producto_id and s.periodo = e.periodo
+    where coalesce(e.cantidad, 0) <> coalesce(s.cantidad, 0)
+    order by 1, 2
+""")
+
+_SALDO_UPSERT = text("""
+    insert into public.inventario_saldos (periodo, producto_id, cantidad)
+    values (:periodo, :producto_id, :cantidad)
+    on conflict (periodo, producto_id) do update set cantidad = excluded.cantidad
+""")
+
+_SALDO_DELETE = text("""
+    delete from public.inventario_saldos where periodo = :periodo and producto_id = :producto_id
+""")
+
+# Same rule as the productos_facetas trigger: scalar values only
+_FACET_COUNTS = text("""
+    select e.key, e.value::text, count(*)
+    from public.productos p, jsonb_each(p.caracteristicas) e
+    where p.id > :after and p.id <= :upto
+      and jsonb_typeof(e.value) in ('string', 'number', 'boolean')
+    group by 1, 2
+""")
+
+_FACET_STORED = text("select atributo, valor::text, productos from public.productos_facetas")
+
+EXAMPLES = 20  # drift rows kept in the report
+
+
+def _closed_range(conn):
+    """(base, first, last) closed months to check, or None when none is attached.
+
+    ``first`` is the oldest closed month whose movements are still attached,
+    ``base`` the month before it when that one is closed too (its balance is
+    the starting point), else None.
+    """
+    first, last = conn.execute(text("""
+        select min(periodo) filter (where archivado_at is null), max(periodo)
+        from public.inventario_periodos
+    """)).one()
+    if first is None:
+        return None
+    base = ledger.add_months(first, -1)
+    known = conn.execute(text("select 1 from public.inventario_periodos where periodo = :p"), {"p": base}).first()
+    return (base if known else None), first, last
+
+
+def run(engine, fix=False, chunk=500, pause_ratio=1.0, timeout_ms=None, progress=None):
+    """Walk every product and return the drift report; ``fix`` repairs it.
+
+    ``timeout_ms`` caps each chunk's statements. ``progress(done, total)``
+    is called after each chunk.
+    """
+    with engine.connect() as conn:
+        total = conn.execute(text("select count(*) from public.productos")).scalar()
+        closed = _closed_range(conn)
+    report = {
+        "productos": 0, "chunks": 0,
+        "saldos": {"checked": closed is not None, "drift": 0, "fixed": 0, "ejemplos": []},
+        "facetas": {"drift": 0, "fixed": False, "ejemplos": []},
+    }
+    facet_counts = Counter()
+    after = "00000000-0000-0000-0000-000000000000"
+    while True:
+        t0 = time.perf_counter()
+        with engine.begin() as conn:
+            if timeout_ms:
+                conn.execute(text(f"set local statement_timeout = {int(timeout_ms)}"))
+            upto, done = conn.execute(_CHUNK, {"after": after, "lim": chunk}).one()
+            if upto is None:
+                break
+            bounds = {"after": after, "upto": upto}
+            if closed is not None:
+                base, first, last = closed
+                rows = conn.execute(_SALDOS_DRIFT, {
+                    **bounds, "base": base, "first": first, "last": last, "next": ledger.add_months(last, 1),
+                }).all()
+                for r in rows:
+                    report["saldos"]["drift"] += 1
+                    if len(report["saldos"]["ejemplos"]) < EXAMPLES:
+                        report["saldos"]["ejemplos"].append({
+                            "producto_id": str(r.producto_id), "periodo": f"{r.periodo:%Y-%m}",
+                            "esperado": str(r.esperado), "registrado": str(r.registrado),
+                        })
+                    if fix:
+                        params = {"periodo": r.periodo, "producto_id": r.producto_id, "cantidad": r.esperado}
+                        conn.execute(_SALDO_UPSERT if r.esperado else _SALDO_DELETE, params)
+                        report["saldos"]["fixed"] += 1
+            for key, value, n in conn.execute(_FACET_COUNTS, bounds):
+                facet_counts[(key, value)] += n
+        after = upto
+        report["productos"] += done
+        report["chunks"] += 1
+        if progress:
+            progress(report["productos"], total)
+        # Idle pause_ratio x as long as the chunk held the database
+        time.sleep((time.perf_counter() - t0) * pause_ratio)
+
+    with engine.begin() as conn:
+        stored = {(key, value): n for key, value, n in conn.execute(_FACET_STORED)}
+        drift = [
+            {"atributo": key, "valor": value,
+             "esperado": facet_counts.get((key, value), 0), "registrado": stored.get((key, value), 0)}
+            for key, value in sorted(set(facet_counts) | set(stored))
+            if facet_counts.get((key, value), 0) != stored.get((key, value), 0)
+        ]
+        report["facetas"]["drift"] = len(drift)
+        report["facetas"]["ejemplos"] = drift[:EXAMPLES]
+        if drift and fix:
+            # Recounted under the table lock, so products edited during the
+            # walk are counted as they are now. Imported here: the blueprint
+            # imports this module for the job kind
+            from blueprints.inventory import rebuild_facets
+            rebuild_facets(conn)
+            report["facetas"]["fixed"] = True
+    return report
+
+
+# ---- CLI --------------------------------------------------------------------
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--url", default=os.getenv("DATABASE_URL", ""))
+    ap.add_argument("--fix", action="store_true", help="repair the drift found")
+    ap.add_argument("--chunk", type=int, default=None, help="products per chunk (RECONCILE_CHUNK_SIZE)")
+    ap.add_argument("--pause", type=float, default=None,
+                    help="sleep this many times each chunk's duration (RECONCILE_PAUSE_RATIO)")
+    args = ap.parse_args(argv)
+    if not args.url:
+        sys.exit("DATABASE_URL (or --url) is required")
+
+    import db
+    db.use_url(args.url)
+    from app import app
+
+    cfg = app.config
+    report = run(
+        db.get_engine(app), fix=args.fix,
+        chunk=args.chunk or cfg["RECONCILE_CHUNK_SIZE"],
+        pause_ratio=cfg["RECONCILE_PAUSE_RATIO"] if args.pause is None else args.pause,
+        timeout_ms=cfg["DB_STATEMENT_TIMEOUT_MS"],
+        progress=lambda done, total: print(f"\r{done}/{total} products", end="", flush=True),
+    )
+    print()
+    if not report["saldos"]["checked"]:
+        print("saldos: no closed periods with attached movements")
+    for name in ("saldos", "facetas"):
+        part = report[name]
+        if name == "saldos" and not part["checked"]:
+            continue
+        print(f"{name}: {part['drift']} drifted" + (", fixed" if args.fix and part["drift"] else ""))
+        for ex in part["ejemplos"]:
+            print("  " + ", ".join(f"{k}={v}" for k, v in ex.items()))
+    if not args.fix and (report["saldos"]["drift"] or report["facetas"]["drift"]):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+"""Single-flight and a short-TTL cache for expensive read endpoints.
+
+A burst of identical requests (everyone opening /inventario/resumen when a
+meeting starts) should cost one aggregation, not one per browser. Handlers
+wrap the computation:
+
+    body = resultcache.cached("inventory", f"resumen:{pedido_id}", compute)
+
+``compute`` returns the encoded response body (bytes). Concurrent callers
+with the same key share one in-flight call. The result is kept for
+RESULT_CACHE_TTL_SECONDS. Write endpoints declare what they make stale:
+
+    @bp.post("/inventario/movimientos")
+    @invalidates("inventory")
+    def create_movement(): ...
+
+and a successful response (< 400) drops that scope.
+
+RESULT_CACHE_MODE:
+    off     every request computes.
+    local   per worker. Writes served by this worker invalidate at once;
+            other workers drop their copy when the change reaches them
+            over the invalidation bus (cachebus.py), or within the TTL
+            when the bus is down.
+    shared  across workers, in an unlogged Postgres table on the primary.
+            The first worker to miss takes a lease on the key (a row in
+            cache_leases) and computes. The others poll for its entry
+            every SHARED_POLL_SECONDS. Nothing is held between polls: no
+            transaction, no pooler connection. A lease lasts the
+            endpoint's statement timeout. If the leader fails, or its
+            lease runs out, the next poller takes the lease and computes.
+            Writes bump a per-scope generation, so no worker serves a body
+            computed before the write.
+
+Each entry records the scope generation it was computed under. A
+computation that overlaps a write is still returned to the callers that
+were waiting for it, but it is not stored.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, request
+from sqlalchemy import text
+
+import cachebus
+import db
+import metrics
+import timeouts
+
+MODES = ("off", "local", "shared")
+
+# How often a worker waiting on another's computation checks for its entry
+SHARED_POLL_SECONDS = 0.05
+
+LOOKUPS = metrics.counter(
+    "result_cache_lookups_total", "Cached endpoint lookups, by scope and result.", ("scope", "result"))
+
+_entries = OrderedDict()  # (scope, key) -> (expires_at, generation, body)
+_flights = {}             # (scope, key) -> _Flight
+_generations = {}         # scope -> local generation
+_lock = threading.Lock()
+
+
+def invalidates(*scopes):
+    """Mark a write endpoint as making ``scopes`` stale when it succeeds."""
+    def decorate(fn):
+        fn.invalidates = scopes
+        return fn
+    return decorate
+
+
+# ---- Shared (Postgres) ------------------------------------------------------
+
+_SHARED_GET = text("""
+    select e.body from public.cache_entries e
+    where e.key = :key and e.expires_at > now()
+      and e.generation = coalesce(
+          (select generation from public.cache_generations where scope = :scope), 0)
+""")
+
+# A lease, not an advisory lock: a session lock doesn't survive transaction
+# pooling, and a transaction lock would keep a connection idle in it while
+# the body is computed
+_SHARED_CLAIM = text("""
+    insert into public.cache_leases (key, expires_at)
+    values (:key, now() + make_interval(secs => :lease))
+    on conflict (key) do update set expires_at = excluded.expires_at
+    where public.cache_leases.expires_at <= now()
+    returning true
+""")
+
+_SHARED_RELEASE = text("delete from public.cache_leases where key = :key")
+
+_SHARED_GENERATION = text("""
+    select coalesce((select generation from public.cache_generations where scope = :scope), 0)
+""")
+
+_SHARED_PUT = text("""
+    insert into public.cache_entries (key, scope, generation, body, expires_at)
+    values (:key, :scope, :generation, :body, now() + make_interval(secs => :ttl))
+    on conflict (key) do update
+    set generation = excluded.generation, body = excluded.body, expires_at = excluded.expires_at
+""")
+
+_SHARED_BUMP = text("""
+    insert into public.cache_generations (scope, generation) values (:scope, 1)
+    on conflict (scope) do update set generation = public.cache_generations.generation + 1
+""")
+
+
+def init_schema(engine):
+    # Unlogged: a cache doesn't need WAL or to survive a crash
+    with engine.begin() as conn:
+        conn.execute(text("""
+        create unlogged table if not exists public.cache_entries (
+          key text primary key,
+          scope text not null,
+          generation bigint not null,
+          body bytea not null,
+          expires_at timestamptz not null
+        )
+        """))
+        conn.execute(text("""
+        create unlogged table if not exists public.cache_generations (
+          scope text primary key,
+          generation bigint not null default 0
+        )
+        """))
+        conn.execute(text("""
+        create unlogged table if not exists public.cache_leases (
+          key text primary key,
+          expires_at timestamptz not null
+        )
+        """))
+
+
+def _shared_fetch(scope, key, compute, ttl):
+    # Unlogged tables aren't readable on a replica: always the primary
+    eng = db.get_engine(current_app)
+    skey = f"{scope}:{key}"
+    # The computation can't outlast its statement timeout
+    lease = timeouts.budget_ms(current_app, request.endpoint) / 1000.0 + 1
+    waited = False
+    while True:
+        with eng.begin() as conn:
+            body = conn.execute(_SHARED_GET, {"key": skey, "scope": scope}).scalar()
+            claimed = body is None and conn.execute(_SHARED_CLAIM, {"key": skey, "lease": lease}).scalar()
+            if claimed:
+                # The leader may have stored it and let go in between
+                body = conn.execute(_SHARED_GET, {"key": skey, "scope": scope}).scalar()
+                if body is not None:
+                    conn.execute(_SHARED_RELEASE, {"key": skey})
+                    claimed = False
+                else:
+                    generation = conn.execute(_SHARED_GENERATION, {"scope": scope}).scalar()
+        if body is not None:
+            LOOKUPS.inc((scope, "coalesced" if waited else "hit"))
+            return bytes(body)
+        if claimed:
+            break
+        # Another worker is computing it; the request deadline bounds the wait
+        waited = True
+        time.sleep(SHARED_POLL_SECONDS)
+
+    LOOKUPS.inc((scope, "miss"))
+    try:
+        body = compute()
+    finally:
+        # Best effort (the request deadline may be spent by now): a lease
+        # left behind expires, and an entry not stored is computed again
+        try:
+            with eng.begin() as conn:
+                if body is not None:
+                    conn.execute(_SHARED_PUT, {
+                        "key": skey, "scope": scope, "generation": generation, "body": body, "ttl": ttl,
+                    })
+                conn.execute(_SHARED_RELEASE, {"key": skey})
+        except Exception as e:
+            print(f"[CACHE] {skey}: lease not released: {type(e).__name__}: {e}")
+    return body
+
+
+# ---- Single flight ----------------------------------------------------------
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.body = None
+        self.error = None
+
+
+def _coalesce(scope, k, fn):
+    """Run ``fn`` once for concurrent callers of ``k`` in this process."""
+    with _lock:
+        flight = _flights.get(k)
+        leader = flight is None
+        if leader:
+            flight = _flights[k] = _Flight()
+    if not leader:
+        LOOKUPS.inc((scope, "coalesced"))
+        flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.body
+    try:
+        flight.body = fn()
+        return flight.body
+    except BaseException as e:
+        flight.error = e
+        raise
+    finally:
+        with _lock:
+            if _flights.get(k) is flight:
+                del _flights[k]
+        flight.done.set()
+
+
+# ---- Entry points -----------------------------------------------------------
+
+def cached(scope, key, compute):
+    """The body for ``key``: from the cache, a concurrent call, or ``compute()``."""
+    cfg = current_app.config
+    mode, ttl = cfg["RESULT_CACHE_MODE"], cfg["RESULT_CACHE_TTL_SECONDS"]
+    if mode == "off" or ttl <= 0:
+        return compute()
+    k = (scope, key)
+    if mode == "shared":
+        return _coalesce(scope, k, lambda: _shared_fetch(scope, key, compute, ttl))
+
+    now = time.monotonic()
+    with _lock:
+        generation = _generations.get(scope, 0)
+        hit = _entries.get(k)
+        if hit is not None and hit[0] > now and hit[1] == generation:
+            _entries.move_to_end(k)
+            LOOKUPS.inc((scope, "hit"))
+            return hit[2]
+
+    def compute_and_store():
+        LOOKUPS.inc((scope, "miss"))
+        body = compute()
+        with _lock:
+            # Not if a write landed meanwhile: the body may predate it
+            if _generations.get(scope, 0) == generation:
+                _entries[k] = (time.monotonic() + ttl, generation, body)
+                _entries.move_to_end(k)
+                while len(_entries) > cfg["RESULT_CACHE_SIZE"]:
+                    _entries.popitem(last=False)
+        return body
+
+    return _coalesce(scope, k, compute_and_store)
+
+
+def _drop_local(scopes=None):
+    """Drop ``scopes`` (every scope when None) from this worker."""
+    with _lock:
+        if scopes is None:
+            scopes = {k[0] for k in _entries} | {k[0] for k in _flights} | set(_generations)
+        for scope in scopes:
+            _generations[scope] = _generations.get(scope, 0) + 1
+            for k in [k for k in _entries if k[0] == scope]:
+                del _entries[k]
+            # Later callers start a new computation instead of joining one
+            # that may have read the data before this write
+            for k in [k for k in _flights if k[0] == scope]:
+                del _flights[k]
+
+
+@cachebus.subscribe
+def _on_bus(scope, key):
+    # Another worker's write: bodies are per scope, whatever the key
+    _drop_local(None if scope is None else (scope,))
+
+
+def invalidate(*scopes):
+    """Drop ``scopes`` here and, in shared mode, for every worker."""
+    _drop_local(scopes)
+    if current_app.config["RESULT_CACHE_MODE"] == "shared":
+        with db.get_engine(current_app).begin() as conn:
+            for scope in scopes:
+                conn.execute(_SHARED_BUMP, {"scope": scope})
+
+
+def init_app(app):
+    if app.config["RESULT_CACHE_MODE"] not in MODES:
+        raise ValueError(f"RESULT_CACHE_MODE must be one of {MODES}, got {app.config['RESULT_CACHE_MODE']!r}")
+
+    @app.after_request
+    def _invalidate(resp):
+        view = app.view_functions.get(request.endpoint)
+        scopes = getattr(view, "invalidates", None)
+        if scopes and resp.status_code < 400:
+            invalidate(*scopes)
+        return resp
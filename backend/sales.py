@@ -0,0 +1,204 @@
+"""Daily sales rollups behind the /reportes/ventas endpoints.
+
+    python -m sales                 # incremental refresh
+    python -m sales --full          # rebuild from scratch
+
+also the "sales_refresh" job ({"full": true}), which the job runners
+enqueue every SALES_REFRESH_INTERVAL_SECONDS (5 minutes by default; 0
+turns that off, e.g. to run the command from cron instead). Reports say
+how fresh they are. Keep the interval well under the change log
+retention: a refresh that falls behind it silently becomes a full rebuild.
+
+A sale is an approved order, dated on the local day it was approved
+(fecha_local for orders approved before that column existed). Three
+rollups are kept, each one row per day and key:
+
+    ventas_dia_producto   producto_id
+    ventas_dia_cliente    cliente_id (unlinked orders: by cliente_nombre)
+    ventas_dia_vendedor   usuario_id (who took the order)
+
+The refresh is incremental, driven by the change log (changelog.py). The
+watermark is a change log version, and every order logged since then is
+reconsidered: the days it used to count on (ventas_pedidos) and the day it
+counts on now. Those days are recomputed whole from pedidos x
+pedido_items. Edits, cancellations and deletions of approved orders
+therefore correct the rollups, not only new approvals. A first run, or a
+watermark the change log no longer covers, rebuilds everything.
+"""
+import argparse
+import os
+import sys
+
+from sqlalchemy import text
+
+# Day an approved order counts on; indexed below
+SALE_DAY = "coalesce(p.approved_fecha_local, p.fecha_local)"
+
+ROLLUPS = ("ventas_dia_producto", "ventas_dia_cliente", "ventas_dia_vendedor")
+
+# Source rows for a set of days (:dias), or every day when :dias is null
+_SOURCE = f"""
+    select {SALE_DAY} as dia, p.id as pedido_id, p.cliente_id, p.cliente_nombre, p.usuario_id,
+           i.producto_id, i.cantidad, i.cantidad * i.precio as importe
+    from public.pedidos p
+    join public.pedido_items i on i.pedido_id = p.id
+    where p.status = 'approved'
+      and (cast(:dias as date[]) is null or {SALE_DAY} = any(cast(:dias as date[])))
+"""
+
+_INSERTS = {
+    "ventas_dia_producto": f"""
+        insert into public.ventas_dia_producto (dia, producto_id, pedidos, cantidad, importe)
+        select dia, producto_id, count(distinct pedido_id), sum(cantidad), sum(importe)
+        from ({_SOURCE}) s
+        group by dia, producto_id
+    """,
+    "ventas_dia_cliente": f"""
+        insert into public.ventas_dia_cliente (dia, cliente_id, cliente_nombre, pedidos, cantidad, importe)
+        select dia, cliente_id, case when cliente_id is null then cliente_nombre end,
+               count(distinct pedido_id), sum(cantidad), sum(importe)
+        from ({_SOURCE}) s
+        group by 1, 2, 3
+    """,
+    "ventas_dia_vendedor": f"""
+        insert into public.ventas_dia_vendedor (dia, usuario_id, pedidos, lineas, cantidad, importe)
+        select dia, usuario_id, count(distinct pedido_id), count(*), sum(cantidad), sum(importe)
+        from ({_SOURCE}) s
+        group by dia, usuario_id
+    """,
+}
+
+
+def init_schema(engine):
+    with engine.begin() as conn:
+        conn.execute(text(f"""
+        create index if not exists pedidos_venta_dia_idx on public.pedidos (({SALE_DAY.replace('p.', '')}))
+        where status = 'approved'
+        """))
+        conn.execute(text("""
+        create table if not exists public.ventas_dia_producto (
+          dia date not null,
+          producto_id uuid not null,
+          pedidos integer not null,
+          cantidad numeric(14,2) not null,
+          importe numeric(18,4) not null,
+          primary key (dia, producto_id)
+        )
+        """))
+        conn.execute(text("""
+        create table if not exists public.ventas_dia_cliente (
+          dia date not null,
+          cliente_id uuid,
+          cliente_nombre text,
+          pedidos integer not null,
+          cantidad numeric(14,2) not null,
+          importe numeric(18,4) not null
+        )
+        """))
+        conn.execute(text("create index if not exists ventas_dia_cliente_dia_idx on public.ventas_dia_cliente (dia)"))
+        conn.execute(text("""
+        create table if not exists public.ventas_dia_vendedor (
+          dia date not null,
+          usuario_id uuid not null,
+          pedidos integer not null,
+          lineas integer not null,
+          cantidad numeric(14,2) not null,
+          importe numeric(18,4) not null,
+          primary key (dia, usuario_id)
+        )
+        """))
+        # Day each order was last counted on, to find the days its change touches
+        conn.execute(text("""
+        create table if not exists public.ventas_pedidos (
+          pedido_id uuid primary key,
+          dia date not null
+        )
+        """))
+        conn.execute(text("create index if not exists ventas_pedidos_dia_idx on public.ventas_pedidos (dia)"))
+        # Watermark (single row): change log version the rollups are current to
+        conn.execute(text("""
+        create table if not exists public.ventas_estado (
+          id boolean primary key default true check (id),
+          version bigint not null,
+          refreshed_at timestamptz not null
+        )
+        """))
+
+
+def refresh(engine, full=False):
+    """Bring the rollups up to date; returns {"full", "dias", "version"}."""
+    with engine.begin() as conn:
+        # One refresh at a time; a second caller waits and then finds little to do
+        conn.execute(text("select pg_advisory_xact_lock(hashtext('sales_refresh'))"))
+        state = conn.execute(text("""
+            select e.version, (select xid from public.cambios_horizonte) as horizonte
+            from public.ventas_estado e
+        """)).first()
+        # Taken before reading: whatever commits meanwhile is at or above it
+        # and gets reconsidered next time
+        version = conn.execute(text("select pg_snapshot_xmin(pg_current_snapshot())::text::bigint")).scalar()
+        if state is None or (state.horizonte is not None and state.version <= state.horizonte):
+            full = True
+
+        if full:
+            dias = None
+            for table in ROLLUPS + ("ventas_pedidos",):
+                conn.execute(text(f"truncate public.{table}"))
+        else:
+            dias = conn.execute(text(f"""
+                with changed as (
+                  select distinct entidad_id as id from public.cambios
+                  where entidad = 'pedido' and xid >= :since
+                )
+                select coalesce(array_agg(distinct dia), '{{}}') from (
+                  select v.dia from public.ventas_pedidos v where v.pedido_id in (select id from changed)
+                  union all
+                  select {SALE_DAY} from public.pedidos p
+                  where p.status = 'approved' and p.id in (select id from changed)
+                ) d
+            """), {"since": state.version}).scalar()
+            if dias:
+                for table in ROLLUPS + ("ventas_pedidos",):
+                    conn.execute(text(f"delete from public.{table} where dia = any(cast(:dias as date[]))"), {"dias": dias})
+
+        if full or dias:
+            for table in ROLLUPS:
+                conn.execute(text(_INSERTS[table]), {"dias": dias})
+            conn.execute(text(f"""
+                insert into public.ventas_pedidos (pedido_id, dia)
+                select p.id, {SALE_DAY} from public.pedidos p
+                where p.status = 'approved'
+                  and (cast(:dias as date[]) is null or {SALE_DAY} = any(cast(:dias as date[])))
+            """), {"dias": dias})
+
+        conn.execute(text("""
+            insert into public.ventas_estado (id, version, refreshed_at) values (true, :v, now())
+            on conflict (id) do update set version = excluded.version, refreshed_at = excluded.refreshed_at
+        """), {"v": version})
+    return {"full": full, "dias": None if dias is None else len(dias), "version": version}
+
+
+# ---- CLI --------------------------------------------------------------------
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--url", default=os.getenv("DATABASE_URL", ""))
+    ap.add_argument("--full", action="store_true", help="rebuild every day instead of the changed ones")
+    args = ap.parse_args(argv)
+    if not args.url:
+        sys.exit("DATABASE_URL (or --url) is required")
+
+    import db
+    db.use_url(args.url)
+    from app import app
+
+    db.warmup(app)  # the rollup tables, on a first run
+    out = refresh(db.get_engine(app), full=args.full)
+    if out["full"]:
+        print(f"rebuilt all days (version {out['version']})")
+    else:
+        print(f"{out['dias']} day(s) recomputed (version {out['version']})")
+
+
+if __name__ == "__main__":
+    main()
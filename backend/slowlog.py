@@ -0,0 +1,168 @@
+"""Slow-statement log with sampled EXPLAIN (ANALYZE, BUFFERS) capture.
+
+Statements slower than DB_SLOW_QUERY_MS are logged with a fingerprint (the
+SQL with literals stripped), the *types* of their bind parameters and the
+endpoint that ran them, and kept in an in-memory ring buffer that admins
+read from /api/v1/admin/slow-queries.
+
+A DB_EXPLAIN_SAMPLE_RATE fraction of slow read-only statements is re-run
+under EXPLAIN (ANALYZE, BUFFERS) on a background thread, inside a READ ONLY
+transaction with its own statement_timeout, and the plan is attached to the
+ring-buffer entry. Statements matching EXPLAIN_DENY (credential checks) are
+never explained, since the plan text would carry the bound values.
+"""
+import datetime
+import hashlib
+import logging
+import queue
+import random
+import re
+import threading
+import time
+from collections import deque
+
+from flask import has_request_context, request
+from sqlalchemy import event
+
+import metrics
+
+log = logging.getLogger("slowlog")
+
+EXPLAIN_DENY = ("crypt(",)
+
+SLOW_QUERIES = metrics.counter(
+    "db_slow_queries_total", "Statements over DB_SLOW_QUERY_MS, by endpoint.", ("endpoint",))
+
+_buffer = deque(maxlen=100)
+_buffer_lock = threading.Lock()
+_explain_queue = None   # queue.Queue, per process with its thread
+_explain_thread = None
+_explain_lock = threading.Lock()
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+_SPACE_RE = re.compile(r"\s+")
+_READ_RE = re.compile(r"\s*(select|with)\b", re.IGNORECASE)
+# timeouts.py prefixes the first statement of each transaction
+_TIMEOUT_PREFIX_RE = re.compile(r"^\s*set local statement_timeout = \d+;\s*", re.IGNORECASE)
+
+
+def fingerprint(statement):
+    """Normalized SQL and a short stable hash of it."""
+    norm = _STRING_RE.sub("?", statement)
+    norm = _NUMBER_RE.sub("?", norm)
+    norm = _SPACE_RE.sub(" ", norm).strip().lower()
+    return norm, hashlib.sha1(norm.encode("utf-8")).hexdigest()[:12]
+
+
+def param_shapes(parameters):
+    """Bind parameter names -> type names; never the values themselves."""
+    if isinstance(parameters, (list, tuple)) and parameters and isinstance(parameters[0], dict):
+        shapes = param_shapes(parameters[0])
+        shapes["__rows__"] = len(parameters)
+        return shapes
+    if isinstance(parameters, dict):
+        return {k: type(v).__name__ for k, v in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return {str(i): type(v).__name__ for i, v in enumerate(parameters)}
+    return {}
+
+
+def recent():
+    with _buffer_lock:
+        return list(reversed(_buffer))
+
+
+def _explainable(statement):
+    if not _READ_RE.match(statement):
+        return False
+    lowered = statement.lower()
+    return not any(p in lowered for p in EXPLAIN_DENY)
+
+
+def _explain_worker(q, timeout_ms):
+    while True:
+        engine, statement, parameters, entry = q.get()
+        try:
+            with engine.connect() as conn:
+                conn = conn.execution_options(slowlog_skip=True)
+                with conn.begin():
+                    conn.exec_driver_sql("set transaction read only")
+                    conn.exec_driver_sql(f"set local statement_timeout = {int(timeout_ms)}")
+                    plan = conn.exec_driver_sql(
+                        "explain (analyze, buffers, format json) " + statement, parameters
+                    ).scalar()
+            entry["plan"] = plan
+        except Exception as e:
+            entry["plan"] = None
+            entry["plan_error"] = str(e).splitlines()[0]
+        finally:
+            q.task_done()
+
+
+def _ensure_explain_thread(timeout_ms):
+    # Per process, on first use: the engine may be created in the gunicorn
+    # master (preload_app), and a thread started there doesn't exist in the
+    # forked workers. Nor does its queue work there: the dead thread is still
+    # registered as its waiter and would take the wakeups
+    global _explain_queue, _explain_thread
+    t = _explain_thread
+    if t is not None and t.is_alive():
+        return
+    with _explain_lock:
+        if _explain_thread is None or not _explain_thread.is_alive():
+            _explain_queue = queue.Queue(maxsize=16)
+            _explain_thread = threading.Thread(
+                target=_explain_worker, args=(_explain_queue, timeout_ms), name="slowlog-explain", daemon=True
+            )
+            _explain_thread.start()
+
+
+def instrument_engine(engine, config):
+    global _buffer
+    threshold_ms = config["DB_SLOW_QUERY_MS"]
+    if threshold_ms <= 0:
+        return engine
+    sample_rate = config["DB_EXPLAIN_SAMPLE_RATE"]
+    if _buffer.maxlen != config["DB_SLOW_QUERY_RING"]:
+        _buffer = deque(_buffer, maxlen=config["DB_SLOW_QUERY_RING"])
+    explain_timeout_ms = config["DB_EXPLAIN_TIMEOUT_MS"]
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("slowlog_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed_ms = (time.perf_counter() - conn.info["slowlog_start"].pop()) * 1000
+        if elapsed_ms < threshold_ms or conn.get_execution_options().get("slowlog_skip"):
+            return
+
+        endpoint = (request.endpoint if has_request_context() else None) or "-"
+        statement = _TIMEOUT_PREFIX_RE.sub("", statement)
+        norm, fp = fingerprint(statement)
+        shapes = param_shapes(parameters)
+        SLOW_QUERIES.inc((endpoint,))
+        log.warning("[SLOW] %.1fms endpoint=%s fp=%s params=%s sql=%s",
+                    elapsed_ms, endpoint, fp, shapes, norm[:300])
+
+        entry = {
+            "at": datetime.datetime.now(datetime.timezone.utc),
+            "endpoint": endpoint,
+            "duration_ms": round(elapsed_ms, 1),
+            "fingerprint": fp,
+            "sql": norm[:2000],
+            "params": shapes,
+        }
+        with _buffer_lock:
+            _buffer.append(entry)
+
+        if sample_rate > 0 and not executemany and _explainable(statement) and random.random() < sample_rate:
+            _ensure_explain_thread(explain_timeout_ms)
+            entry["plan"] = "pending"
+            try:
+                _explain_queue.put_nowait((engine, statement, parameters, entry))
+            except queue.Full:
+                entry.pop("plan")
+
+    return engine
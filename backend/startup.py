@@ -0,0 +1,20 @@
+# Wall-clock seconds spent in each startup phase, in the order they ran.
+# Phases: "import" (framework + blueprint modules), "config" (Config, CORS,
+# DATABASE_URL resolution) and "db_warmup" (first connection + schema bootstrap).
+TIMINGS = {}
+
+
+def mark(phase, seconds):
+    TIMINGS[phase] = seconds
+
+
+def report():
+    """Phase timings in milliseconds, plus the total."""
+    out = {phase: round(sec * 1000, 1) for phase, sec in TIMINGS.items()}
+    out["total"] = round(sum(TIMINGS.values()) * 1000, 1)
+    return out
+
+
+def log_report(log=print):
+    parts = " ".join(f"{k}={v}ms" for k, v in report().items())
+    log(f"[STARTUP] {parts}")
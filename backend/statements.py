@@ -0,0 +1,741 @@
+"""Central registry of the SQL the API runs per request.
+
+Every statement is compiled once at import time with typed bind parameters,
+so request handlers never rebuild ``text()`` objects. ``run()`` executes a
+statement either as a plain parameterized query (what transaction-mode
+PgBouncer requires) or, on engines flagged with ``enable_prepared()``, as a
+server-side ``PREPARE`` / ``EXECUTE`` pair cached per DBAPI connection.
+
+Schema bootstrap DDL stays inline in each blueprint's ``init_schema``: it
+runs once per process and gains nothing from the registry.
+"""
+import re
+import weakref
+
+from sqlalchemy import bindparam, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB, UUID
+from sqlalchemy.types import BigInteger, Date, DateTime, Integer, Numeric, String, Time
+
+STATEMENT_MODES = ("plain", "prepared", "auto")
+
+REGISTRY = {}
+
+# Same rule text() uses to find ":name" binds (skips "::type" casts)
+_BIND_RE = re.compile(r"(?<![:\w\\]):(\w+)(?!:)")
+_PG = postgresql.dialect()
+_prepared_engines = weakref.WeakSet()
+
+
+class Statement:
+    def __init__(self, name, sql, types):
+        self.name = name
+        self.sql = sql
+        self.types = types
+
+        order = []
+        def _positional(m):
+            key = m.group(1)
+            if key not in order:
+                order.append(key)
+            return f"${order.index(key) + 1}"
+        positional_sql = _BIND_RE.sub(_positional, sql)
+
+        missing = [k for k in order if k not in types]
+        if missing:
+            raise ValueError(f"statement {name!r}: untyped bind params {missing}")
+        self.param_order = order
+
+        binds = [bindparam(k, type_=types[k]) for k in order]
+        self.clause = text(sql).bindparams(*binds)
+
+        # Server-side prepared form: PREPARE once per connection, then EXECUTE
+        # (PREPARE only accepts DML; utility statements always run plain)
+        self.preparable = sql.split(None, 1)[0].lower() in ("select", "insert", "update", "delete", "with")
+        self.pg_name = f"gt_{name}"
+        pg_types = ", ".join(types[k].compile(dialect=_PG) for k in order)
+        self.prepare_sql = (
+            f"prepare {self.pg_name}" + (f" ({pg_types})" if order else "") + f" as {positional_sql}"
+        )
+        args = ", ".join(f":{k}" for k in order)
+        self.execute_clause = text(
+            f"execute {self.pg_name}" + (f"({args})" if order else "")
+        ).bindparams(*[bindparam(k, type_=types[k]) for k in order])
+
+    def __repr__(self):
+        return f"<Statement {self.name}>"
+
+
+def register(name, sql, **types):
+    if name in REGISTRY:
+        raise ValueError(f"statement {name!r} registered twice")
+    stmt = Statement(name, sql, types)
+    REGISTRY[name] = stmt
+    return stmt
+
+
+# ---- Mode selection ---------------------------------------------------------
+
+def is_transaction_pooler(url):
+    """Transaction-mode PgBouncer (Supabase pooler on 6543) can't keep PREPAREd statements."""
+    u = str(url).lower()
+    return ":6543" in u or "pgbouncer" in u
+
+
+def resolve_mode(mode, url):
+    """Map the configured DB_STATEMENT_MODE to 'plain' or 'prepared' for this URL."""
+    mode = (mode or "plain").lower()
+    if mode not in STATEMENT_MODES:
+        raise ValueError(f"DB_STATEMENT_MODE must be one of {STATEMENT_MODES}, got {mode!r}")
+    if mode == "plain":
+        return "plain"
+    if is_transaction_pooler(url):
+        if mode == "prepared":
+            print("[DB] DB_STATEMENT_MODE=prepared ignored: URL points at a transaction pooler")
+        return "plain"
+    return "prepared"
+
+
+def enable_prepared(engine):
+    _prepared_engines.add(engine)
+
+
+def uses_prepared(engine):
+    return engine in _prepared_engines
+
+
+def run(conn, stmt, params=None):
+    """Execute a registered statement on ``conn`` and return the Result."""
+    params = params or {}
+    if (
+        not stmt.preparable
+        or conn.engine not in _prepared_engines
+        # DECLARE ... CURSOR can't wrap EXECUTE: server-side cursors run plain
+        or conn.get_execution_options().get("stream_results")
+    ):
+        return conn.execute(stmt.clause, params)
+
+    prepared = conn.connection.info.setdefault("prepared_statements", set())
+    if stmt.name not in prepared:
+        conn.exec_driver_sql(stmt.prepare_sql)
+        prepared.add(stmt.name)
+    return conn.execute(stmt.execute_clause, params)
+
+
+# ---- Auth / users -----------------------------------------------------------
+
+# Cache invalidation messages (cachebus.py); writes emit them from the same
+# statement, so they cost no extra round trip and arrive only on commit
+CACHE_CHANNEL = "gestor_cache"
+
+
+def _notify_cache(scope, key_sql):
+    return (f"pg_notify('{CACHE_CHANNEL}', json_build_object("
+            f"'scope', '{scope}', 'key', {key_sql}, 'origin', :origin)::text)")
+
+
+# Login in one round trip: verify the password and create the prefs row on
+# first login. The outer select can't see the CTE's insert, hence coalesce.
+LOGIN = register("login", """
+    with u as (
+      select id, nombre_completo, email, profile
+      from public.usuarios
+      where email = :email
+        and password_hash = crypt(:password, password_hash)
+      limit 1
+    ),
+    created as (
+      insert into public.usuarios_prefs (user_id, prefs)
+      select id, :defaults from u
+      on conflict (user_id) do nothing
+      returning prefs
+    )
+    select u.id, u.nombre_completo, u.email, u.profile,
+           coalesce(created.prefs, p.prefs) as prefs
+    from u
+    left join created on true
+    left join public.usuarios_prefs p on p.user_id = u.id
+""", email=String(), password=String(), defaults=JSONB())
+
+PREFS_UPSERT = register("prefs_upsert", """
+    with saved as (
+      insert into public.usuarios_prefs (user_id, prefs, updated_at)
+      values (:uid, :prefs, now())
+      on conflict (user_id) do update
+        set prefs = excluded.prefs,
+            updated_at = now()
+      returning user_id
+    )
+    select """ + _notify_cache("users", "saved.user_id") + """ from saved
+""", uid=UUID(as_uuid=False), prefs=JSONB(), origin=String())
+
+USER_WITH_PREFS = register("user_with_prefs", """
+    select u.id, u.nombre_completo, u.email, u.profile, p.prefs
+    from public.usuarios u
+    left join public.usuarios_prefs p on p.user_id = u.id
+    where u.id = :uid
+""", uid=UUID(as_uuid=False))
+
+# Text the admin user search matches against; usuarios_busqueda_trgm
+# (app.users_init_schema) indexes this exact expression
+USER_SEARCH_EXPR = "lower(nombre_completo || ' ' || email || ' ' || profile)"
+
+# Keyset page, newest first: rows strictly after the (created_at, id) of the
+# previous page's last row. The first page passes nulls, which coalesce to
+# the top of the ordering.
+ADMIN_LIST_USERS = register("admin_list_users", f"""
+    select id, nombre_completo, email, profile, created_at
+    from public.usuarios
+    where (created_at, id) < (coalesce(:after_at, 'infinity'::timestamptz),
+                              coalesce(:after_id, 'ffffffff-ffff-ffff-ffff-ffffffffffff'::uuid))
+      and (:p is null or {USER_SEARCH_EXPR} like :p)
+    order by created_at desc, id desc
+    limit :lim
+""", after_at=DateTime(timezone=True), after_id=UUID(as_uuid=False), p=String(), lim=Integer())
+
+USER_EMAIL_EXISTS = register("user_email_exists", """
+    select 1 from public.usuarios where email = :e
+""", e=String())
+
+ENSURE_PGCRYPTO = register("ensure_pgcrypto", """
+    create extension if not exists pgcrypto
+""")
+
+USER_INSERT = register("user_insert", """
+    insert into public.usuarios (nombre_completo, email, password_hash, profile)
+    values (:n, :e, crypt(:p, gen_salt('bf')), :pr)
+    returning id, nombre_completo, email, profile, created_at
+""", n=String(), e=String(), p=String(), pr=String())
+
+USER_PREFS_DELETE = register("user_prefs_delete", """
+    delete from public.usuarios_prefs where user_id = :uid
+""", uid=UUID(as_uuid=False))
+
+USER_DELETE = register("user_delete", """
+    with gone as (
+      delete from public.usuarios where id = :uid returning id
+    )
+    select gone.id, """ + _notify_cache("users", "gone.id") + """ from gone
+""", uid=UUID(as_uuid=False), origin=String())
+
+
+# ---- Inventory --------------------------------------------------------------
+
+# Stock per product: the balance carried forward by the last closed period
+# (ledger.py) plus the movements of the open months. The fecha_local bound
+# lets Postgres skip closed partitions at execution time. {products} narrows
+# both sides to a set of producto_id.
+_STOCK_SQL = """
+    select producto_id, sum(qty) as qty
+    from (
+      select producto_id, cantidad as qty
+      from public.inventario_saldos
+      where periodo = (select max(periodo) from public.inventario_periodos)
+        {products}
+      union all
+      select producto_id, case when clase='entrada' then cantidad else -cantidad end
+      from public.inventario_movimientos
+      where fecha_local >= (
+          select coalesce((max(periodo) + interval '1 month')::date, '-infinity'::date)
+          from public.inventario_periodos)
+        {products}
+    ) ledger
+    group by producto_id
+"""
+
+# Reserved = items from draft/submitted orders; the *_EXCLUDING variants
+# leave out one order (the one being edited) so its own lines don't count
+# against it. The *_FILTERED variants keep the products whose
+# caracteristicas match :filtro, a jsonpath predicate built from the facet
+# filters (blueprints/inventory.py facet_path). They use the GIN
+# jsonb_path_ops index, and stock is computed for those products only.
+_INVENTORY_SUMMARY_SQL = """
+  with stock as ({stock}),
+  reserved as (
+    select i.producto_id, sum(i.cantidad) as reservado
+    from public.pedido_items i
+    join public.pedidos p on p.id = i.pedido_id
+    where p.status in ('draft','submitted')
+      {where_extra}
+    group by i.producto_id
+  )
+  select
+    p.id,
+    p.referencia,
+    p.descripcion,
+    p.precio_lista,
+    p.caracteristicas,
+    coalesce(s.qty,0)                                     as cantidad_actual,
+    coalesce(s.qty,0) - coalesce(r.reservado,0)           as cantidad_disponible
+  from public.productos p
+  left join stock s on s.producto_id = p.id
+  left join reserved r on r.producto_id = p.id
+  {product_where}
+  order by p.referencia asc
+"""
+
+_FACET_MATCH = "caracteristicas @@ cast(:filtro as jsonpath)"
+
+
+def _inventory_summary_sql(excluding=False, filtered=False):
+    narrow = f"and producto_id in (select id from public.productos where {_FACET_MATCH})"
+    return _INVENTORY_SUMMARY_SQL.format(
+        stock=_STOCK_SQL.format(products=narrow if filtered else ""),
+        where_extra="and p.id <> :po" if excluding else "",
+        product_where=f"where p.{_FACET_MATCH}" if filtered else "",
+    )
+
+
+INVENTORY_SUMMARY = register(
+    "inventory_summary", _inventory_summary_sql(),
+)
+
+INVENTORY_SUMMARY_EXCLUDING = register(
+    "inventory_summary_excluding", _inventory_summary_sql(excluding=True),
+    po=UUID(as_uuid=False),
+)
+
+INVENTORY_SUMMARY_FILTERED = register(
+    "inventory_summary_filtered", _inventory_summary_sql(filtered=True),
+    filtro=String(),
+)
+
+INVENTORY_SUMMARY_FILTERED_EXCLUDING = register(
+    "inventory_summary_filtered_excluding", _inventory_summary_sql(excluding=True, filtered=True),
+    po=UUID(as_uuid=False), filtro=String(),
+)
+
+# Facet sidebar: value counts per attribute, kept current by the
+# productos_facetas trigger (blueprints/inventory.py), so this never
+# aggregates the catalog
+FACETS = register("facets", """
+    select atributo, valor, productos
+    from public.productos_facetas
+    where productos > 0
+    order by atributo, productos desc, valor
+""")
+
+# Availability for a chosen set of products (by id or referencia) in one
+# statement; stock and reservations are computed for those products only.
+# A null :po counts every open order as reserved.
+PRODUCTS_AVAILABILITY = register("products_availability", """
+    with prod as (
+      select id, referencia, descripcion
+      from public.productos
+      where id = any(cast(:ids as uuid[])) or referencia = any(cast(:refs as text[]))
+    ),
+    stock as (""" + _STOCK_SQL.format(products="and producto_id in (select id from prod)") + """),
+    reserved as (
+      select i.producto_id, sum(i.cantidad) as qty
+      from public.pedido_items i
+      join public.pedidos p on p.id = i.pedido_id
+      where i.producto_id in (select id from prod)
+        and p.status in ('draft','submitted')
+        and p.id is distinct from :po
+      group by i.producto_id
+    )
+    select prod.id, prod.referencia, prod.descripcion,
+           coalesce(stock.qty,0)                              as cantidad_actual,
+           coalesce(reserved.qty,0)                           as cantidad_reservada,
+           coalesce(stock.qty,0) - coalesce(reserved.qty,0)   as cantidad_disponible
+    from prod
+    left join stock on stock.producto_id = prod.id
+    left join reserved on reserved.producto_id = prod.id
+    order by prod.referencia
+""", ids=ARRAY(String()), refs=ARRAY(String()), po=UUID(as_uuid=False))
+
+# Delta sync (changelog.py). The version token is taken first, in its own
+# snapshot: whatever commits before the rows are read is sent now and,
+# being at or above the token, again next time. :horizonte is null until
+# the log is first purged.
+CHANGES_VERSION = register("changes_version", """
+    select pg_snapshot_xmin(pg_current_snapshot())::text::bigint as version,
+           (select xid from public.cambios_horizonte) as horizonte
+""")
+
+# Products logged since :since, shaped like INVENTORY_SUMMARY rows; a
+# logged id that no longer exists comes back with deleted = true
+INVENTORY_CHANGES = register("inventory_changes", """
+    with changed as (
+      select distinct entidad_id as id
+      from public.cambios
+      where entidad = 'producto' and xid >= :since
+    ),
+    stock as (""" + _STOCK_SQL.format(products="and producto_id in (select id from changed)") + """),
+    reserved as (
+      select i.producto_id, sum(i.cantidad) as reservado
+      from public.pedido_items i
+      join public.pedidos p on p.id = i.pedido_id
+      where i.producto_id in (select id from changed)
+        and p.status in ('draft','submitted')
+        and p.id is distinct from :po
+      group by i.producto_id
+    )
+    select
+      c.id,
+      p.id is null                                          as deleted,
+      p.referencia,
+      p.descripcion,
+      p.precio_lista,
+      p.caracteristicas,
+      coalesce(s.qty,0)                                     as cantidad_actual,
+      coalesce(s.qty,0) - coalesce(r.reservado,0)           as cantidad_disponible
+    from changed c
+    left join public.productos p on p.id = c.id
+    left join stock s on s.producto_id = c.id
+    left join reserved r on r.producto_id = c.id
+    order by p.referencia asc
+""", since=BigInteger(), po=UUID(as_uuid=False))
+
+PRODUCT_ID_BY_REF = register("product_id_by_ref", """
+    select id from productos where referencia = :r
+""", r=String())
+
+MOVEMENT_INSERT = register("movement_insert", """
+    insert into inventario_movimientos
+    (producto_id, cantidad, clase, tipo, motivo, usuario_id, fecha_local, hora_local, ubicacion)
+    values (:producto_id, :cantidad, :clase, :tipo, :motivo, :usuario_id, :fecha_local, :hora_local, :ubicacion)
+""", producto_id=UUID(as_uuid=False), cantidad=Numeric(12, 2), clase=String(), tipo=String(),
+    motivo=String(), usuario_id=UUID(as_uuid=False), fecha_local=Date(), hora_local=Time(),
+    ubicacion=String())
+
+PRODUCT_INSERT = register("product_insert", """
+    insert into productos (referencia, descripcion, precio_lista, caracteristicas)
+    values (:r, :d, :pl, :c)
+""", r=String(), d=String(), pl=Numeric(12, 2), c=JSONB())
+
+
+# ---- Clients ----------------------------------------------------------------
+
+_CLIENT_COLUMNS = "id, nombre, direccion, direccion_entrega, email, telefono, persona_contacto, ciudad, pais"
+
+CLIENTS_LIST = register("clients_list", f"""
+    select {_CLIENT_COLUMNS}
+    from public.clientes
+    order by lower(nombre) asc limit :lim
+""", lim=Integer())
+
+CLIENTS_SEARCH = register("clients_search", f"""
+    select {_CLIENT_COLUMNS}
+    from public.clientes
+    where
+      lower(nombre) like :p or
+      lower(coalesce(email,'')) like :p or
+      lower(coalesce(telefono,'')) like :p or
+      lower(coalesce(persona_contacto,'')) like :p or
+      lower(coalesce(ciudad,'')) like :p or
+      lower(coalesce(pais,'')) like :p
+    order by lower(nombre) asc limit :lim
+""", p=String(), lim=Integer())
+
+CLIENT_INSERT = register("client_insert", """
+    insert into public.clientes
+    (nombre, direccion, direccion_entrega, email, telefono, persona_contacto, ciudad, pais)
+    values (:n, :d, :de, :e, :t, :pc, :c, :p)
+    returning id
+""", n=String(), d=String(), de=String(), e=String(), t=String(), pc=String(), c=String(), p=String())
+
+CLIENT_BY_ID = register("client_by_id", f"""
+    select {_CLIENT_COLUMNS}
+    from public.clientes where id = :id
+""", id=UUID(as_uuid=False))
+
+CLIENT_ORDER_DEFAULTS = register("client_order_defaults", """
+    select nombre, telefono, coalesce(direccion_entrega, direccion) as dir_ent
+    from public.clientes where id = :cid
+""", cid=UUID(as_uuid=False))
+
+
+# Bulk import: every client the file names, by id or email, in one lookup
+CLIENTS_ORDER_DEFAULTS_MANY = register("clients_order_defaults_many", """
+    select id, lower(email) as email, nombre, telefono, coalesce(direccion_entrega, direccion) as dir_ent
+    from public.clientes
+    where id = any(cast(:ids as uuid[])) or lower(email) = any(cast(:emails as text[]))
+""", ids=ARRAY(String()), emails=ARRAY(String()))
+
+# ---- Orders -----------------------------------------------------------------
+
+ORDER_STATUS_BY_ID = register("order_status_by_id", """
+    select id, status from public.pedidos where id = :id
+""", id=UUID(as_uuid=False))
+
+ORDER_APPROVE = register("order_approve", """
+    update public.pedidos
+    set status = cast(:st as public.order_status),
+        approved_at = now(),
+        approved_by = :uid,
+        approved_fecha_local = current_date,
+        approved_hora_local = current_time
+    where id = :id
+    returning id, status, approved_at, approved_by, approved_fecha_local, approved_hora_local
+""", st=String(), id=UUID(as_uuid=False), uid=UUID(as_uuid=False))
+
+ORDER_INSERT = register("order_insert", """
+    insert into public.pedidos
+    (cliente_id, cliente_nombre, cliente_telefono, direccion_entrega, fecha_entrega, usuario_id, fecha_local, hora_local)
+    values (:cid, :n, :t, :d, :fe, :uid, coalesce(:fl, current_date), coalesce(:hl, current_time))
+    returning id
+""", cid=UUID(as_uuid=False), n=String(), t=String(), d=String(), fe=Date(),
+    uid=UUID(as_uuid=False), fl=Date(), hl=Time())
+
+ORDERS_LIST = register("orders_list", """
+    with totals as (
+      select
+        i.pedido_id,
+        sum(i.cantidad) as items_count,
+        sum(i.cantidad * i.precio) as total
+      from public.pedido_items i
+      group by i.pedido_id
+    )
+    select
+      p.id, p.status, p.cliente_nombre, p.cliente_telefono, p.direccion_entrega,
+      p.fecha_entrega, p.created_at,
+      coalesce(t.items_count,0) as items_count,
+      coalesce(t.total,0) as total
+    from public.pedidos p
+    left join totals t on t.pedido_id = p.id
+    order by p.created_at desc
+    limit 200
+""")
+
+# Orders logged since :since (changelog.py), shaped like ORDERS_LIST rows;
+# deleted orders come back with deleted = true
+ORDERS_CHANGES = register("orders_changes", """
+    with changed as (
+      select distinct entidad_id as id
+      from public.cambios
+      where entidad = 'pedido' and xid >= :since
+    ),
+    totals as (
+      select
+        i.pedido_id,
+        sum(i.cantidad) as items_count,
+        sum(i.cantidad * i.precio) as total
+      from public.pedido_items i
+      where i.pedido_id in (select id from changed)
+      group by i.pedido_id
+    )
+    select
+      c.id, p.id is null as deleted,
+      p.status, p.cliente_nombre, p.cliente_telefono, p.direccion_entrega,
+      p.fecha_entrega, p.created_at,
+      coalesce(t.items_count,0) as items_count,
+      coalesce(t.total,0) as total
+    from changed c
+    left join public.pedidos p on p.id = c.id
+    left join totals t on t.pedido_id = c.id
+    order by p.created_at desc
+""", since=BigInteger())
+
+# BI export: one flat row per order line (an order without lines gives one
+# row with null item columns), in (fecha_local, id) index order so a
+# server-side cursor returns the first rows without sorting the range.
+# Null bounds leave that side open.
+ORDERS_EXPORT = register("orders_export", """
+    select
+      p.id as pedido_id, p.status, p.cliente_id, p.cliente_nombre, p.cliente_telefono,
+      p.direccion_entrega, p.fecha_entrega, p.fecha_local, p.hora_local, p.created_at,
+      p.approved_at, p.approved_by,
+      i.id as item_id, i.producto_id, i.referencia, i.descripcion, i.cantidad, i.precio,
+      i.cantidad * i.precio as importe
+    from public.pedidos p
+    left join public.pedido_items i on i.pedido_id = p.id
+    where p.fecha_local >= coalesce(:desde, '-infinity'::date)
+      and p.fecha_local <= coalesce(:hasta, 'infinity'::date)
+      and p.status::text = any(cast(:statuses as text[]))
+    order by p.fecha_local, p.id, i.created_at
+""", desde=Date(), hasta=Date(), statuses=ARRAY(String()))
+
+ORDER_DETAIL = register("order_detail", """
+    select p.id, p.status, p.cliente_nombre, p.cliente_telefono, p.direccion_entrega,
+           p.fecha_entrega, p.fecha_local, p.hora_local, p.created_at,
+           p.approved_at, p.approved_by, p.approved_fecha_local, p.approved_hora_local,
+           i.id as item_id, i.producto_id as item_producto_id, i.referencia as item_referencia,
+           i.descripcion as item_descripcion, i.cantidad as item_cantidad, i.precio as item_precio,
+           i.created_at as item_created_at
+    from public.pedidos p
+    left join public.pedido_items i on i.pedido_id = p.id
+    where p.id = :id
+    order by i.created_at asc
+""", id=UUID(as_uuid=False))
+
+PRODUCT_AVAILABLE = register("product_available", """
+    select
+      coalesce((select qty from (""" + _STOCK_SQL.format(products="and producto_id = :pid") + """) s),0)
+      -
+      (select coalesce(sum(i.cantidad),0)
+       from public.pedido_items i
+       join public.pedidos p on p.id = i.pedido_id
+       where i.producto_id = :pid
+         and p.status in ('draft','submitted')
+         and p.id <> :po)
+""", pid=UUID(as_uuid=False), po=UUID(as_uuid=False))
+
+PRODUCT_BY_REF = register("product_by_ref", """
+    select id, referencia, descripcion, precio_lista from public.productos where referencia = :r
+""", r=String())
+
+# Batch item add: one round trip resolves every requested product with its
+# stock, reservations in other open orders and the line already in this order.
+ORDER_LINES_RESOLVE = register("order_lines_resolve", """
+    with prod as (
+      select id, referencia, descripcion, precio_lista
+      from public.productos
+      where id = any(cast(:ids as uuid[])) or referencia = any(cast(:refs as text[]))
+    ),
+    stock as (""" + _STOCK_SQL.format(products="and producto_id in (select id from prod)") + """),
+    reserved as (
+      select i.producto_id, sum(i.cantidad) as qty
+      from public.pedido_items i
+      join public.pedidos p on p.id = i.pedido_id
+      where i.producto_id in (select id from prod)
+        and p.status in ('draft','submitted')
+        and p.id <> :po
+      group by i.producto_id
+    ),
+    mine as (
+      select distinct on (producto_id) producto_id, id, cantidad, precio
+      from public.pedido_items
+      where pedido_id = :po and producto_id in (select id from prod)
+      order by producto_id, created_at
+    )
+    select prod.id, prod.referencia, prod.descripcion, prod.precio_lista,
+           coalesce(stock.qty,0) - coalesce(reserved.qty,0) as available,
+           mine.id as item_id, mine.cantidad as item_cantidad, mine.precio as item_precio
+    from prod
+    left join stock on stock.producto_id = prod.id
+    left join reserved on reserved.producto_id = prod.id
+    left join mine on mine.producto_id = prod.id
+""", ids=ARRAY(String()), refs=ARRAY(String()), po=UUID(as_uuid=False))
+
+ORDER_ITEMS_INSERT_MANY = register("order_items_insert_many", """
+    insert into public.pedido_items
+    (pedido_id, producto_id, referencia, descripcion, cantidad, precio)
+    select :po, u.pid, u.ref, u.descr, u.c, u.p
+    from unnest(cast(:pids as uuid[]), cast(:refs as text[]), cast(:descs as text[]),
+                cast(:cs as numeric[]), cast(:ps as numeric[])) as u(pid, ref, descr, c, p)
+    returning id, producto_id
+""", po=UUID(as_uuid=False), pids=ARRAY(String()), refs=ARRAY(String()), descs=ARRAY(String()),
+    cs=ARRAY(Numeric(12, 2)), ps=ARRAY(Numeric(12, 2)))
+
+ORDER_ITEMS_UPDATE_MANY = register("order_items_update_many", """
+    update public.pedido_items i
+    set cantidad = u.c, precio = u.p
+    from unnest(cast(:ids as uuid[]), cast(:cs as numeric[]), cast(:ps as numeric[])) as u(id, c, p)
+    where i.id = u.id
+""", ids=ARRAY(String()), cs=ARRAY(Numeric(12, 2)), ps=ARRAY(Numeric(12, 2)))
+
+# Bulk import (POST /pedidos/import): all orders, then all their lines, one
+# statement each. Order ids are generated by the caller so lines can
+# reference them without a round trip.
+ORDERS_IMPORT = register("orders_import", """
+    insert into public.pedidos
+    (id, cliente_id, cliente_nombre, cliente_telefono, direccion_entrega, fecha_entrega, usuario_id)
+    select u.id, u.cid, u.n, u.t, u.d, u.fe, :uid
+    from unnest(cast(:ids as uuid[]), cast(:cids as uuid[]), cast(:ns as text[]), cast(:ts as text[]),
+                cast(:ds as text[]), cast(:fes as date[])) as u(id, cid, n, t, d, fe)
+""", ids=ARRAY(String()), cids=ARRAY(String()), ns=ARRAY(String()), ts=ARRAY(String()),
+    ds=ARRAY(String()), fes=ARRAY(String()), uid=UUID(as_uuid=False))
+
+ORDER_ITEMS_IMPORT = register("order_items_import", """
+    insert into public.pedido_items
+    (pedido_id, producto_id, referencia, descripcion, cantidad, precio)
+    select u.po, u.pid, u.ref, u.descr, u.c, u.p
+    from unnest(cast(:pos as uuid[]), cast(:pids as uuid[]), cast(:refs as text[]), cast(:descs as text[]),
+                cast(:cs as numeric[]), cast(:ps as numeric[])) as u(po, pid, ref, descr, c, p)
+""", pos=ARRAY(String()), pids=ARRAY(String()), refs=ARRAY(String()), descs=ARRAY(String()),
+    cs=ARRAY(Numeric(12, 2)), ps=ARRAY(Numeric(12, 2)))
+
+ORDER_ITEM_BY_ID = register("order_item_by_id", """
+    select id, producto_id, cantidad, precio from public.pedido_items where id = :id and pedido_id = :po
+""", id=UUID(as_uuid=False), po=UUID(as_uuid=False))
+
+ORDER_ITEM_UPDATE = register("order_item_update", """
+    update public.pedido_items set cantidad = :c, precio = :p where id = :id
+""", c=Numeric(12, 2), p=Numeric(12, 2), id=UUID(as_uuid=False))
+
+ORDER_ITEM_DELETE = register("order_item_delete", """
+    delete from public.pedido_items where id = :id and pedido_id = :po
+""", id=UUID(as_uuid=False), po=UUID(as_uuid=False))
+
+ORDER_SUBMIT = register("order_submit", """
+    update public.pedidos set status = 'submitted' where id = :id
+""", id=UUID(as_uuid=False))
+
+ORDER_ITEMS_DELETE_ALL = register("order_items_delete_all", """
+    delete from public.pedido_items where pedido_id = :pid
+""", pid=UUID(as_uuid=False))
+
+ORDER_DELETE = register("order_delete", """
+    delete from public.pedidos where id = :pid returning id
+""", pid=UUID(as_uuid=False))
+
+
+# ---- Sales reports ----------------------------------------------------------
+# Read the daily rollups kept by sales.py, never pedidos x pedido_items.
+
+SALES_STATE = register("sales_state", """
+    select refreshed_at from public.ventas_estado
+""")
+
+SALES_BY_PRODUCT = register("sales_by_product", """
+    select v.producto_id, p.referencia, p.descripcion,
+           sum(v.pedidos) as pedidos, sum(v.cantidad) as cantidad, sum(v.importe) as importe
+    from public.ventas_dia_producto v
+    join public.productos p on p.id = v.producto_id
+    where v.dia between :desde and :hasta
+    group by v.producto_id, p.referencia, p.descripcion
+    order by importe desc, p.referencia
+    limit :lim
+""", desde=Date(), hasta=Date(), lim=Integer())
+
+SALES_BY_CLIENT = register("sales_by_client", """
+    select v.cliente_id, coalesce(c.nombre, v.cliente_nombre) as cliente,
+           sum(v.pedidos) as pedidos, sum(v.cantidad) as cantidad, sum(v.importe) as importe
+    from public.ventas_dia_cliente v
+    left join public.clientes c on c.id = v.cliente_id
+    where v.dia between :desde and :hasta
+    group by v.cliente_id, v.cliente_nombre, c.nombre
+    order by importe desc, cliente
+    limit :lim
+""", desde=Date(), hasta=Date(), lim=Integer())
+
+SALES_BY_SELLER = register("sales_by_seller", """
+    select v.usuario_id, u.nombre_completo as vendedor,
+           sum(v.pedidos) as pedidos, sum(v.lineas) as lineas,
+           sum(v.cantidad) as cantidad, sum(v.importe) as importe
+    from public.ventas_dia_vendedor v
+    left join public.usuarios u on u.id = v.usuario_id
+    where v.dia between :desde and :hasta
+    group by v.usuario_id, u.nombre_completo
+    order by importe desc, vendedor
+    limit :lim
+""", desde=Date(), hasta=Date(), lim=Integer())
+
+SALES_DAILY = register("sales_daily", """
+    select dia, sum(pedidos) as pedidos, sum(lineas) as lineas,
+           sum(cantidad) as cantidad, sum(importe) as importe
+    from public.ventas_dia_vendedor
+    where dia between :desde and :hasta
+    group by dia
+    order by dia
+    limit :lim
+""", desde=Date(), hasta=Date(), lim=Integer())
+
+
+# ---- Jobs -------------------------------------------------------------------
+
+_JOB_COLUMNS = (
+    "id, tipo, params, status, progress, message, result, error, usuario_id, attempts, "
+    "created_at, started_at, finished_at"
+)
+
+JOB_INSERT = register("job_insert", f"""
+    insert into public.jobs (tipo, params, usuario_id)
+    values (:t, :p, :uid)
+    returning {_JOB_COLUMNS}
+""", t=String(), p=JSONB(), uid=UUID(as_uuid=False))
+
+JOB_BY_ID = register("job_by_id", f"""
+    select {_JOB_COLUMNS} from public.jobs where id = :id
+""", id=UUID(as_uuid=False))
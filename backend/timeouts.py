@@ -0,0 +1,122 @@
+"""Per-endpoint statement timeouts and an overall request deadline.
+
+Every request gets a deadline REQUEST_DEADLINE_MS from its start. The first
+statement of each transaction it runs is prefixed with
+``SET LOCAL statement_timeout`` set to the endpoint's budget, capped by the
+time left before the deadline. The prefix rides in the same round trip as
+the statement. Budgets come from ``@statement_timeout(ms)`` on the view,
+overridden by STATEMENT_TIMEOUTS ("orders.list_orders=2000,login=3000"), or
+default to DB_STATEMENT_TIMEOUT_MS.
+
+A cancelled statement (SQLSTATE 57014, raised as StatementTimeout) or an
+exhausted deadline answers 503 with Retry-After instead of a 500; both are
+counted per endpoint in db_timeouts_total.
+"""
+import time
+
+from flask import current_app, g, has_request_context, jsonify, request
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+
+import metrics
+
+QUERY_CANCELED = "57014"
+
+TIMEOUTS = metrics.counter(
+    "db_timeouts_total", "Requests cut short by a statement timeout or the request deadline.",
+    ("endpoint", "kind"))
+
+
+class DeadlineExceeded(Exception):
+    """The request ran out of time before its next statement."""
+
+
+class StatementTimeout(OperationalError):
+    """Postgres cancelled a statement that outran its statement_timeout."""
+
+
+def statement_timeout(ms):
+    def decorate(fn):
+        fn.statement_timeout_ms = ms
+        return fn
+    return decorate
+
+
+def budget_ms(app, endpoint):
+    overrides = app.config["STATEMENT_TIMEOUTS"]
+    if endpoint in overrides:
+        return overrides[endpoint]
+    ms = getattr(app.view_functions.get(endpoint), "statement_timeout_ms", None)
+    return ms if ms is not None else app.config["DB_STATEMENT_TIMEOUT_MS"]
+
+
+def _timeout_for_request():
+    """Milliseconds for the next transaction, or None outside a timed request."""
+    if not has_request_context():
+        return None
+    deadline = g.get("deadline")
+    if deadline is None:
+        return None
+    remaining = int((deadline - time.perf_counter()) * 1000)
+    if remaining <= 0:
+        raise DeadlineExceeded()
+    return min(budget_ms(current_app, request.endpoint), remaining)
+
+
+# ---- Engine hooks -----------------------------------------------------------
+
+def instrument_engine(engine):
+    @event.listens_for(engine, "begin")
+    def _on_begin(conn):
+        conn.info["timeout_pending"] = True
+
+    @event.listens_for(engine, "before_cursor_execute", retval=True)
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        if not conn.info.pop("timeout_pending", False):
+            return statement, parameters
+        ms = _timeout_for_request()
+        if ms is None:
+            return statement, parameters
+        set_local = f"set local statement_timeout = {int(ms)}"
+        if getattr(cursor, "name", None):
+            # Server-side cursor: DECLARE can't wrap two statements
+            with conn.connection.dbapi_connection.cursor() as plain:
+                plain.execute(set_local)
+            return statement, parameters
+        return f"{set_local}; {statement}", parameters
+
+    @event.listens_for(engine, "handle_error")
+    def _on_error(ctx):
+        if getattr(ctx.original_exception, "pgcode", None) == QUERY_CANCELED:
+            return StatementTimeout(ctx.statement, ctx.parameters, ctx.original_exception)
+        return None
+
+    return engine
+
+
+# ---- Request hooks ----------------------------------------------------------
+
+def init_app(app):
+    app.before_request(_start_deadline)
+    app.register_error_handler(DeadlineExceeded, _deadline_exceeded)
+    app.register_error_handler(StatementTimeout, _statement_timeout)
+
+
+def _start_deadline():
+    g.deadline = time.perf_counter() + current_app.config["REQUEST_DEADLINE_MS"] / 1000.0
+
+
+def _unavailable(kind):
+    TIMEOUTS.inc((request.endpoint or "unmatched", kind))
+    resp = jsonify({"error": "La consulta tardó demasiado, intente de nuevo"})
+    resp.status_code = 503
+    resp.headers["Retry-After"] = str(current_app.config["TIMEOUT_RETRY_AFTER"])
+    return resp
+
+
+def _deadline_exceeded(e):
+    return _unavailable("deadline")
+
+
+def _statement_timeout(e):
+    return _unavailable("statement_timeout")
@@ -0,0 +1,80 @@
+"""Per-worker cache of (user, prefs) by user id, for /me and login.
+
+login fills the cache. update_prefs and admin user creation write through
+to it, and admin_delete_user drops the user. The prefs and delete
+statements also notify the other workers, which evict that user
+(cachebus.py). Entries still expire after USER_CACHE_TTL_SECONDS, which
+bounds staleness while the bus is down. Size is capped at USER_CACHE_SIZE,
+least recently used first.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+
+import cachebus
+import metrics
+
+LOOKUPS = metrics.counter("user_cache_lookups_total", "/me cache lookups, by result.", ("result",))
+
+_entries = OrderedDict()  # user id -> (expires_at, user, prefs)
+_lock = threading.Lock()
+
+
+def _key(user_id):
+    return str(user_id)
+
+
+def get(user_id):
+    """(user, prefs) or None on a miss or an expired entry."""
+    key = _key(user_id)
+    now = time.monotonic()
+    with _lock:
+        hit = _entries.get(key)
+        if hit is not None and hit[0] > now:
+            _entries.move_to_end(key)
+            LOOKUPS.inc(("hit",))
+            return hit[1], hit[2]
+        _entries.pop(key, None)
+    LOOKUPS.inc(("miss",))
+    return None
+
+
+def put(user, prefs):
+    cfg = current_app.config
+    if cfg["USER_CACHE_SIZE"] <= 0:
+        return
+    key = _key(user["id"])
+    entry = (time.monotonic() + cfg["USER_CACHE_TTL_SECONDS"], dict(user), prefs)
+    with _lock:
+        _entries[key] = entry
+        _entries.move_to_end(key)
+        while len(_entries) > cfg["USER_CACHE_SIZE"]:
+            _entries.popitem(last=False)
+
+
+def update_prefs(user_id, prefs):
+    """Write-through for a prefs change; a user not cached here stays uncached."""
+    with _lock:
+        hit = _entries.get(_key(user_id))
+        if hit is not None:
+            _entries[_key(user_id)] = (hit[0], hit[1], prefs)
+
+
+def invalidate(user_id):
+    with _lock:
+        _entries.pop(_key(user_id), None)
+
+
+def clear():
+    with _lock:
+        _entries.clear()
+
+
+@cachebus.subscribe
+def _on_bus(scope, key):
+    if scope is None or (scope == "users" and key is None):
+        clear()
+    elif scope == "users":
+        invalidate(key)
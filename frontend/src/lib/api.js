@@ -21,6 +21,21 @@ export function detectApiBase() {
   return envBase || locBase || localBase
 }
 
+// Read-your-writes: the API answers a write with an X-Write-Token that
+// expires with the replica-lag window. Sending the latest one back keeps this
+// user's reads on the primary until then, whichever worker serves them.
+const WRITE_TOKEN_HEADER = 'X-Write-Token'
+let writeToken = null
+
+export function writeTokenHeaders() {
+  return writeToken ? { [WRITE_TOKEN_HEADER]: writeToken } : {}
+}
+
+function rememberWriteToken(res) {
+  const t = res.headers.get(WRITE_TOKEN_HEADER)
+  if (t) writeToken = t
+}
+
 export function useAuthedFetch() {
   const { token } = useAuth()
   const base = detectApiBase()
@@ -44,7 +59,7 @@ export function useAuthedFetch() {
         throw new Error(`authedFetch: 'path' must start with '/'. Got: ${path}`)
       }
       const url = base + path
-      const headers = { 'Content-Type': 'application/json', ...(opts.headers || {}) }
+      const headers = { 'Content-Type': 'application/json', ...writeTokenHeaders(), ...(opts.headers || {}) }
       if (token) headers.Authorization = `Bearer ${token}`
 
       if (import.meta.env.DEV || import.meta.env.VITE_DEBUG === '1') {
@@ -56,6 +71,7 @@ export function useAuthedFetch() {
         headers,
         credentials: 'omit', // we use tokens, not cookies
       })
+      rememberWriteToken(res)
 
       const ct = res.headers.get('content-type') || ''
       if (!ct.includes('application/json')) {
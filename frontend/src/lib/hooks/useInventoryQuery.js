@@ -1,5 +1,6 @@
 import { useQuery } from '@tanstack/react-query'
 import { useAuth } from '../../contexts/AuthContext'
+import { writeTokenHeaders } from '../api'
 
 function getApiBase() {
   const base = import.meta.env.VITE_API_URL || ''
@@ -13,6 +14,7 @@ async function fetchJson(path, { signal, onUnauthorized } = {}) {
     method: 'GET',
     headers: {
       'Content-Type': 'application/json',
+      ...writeTokenHeaders(),
       ...(token ? { Authorization: `Bearer ${token}` } : {})
     },
     signal
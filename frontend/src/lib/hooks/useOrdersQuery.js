@@ -1,5 +1,6 @@
 import { useQuery } from '@tanstack/react-query'
 import { useAuth } from '../../contexts/AuthContext'
+import { writeTokenHeaders } from '../api'
 
 function getApiBase() {
   const base = import.meta.env.VITE_API_URL || ''
@@ -12,6 +13,7 @@ async function fetchJson(path, { signal, onUnauthorized } = {}) {
   const res = await fetch(url, {
     headers: {
       'Content-Type': 'application/json',
+      ...writeTokenHeaders(),
       ...(token ? { Authorization: `Bearer ${token}` } : {})
     },
     signal
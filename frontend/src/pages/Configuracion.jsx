@@ -1,4 +1,4 @@
-import React, { useEffect, useMemo, useRef, useState } from 'react'
+import React, { useEffect, useRef, useState } from 'react'
 import {
   Box, Heading, Text, Stack, HStack, VStack, Tabs, TabList, TabPanels, TabPanel, Tab,
   Badge, useColorModeValue, Button, IconButton, Input, InputGroup, InputLeftElement,
@@ -34,6 +34,8 @@ function AccentTab({ label, underline, disabled=false }) {
   )
 }
 
+const USERS_PAGE_SIZE = 25
+
 function fmtDateTimeISO(s){
   if(!s) return '—'
   try{
@@ -68,43 +70,55 @@ export default function Configuracion(){
   // tabs
   const [tabIndex, setTabIndex] = useState(0)
 
-  // users state
+  // users state: one server-side page at a time (keyset cursor), searched on the server
   const [users, setUsers] = useState([])
+  const [nextCursor, setNextCursor] = useState(null)
   const [loadingUsers, setLoadingUsers] = useState(false)
+  const [loadingMore, setLoadingMore] = useState(false)
   const [query, setQuery] = useState('')
+  const usersReq = useRef(0) // ignore responses to superseded searches
 
   const headingRef = useRef(null)
   useEffect(() => { if (headingRef.current) headingRef.current.focus() }, [])
 
-  async function loadUsers(){
+  async function loadUsers({ cursor = null } = {}){
     if (!canManage) return
-    setLoadingUsers(true)
+    const append = Boolean(cursor)
+    const req = ++usersReq.current
+    // This request supersedes any in flight, whose finally won't reset its flag
+    setLoadingMore(append)
+    setLoadingUsers(!append)
     try {
-      const data = await authedFetchJson('/admin/users')
-      setUsers(Array.isArray(data) ? data : [])
+      const params = new URLSearchParams({ limit: String(USERS_PAGE_SIZE) })
+      const q = query.trim()
+      if (q) params.set('q', q)
+      if (cursor) params.set('cursor', cursor)
+      const data = await authedFetchJson(`/admin/users?${params}`)
+      if (req !== usersReq.current) return
+      const items = Array.isArray(data?.items) ? data.items : []
+      setUsers(prev => append ? [...prev, ...items] : items)
+      setNextCursor(data?.next_cursor || null)
     } catch(err){
+      if (req !== usersReq.current) return
       toast({
         status:'error',
         title:'No se pudieron cargar los usuarios',
         description: String(err?.message || err)
       })
     } finally {
-      setLoadingUsers(false)
+      if (req === usersReq.current) {
+        setLoadingMore(false)
+        setLoadingUsers(false)
+      }
     }
   }
 
-  // load when entering the Usuarios tab
-  useEffect(() => { if (tabIndex === 1) loadUsers() }, [tabIndex, canManage]) // 0: General, 1: Usuarios
-
-  const filtered = useMemo(() => {
-    const q = (query||'').toLowerCase()
-    if (!q) return users
-    return users.filter(u =>
-      (u.nombre_completo||'').toLowerCase().includes(q) ||
-      (u.email||'').toLowerCase().includes(q) ||
-      (u.profile||'').toLowerCase().includes(q)
-    )
-  }, [users, query])
+  // load when entering the Usuarios tab, and again (debounced) as the search changes
+  useEffect(() => {
+    if (tabIndex !== 1) return // 0: General, 1: Usuarios
+    const t = setTimeout(() => { loadUsers() }, query ? 300 : 0)
+    return () => clearTimeout(t)
+  }, [tabIndex, canManage, query])
 
   // add user modal
   const [adding, setAdding] = useState(false)
@@ -258,7 +272,7 @@ export default function Configuracion(){
                   </Stack>
                 ) : (
                   <Stack spacing="3">
-                    {filtered.map(u => {
+                    {users.map(u => {
                       const asProp = isAdmin ? Link : undefined
                       const toProp = isAdmin ? `/configuracion/usuarios/${u.id}` : undefined
                       return (
@@ -317,11 +331,23 @@ export default function Configuracion(){
                       )
                     })}
 
-                    {filtered.length === 0 && (
+                    {users.length === 0 && (
                       <Box borderWidth="1px" rounded="md" p="10" textAlign="center" color={muted}>
-                        {users.length === 0 ? 'No hay usuarios.' : 'Sin resultados para tu búsqueda.'}
+                        {query.trim() ? 'Sin resultados para tu búsqueda.' : 'No hay usuarios.'}
                       </Box>
                     )}
+
+                    {nextCursor && (
+                      <Button
+                        variant="outline"
+                        alignSelf="center"
+                        onClick={()=>loadUsers({ cursor: nextCursor })}
+                        isLoading={loadingMore}
+                        loadingText="Cargando"
+                      >
+                        Cargar más
+                      </Button>
+                    )}
                   </Stack>
                 )}
               </Box>